@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the plugin's API commands
+Drives TapoP110Plugin.on_api_command, directly and optionally over HTTP, against
+a simulated plug and measures per-command latency (p50/p95/p99), connect and
+reconnect cost, throughput with concurrent clients and the overhead of the
+monitoring thread. Results are written as JSON; pass an earlier result file as
+--baseline to flag regressions between releases
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+import flask
+from octoprint.plugin import PluginSettings
+from octoprint.settings import settings as octoprint_settings
+
+import octoprint_tapo_p110
+from octoprint_tapo_p110 import simulator
+
+IDENTIFIER = "tapo_p110"
+
+# label: (command, data), every read forced unless it is meant to hit the cache
+COMMANDS = [
+    ("get_status (cached)", "get_status", {}),
+    ("get_status", "get_status", {"force": True}),
+    ("get_energy", "get_energy", {"force": True}),
+    ("get_snapshot", "get_snapshot", {"force": True}),
+    ("turn_on", "turn_on", {"async": False}),
+    ("turn_off", "turn_off", {"async": False}),
+    ("toggle", "toggle", {"async": False}),
+    ("turn_on (async accept)", "turn_on", {"async": True}),
+    ("get_history", "get_history", {}),
+    ("get_devices", "get_devices", {}),
+    ("get_stats", "get_stats", {}),
+    ("get_job_energy", "get_job_energy", {}),
+    ("get_scheduled_actions", "get_scheduled_actions", {}),
+]
+
+# What each throughput client sends: mostly cached reads, like browsers refreshing
+THROUGHPUT_MIX = [("get_status", {})] * 4 + [("get_energy", {})] * 4 + [("get_status", {"force": True})] * 2
+
+CLIENT_COUNTS = [1, 2, 4, 8, 16]
+
+# Longest wait for background jobs to finish between phases
+SETTLE_TIMEOUT = 30.0
+
+
+class Printer:
+    """Stands in for OctoPrint's printer, idle and cold"""
+
+    def is_printing(self):
+        return False
+
+    def get_current_temperatures(self):
+        return {}
+
+
+class PluginManager:
+    """Stands in for OctoPrint's plugin manager, counting push messages"""
+
+    def __init__(self):
+        self.messages = 0
+
+    def send_plugin_message(self, identifier, data):
+        self.messages += 1
+
+
+def make_plugin(folder, plug, address, transport):
+    """A plugin instance set up like OctoPrint would, talking to the simulated plug"""
+    settings = octoprint_settings(init=True, basedir=os.path.join(folder, "octoprint"))
+    plugin = octoprint_tapo_p110.TapoP110Plugin()
+    plugin._identifier = IDENTIFIER
+    plugin._plugin_version = "benchmark"
+    plugin._settings = PluginSettings(settings, IDENTIFIER, defaults=plugin.get_settings_defaults())
+    plugin._logger = logging.getLogger("benchmark.plugin")
+    plugin._plugin_manager = PluginManager()
+    plugin._printer = Printer()
+    plugin.get_plugin_data_folder = lambda: os.path.join(folder, "data")
+    os.makedirs(plugin.get_plugin_data_folder(), exist_ok=True)
+
+    plugin._settings.set(["device_ip"], address)
+    plugin._settings.set(["username"], simulator.DEFAULT_EMAIL)
+    plugin._settings.set(["password"], simulator.DEFAULT_PASSWORD)
+    plugin._settings.set(["enable_energy_monitoring"], True)
+    plugin.initialize()
+
+    if transport == "inprocess":
+        # Same plug state, but no HTTP or crypto between plugin and plug
+        client_class = simulator.client_class(plug)
+        plugin.library.get_client_class = lambda: client_class
+    return plugin
+
+
+class DirectClient:
+    """Calls on_api_command in-process, the way OctoPrint's API blueprint does"""
+
+    def __init__(self, plugin, app):
+        self.plugin = plugin
+        self.app = app
+
+    def call(self, command, data):
+        with self.app.app_context():
+            response = self.plugin.on_api_command(command, dict(data))
+            return getattr(response, "status_code", 200), response.get_json(silent=True)
+
+
+class HttpClient:
+    """Sends the command as a JSON POST to the plugin's API endpoint"""
+
+    def __init__(self, url):
+        import requests
+        self.url = url
+        self.session = requests.Session()
+
+    def call(self, command, data):
+        response = self.session.post(self.url, json=dict(data, command=command))
+        return response.status_code, response.json()
+
+
+def make_api_app(plugin):
+    """Flask app serving the plugin's SimpleApi commands like OctoPrint's /api/plugin/<identifier>"""
+    app = flask.Flask("benchmark")
+    commands = plugin.get_api_commands()
+
+    @app.route(f"/api/plugin/{IDENTIFIER}", methods=["POST"])
+    def api():
+        data = flask.request.get_json(silent=True) or {}
+        command = data.get("command")
+        if command not in commands:
+            return flask.make_response("Unknown command", 400)
+        if any(parameter not in data for parameter in commands[command]):
+            return flask.make_response("Missing parameters", 400)
+        return plugin.on_api_command(command, data) or flask.make_response("", 204)
+
+    return app
+
+
+def serve_api(app):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name="benchmark_api", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/api/plugin/{IDENTIFIER}"
+
+
+def summarize(samples, errors=0):
+    """Latency percentiles in milliseconds"""
+    ordered = sorted(samples)
+    if not ordered:
+        return dict(count=0, errors=errors)
+
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] * 1000
+
+    return dict(count=len(ordered), errors=errors,
+                min=ordered[0] * 1000, p50=percentile(0.5), p95=percentile(0.95), p99=percentile(0.99),
+                max=ordered[-1] * 1000, mean=sum(ordered) / len(ordered) * 1000)
+
+
+def timed(client, command, data):
+    """Seconds the command took and whether it succeeded, device errors are answered with 200"""
+    start = time.perf_counter()
+    status, body = client.call(command, data)
+    return time.perf_counter() - start, status < 400 and not (body or {}).get("error")
+
+
+def settle(plugin):
+    """Let background jobs finish and close the breakers, so no phase inherits the previous one's load or faults"""
+    deadline = time.monotonic() + SETTLE_TIMEOUT
+    while any(not job.done for job in plugin.jobs.list()) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    for device in plugin._get_devices():
+        device.breaker.reset()
+
+
+##~~ Benchmarks
+
+def bench_commands(client, iterations):
+    results = {}
+    for label, command, data in COMMANDS:
+        client.call(command, data)  # warm up
+        samples, errors = [], 0
+        for _ in range(iterations):
+            elapsed, ok = timed(client, command, data)
+            samples.append(elapsed)
+            errors += not ok
+        results[label] = summarize(samples, errors)
+    return results
+
+
+def bench_connect(plugin, plug, client, iterations):
+    """Fresh sessions, and recovery from a session the plug expired"""
+    device = plugin._get_device()
+    connects = []
+    for _ in range(iterations):
+        device.disconnect()
+        start = time.perf_counter()
+        device.connect()
+        connects.append(time.perf_counter() - start)
+
+    failed, reconnects, errors = [], [], 0
+    for _ in range(iterations):
+        device.connect()
+        plug.inject(simulator.FAULT_SESSION_EXPIRED)
+        # The call hitting the expired session fails and drops it, the next one reconnects
+        elapsed, _ = timed(client, "get_status", {"force": True})
+        failed.append(elapsed)
+        elapsed, ok = timed(client, "get_status", {"force": True})
+        reconnects.append(elapsed)
+        errors += not ok
+    return dict(connect=summarize(connects), expired_call=summarize(failed),
+                reconnect=summarize(reconnects, errors))
+
+
+def bench_throughput(make_client, clients, duration):
+    samples, errors = [], [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def run():
+        client = make_client()
+        local, failed = [], 0
+        while time.perf_counter() < stop_at:
+            command, data = random.choice(THROUGHPUT_MIX)
+            elapsed, ok = timed(client, command, data)
+            local.append(elapsed)
+            failed += not ok
+        with lock:
+            samples.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=run, name=f"benchmark_client_{index}") for index in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    result = summarize(samples, errors[0])
+    result.update(clients=clients, requests_per_second=len(samples) / elapsed)
+    return result
+
+
+def bench_monitor(plugin, plug, client, duration, interval):
+    """CPU time and request latency with and without the monitoring thread running"""
+    plugin._settings.set(["energy_update_interval"], interval)
+    plugin._settings.set(["poll_interval_off"], interval)
+
+    def window():
+        # CPU while nothing but the monitor (if running) is busy, then latency next to it
+        requests = sum(plug.requests.values())
+        messages = plugin._plugin_manager.messages
+        cpu, wall = time.process_time(), time.perf_counter()
+        time.sleep(duration)
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+        requests = sum(plug.requests.values()) - requests
+        messages = plugin._plugin_manager.messages - messages
+
+        samples, errors = [], 0
+        for _ in range(200):
+            elapsed, ok = timed(client, "get_status", {})
+            samples.append(elapsed)
+            errors += not ok
+            time.sleep(0.005)
+        return dict(cpu_percent=cpu / wall * 100, cpu_seconds=cpu, plug_requests=requests,
+                    push_messages=messages, cached_get_status=summarize(samples, errors))
+
+    idle = window()
+    plugin._start_monitoring()
+    try:
+        monitored = window()
+    finally:
+        plugin.polling.stop()
+
+    overhead = max(0.0, monitored["cpu_seconds"] - idle["cpu_seconds"])
+    monitored.update(
+        cpu_overhead_percent=monitored["cpu_percent"] - idle["cpu_percent"],
+        plug_requests_per_second=monitored["plug_requests"] / duration,
+        cpu_ms_per_plug_request=overhead / max(1, monitored["plug_requests"]) * 1000
+    )
+    return dict(poll_interval=interval, idle=idle, monitored=monitored)
+
+
+##~~ Reporting
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, universal_newlines=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_latencies(title, results):
+    print(f"{title:<28} {'p50':>9} {'p95':>9} {'p99':>9} {'errors':>7}")
+    for label, stats in results.items():
+        if stats["count"]:
+            print(f"{label:<28} {stats['p50']:>7.2f}ms {stats['p95']:>7.2f}ms {stats['p99']:>7.2f}ms {stats['errors']:>7}")
+    print()
+
+
+def failures(results):
+    """Phases with failed requests: their timings measure errors, not the plugin"""
+    found = []
+    for transport, commands in results["commands"].items():
+        found.extend((f"{transport} {label}", stats["errors"]) for label, stats in commands.items())
+    found.append(("reconnect", results["connect"]["reconnect"]["errors"]))
+    for transport, runs in results["throughput"].items():
+        found.extend((f"{transport} {run['clients']} clients", run["errors"]) for run in runs)
+    for window in ("idle", "monitored"):
+        found.append((f"{window} cached get_status", results["monitor"][window]["cached_get_status"]["errors"]))
+    return [(label, errors) for label, errors in found if errors]
+
+
+def compare(results, baseline, tolerance):
+    """Latencies whose p95 or throughputs that got worse than tolerance allows, and phases with errors"""
+    regressions = [f"{label}: {errors} error(s)" for label, errors in failures(results)]
+    for transport, commands in results["commands"].items():
+        for label, stats in commands.items():
+            before = baseline.get("commands", {}).get(transport, {}).get(label)
+            if before and before.get("p95") and stats.get("p95") and stats["p95"] > before["p95"] * (1 + tolerance):
+                regressions.append(f"{transport} {label}: p95 {before['p95']:.2f}ms -> {stats['p95']:.2f}ms")
+    for transport, runs in results["throughput"].items():
+        before = dict((run["clients"], run) for run in baseline.get("throughput", {}).get(transport, []))
+        for run in runs:
+            old = before.get(run["clients"])
+            if old and run["requests_per_second"] < old["requests_per_second"] * (1 - tolerance):
+                regressions.append(f"{transport} {run['clients']} clients: {old['requests_per_second']:.0f} -> "
+                                   f"{run['requests_per_second']:.0f} req/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--transport", choices=["inprocess", "http"], default="inprocess",
+                        help="talk to the simulated plug in-process or over HTTP through PyP100")
+    parser.add_argument("--http-api", action="store_true", help="also send the commands through an HTTP API endpoint")
+    parser.add_argument("--rtt", type=float, default=0.02, help="simulated plug round-trip time in seconds")
+    parser.add_argument("--jitter", type=float, default=0.2, help="round-trip time variation, 0.2 is +/-20%%")
+    parser.add_argument("--iterations", type=int, default=50, help="calls per command")
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds per throughput and monitor run")
+    parser.add_argument("--clients", type=int, nargs="+", default=CLIENT_COUNTS, help="concurrent client counts")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="monitoring interval during the overhead run")
+    parser.add_argument("--output", default="benchmark_commands.json", help="where to write the JSON results")
+    parser.add_argument("--baseline", help="earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before flagging a regression")
+    args = parser.parse_args()
+
+    logging.getLogger("benchmark").addHandler(logging.NullHandler())
+    logging.getLogger("benchmark").propagate = False
+
+    folder = tempfile.mkdtemp(prefix="tapo_benchmark_")
+    plug = simulator.SimulatedPlug(power_curve=simulator.printer_curve(), latency=args.rtt, jitter=args.jitter)
+    server = simulator.SimulatorServer(plug).start()
+    try:
+        plugin = make_plugin(folder, plug, server.address, args.transport)
+        app = make_api_app(plugin)
+        transports = dict(api=lambda: DirectClient(plugin, app))
+        api_server = None
+        if args.http_api:
+            api_server, url = serve_api(app)
+            transports["http"] = lambda: HttpClient(url)
+
+        print("⏱️  API Command Benchmark")
+        print("=" * 60)
+        print(f"Plug: {args.transport}, RTT {args.rtt * 1000:.0f} ms ±{args.jitter * 100:.0f}%, "
+              f"{args.iterations} calls per command")
+        print()
+
+        results = dict(
+            meta=dict(timestamp=time.time(), revision=git_revision(), python=platform.python_version(),
+                      platform=platform.platform(), transport=args.transport, rtt=args.rtt, jitter=args.jitter,
+                      iterations=args.iterations, duration=args.duration),
+            commands={}, throughput={}
+        )
+
+        for name, make_client in transports.items():
+            settle(plugin)
+            results["commands"][name] = bench_commands(make_client(), args.iterations)
+            print_latencies(f"Commands ({name})", results["commands"][name])
+
+        settle(plugin)
+        results["connect"] = bench_connect(plugin, plug, transports["api"](), max(5, args.iterations // 5))
+        print_latencies("Connection", results["connect"])
+
+        for name, make_client in transports.items():
+            print(f"Throughput ({name}) {'clients':>10} {'req/s':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'errors':>7}")
+            runs = results["throughput"][name] = []
+            for clients in args.clients:
+                settle(plugin)
+                run = bench_throughput(make_client, clients, args.duration)
+                runs.append(run)
+                print(f"{'':<17} {clients:>10} {run['requests_per_second']:>9.0f} {run['p50']:>7.2f}ms "
+                      f"{run['p95']:>7.2f}ms {run['p99']:>7.2f}ms {run['errors']:>7}")
+            print()
+
+        settle(plugin)
+        monitor = results["monitor"] = bench_monitor(plugin, plug, transports["api"](), args.duration,
+                                                     args.poll_interval)
+        print(f"Monitoring every {args.poll_interval:.1f}s: "
+              f"{monitor['monitored']['cpu_overhead_percent']:+.2f}% CPU, "
+              f"{monitor['monitored']['plug_requests_per_second']:.1f} plug requests/s "
+              f"({monitor['monitored']['cpu_ms_per_plug_request']:.2f}ms CPU each), "
+              f"cached get_status p95 {monitor['idle']['cached_get_status']['p95']:.2f}ms idle vs "
+              f"{monitor['monitored']['cached_get_status']['p95']:.2f}ms monitored")
+
+        if api_server is not None:
+            api_server.shutdown()
+        plugin.on_shutdown()
+    finally:
+        server.stop()
+        shutil.rmtree(folder, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"\n📄 Results written to {args.output}")
+
+    failed = failures(results)
+    if failed:
+        print(f"❌ {sum(errors for _, errors in failed)} request(s) failed, these timings are not representative:")
+        for label, errors in failed:
+            print(f"   {label}: {errors} error(s)")
+        return 1
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) beyond {args.tolerance * 100:.0f}%:")
+            for regression in regressions:
+                print(f"   {regression}")
+            return 1
+        print(f"✅ No regressions beyond {args.tolerance * 100:.0f}% against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
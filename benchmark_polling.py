@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Benchmark for multi-plug polling
+Measures how long one refresh of all plugs takes as the number of plugs grows,
+driving the plugin's own poll (device reads, cache, push messages and power
+history) against simulated plugs with a fixed round-trip time (no real devices needed)
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from octoprint.plugin import PluginSettings
+from octoprint.settings import settings as octoprint_settings
+
+from benchmark_commands import IDENTIFIER, Printer, PluginManager
+from octoprint_tapo_p110 import simulator
+from octoprint_tapo_p110.cache import GROUP_ENERGY
+from octoprint_tapo_p110.plugin import TapoP110Plugin
+from octoprint_tapo_p110.polling import PollingEngine
+
+PLUG_COUNTS = [1, 2, 4, 8, 16, 32]
+
+
+def make_plugin(settings, folder, count, rtt, jitter):
+    """A plugin with count plugs, each backed by a simulated P110 listening on localhost so the
+    connection probe finds it. Sessions talk to the simulated plug in-process, one RTT per request.
+    """
+    plugs, servers = {}, []
+    for index in range(count):
+        plug = simulator.SimulatedPlug(device_on=True, power_curve=simulator.printer_curve(),
+                                       latency=rtt, jitter=jitter)
+        server = simulator.SimulatorServer(plug).start()
+        plugs[server.address] = simulator.client_class(plug)
+        servers.append(server)
+
+    plugin = TapoP110Plugin()
+    plugin._identifier = IDENTIFIER
+    plugin._plugin_version = "benchmark"
+    plugin._settings = PluginSettings(settings, IDENTIFIER, defaults=plugin.get_settings_defaults())
+    plugin._logger = logging.getLogger("benchmark.plugin")
+    plugin._plugin_manager = PluginManager()
+    plugin._printer = Printer()
+    plugin.get_plugin_data_folder = lambda: os.path.join(folder, "data")
+    os.makedirs(plugin.get_plugin_data_folder(), exist_ok=True)
+
+    plugin._settings.set(["device_ip"], "")
+    plugin._settings.set(["devices"], [dict(id=f"plug{index}", ip=server.address)
+                                       for index, server in enumerate(servers)])
+    plugin._settings.set(["username"], simulator.DEFAULT_EMAIL)
+    plugin._settings.set(["password"], simulator.DEFAULT_PASSWORD)
+    plugin._settings.set(["enable_energy_monitoring"], True)
+    plugin._settings.set(["auto_rediscover"], False)
+    plugin.initialize()
+    # Every plug gets the client of its own simulated P110
+    client = lambda address, email, password: plugs[address](address, email, password)
+    plugin.library.get_client_class = lambda: client
+
+    for device in plugin._get_devices():
+        if not device.connect():
+            raise RuntimeError(f"Could not connect to simulated plug {device.id}: {device.last_error}")
+    return plugin, servers
+
+
+def refresh(plugin, run):
+    """Seconds one refresh of every plug took, raising if a plug didn't answer so a failed refresh is never timed"""
+    devices = plugin._get_devices()
+    # Start every round from cold caches: each poll reads status and energy from the plug
+    for device in devices:
+        device.cache.invalidate()
+    start = time.monotonic()
+    run(devices)
+    elapsed = time.monotonic() - start
+
+    for device in devices:
+        energy = device.cache.snapshot(GROUP_ENERGY)
+        if energy is None or energy.timestamp < start:
+            raise RuntimeError(f"{device.id} did not answer: {device.last_error}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rtt", type=float, default=0.1, help="simulated round-trip time in seconds")
+    parser.add_argument("--jitter", type=float, default=0.2, help="round-trip time variation, 0.2 is +/-20%%")
+    parser.add_argument("--workers", type=int, default=32, help="polling worker pool size")
+    parser.add_argument("--rounds", type=int, default=5, help="refreshes per plug count")
+    args = parser.parse_args()
+
+    logging.getLogger("benchmark").addHandler(logging.NullHandler())
+    logging.getLogger("benchmark").propagate = False
+
+    print("⏱️  Polling Benchmark")
+    print("=" * 60)
+    print(f"Simulated RTT: {args.rtt * 1000:.0f} ms ±{args.jitter * 100:.0f}%, one batched read per plug, "
+          f"{args.workers} workers")
+    print()
+    print(f"{'plugs':>6} {'sequential':>12} {'concurrent':>12} {'speedup':>9} {'vs 1 plug':>10} {'pushes':>7}")
+
+    # OctoPrint's settings are initialised once per process, every plug count gets its own data folder
+    root = tempfile.mkdtemp(prefix="tapo_benchmark_")
+    settings = octoprint_settings(init=True, basedir=os.path.join(root, "octoprint"))
+    baseline = None
+    for count in PLUG_COUNTS:
+        folder = os.path.join(root, f"plugs{count}")
+        plugin, servers = make_plugin(settings, folder, count, args.rtt, args.jitter)
+        engine = PollingEngine(plugin._poll_device, lambda device: 60, args.workers, plugin._logger)
+        engine.set_devices(plugin._get_devices())
+        try:
+            sequential = statistics.median(
+                refresh(plugin, lambda devices: [plugin._poll_device(device) for device in devices])
+                for _ in range(args.rounds))
+            concurrent = statistics.median(
+                refresh(plugin, lambda devices: engine.poll_all()) for _ in range(args.rounds))
+            pushes = plugin._plugin_manager.messages
+        finally:
+            engine.stop(wait=True)
+            plugin.on_shutdown()
+            for server in servers:
+                server.stop()
+
+        if baseline is None:
+            baseline = concurrent
+        print(f"{count:>6} {sequential * 1000:>10.0f}ms {concurrent * 1000:>10.0f}ms "
+              f"{sequential / concurrent:>8.1f}x {concurrent / baseline:>9.2f}x {pushes:>7}")
+    shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the plugin's import cost
+Imports the plugin in fresh interpreters and measures how long the import
+takes on top of OctoPrint's own modules, checking that it neither imports
+PyP100 nor starts a subprocess (like a pip install) while doing so
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Runs in a fresh interpreter, prints the measurements as JSON
+PROBE = r"""
+import json, subprocess, sys, time
+sys.path.insert(0, {root!r})
+
+spawned = []
+def record(*args, **kwargs):
+    spawned.append(repr(args[0] if args else kwargs.get("args")))
+    raise OSError("subprocesses are disabled during the benchmark")
+subprocess.Popen = record
+
+start = time.perf_counter()
+import octoprint.plugin, flask
+octoprint_done = time.perf_counter()
+import octoprint_tapo_p110.plugin
+plugin_done = time.perf_counter()
+
+library = None
+if {load_library!r}:
+    import logging
+    from octoprint_tapo_p110.library import ClientLoader
+    loader = ClientLoader(logging.getLogger("benchmark"))
+    loader.get_client_class()
+    library = time.perf_counter() - plugin_done
+
+print(json.dumps(dict(
+    octoprint=octoprint_done - start,
+    plugin=plugin_done - octoprint_done,
+    library=library,
+    pyp100_imported="PyP100" in sys.modules and not {load_library!r},
+    spawned=spawned
+)))
+"""
+
+
+def measure(load_library):
+    code = PROBE.format(root=ROOT, load_library=load_library)
+    output = subprocess.check_output([sys.executable, "-c", code], universal_newlines=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=10, help="fresh interpreters per measurement")
+    args = parser.parse_args()
+
+    print("⏱️  Plugin Startup Benchmark")
+    print("=" * 60)
+    print(f"Python {sys.version.split()[0]}, {args.rounds} fresh interpreters each")
+    print()
+
+    runs = [measure(False) for _ in range(args.rounds)]
+    loaded = [measure(True) for _ in range(args.rounds)]
+
+    octoprint = statistics.median(run["octoprint"] for run in runs)
+    plugin = statistics.median(run["plugin"] for run in runs)
+    print(f"{'octoprint.plugin + flask import':<36} {octoprint * 1000:>8.1f}ms")
+    print(f"{'plugin import':<36} {plugin * 1000:>8.1f}ms")
+
+    library = [run["library"] for run in loaded if run["library"] is not None]
+    if library:
+        print(f"{'PyP100 on first device use':<36} {statistics.median(library) * 1000:>8.1f}ms")
+
+    print()
+    spawned = sorted(set(command for run in runs for command in run["spawned"]))
+    if any(run["pyp100_imported"] for run in runs):
+        print("❌ Importing the plugin imported PyP100")
+    else:
+        print("✅ PyP100 is not imported with the plugin")
+    if spawned:
+        print(f"❌ Importing the plugin started subprocesses: {', '.join(spawned)}")
+    else:
+        print("✅ No subprocess started while importing the plugin")
+    return 1 if spawned or any(run["pyp100_imported"] for run in runs) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
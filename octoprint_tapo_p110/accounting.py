@@ -0,0 +1,142 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import json
+import os
+import threading
+
+# Print results as reported by the ending event
+RESULT_DONE = "done"
+RESULT_FAILED = "failed"
+RESULT_CANCELLED = "cancelled"
+
+
+class PrintSession(object):
+    """Energy of one running print, integrated sample by sample.
+
+    Power between two samples is taken as the average of both (trapezoidal
+    rule). The first sample's power is assumed back to the print start and
+    the last one's up to the print end, so the whole print is covered.
+    """
+
+    def __init__(self, path, name, origin, device_id, started):
+        self.path = path
+        self.name = name
+        self.origin = origin
+        self.device = device_id
+        self.started = started
+        self.energy_ws = 0.0
+        self.peak_w = 0.0
+        self.samples = 0
+        self._last = None
+
+    def add(self, timestamp, watts):
+        if timestamp <= self.started:
+            return
+        if self._last is None:
+            self.energy_ws += watts * (timestamp - self.started)
+        else:
+            last_timestamp, last_watts = self._last
+            if timestamp <= last_timestamp:
+                return
+            self.energy_ws += (watts + last_watts) / 2.0 * (timestamp - last_timestamp)
+        self._last = (timestamp, watts)
+        self.peak_w = max(self.peak_w, watts)
+        self.samples += 1
+
+    def to_dict(self, now, result=None):
+        energy_ws = self.energy_ws
+        if self._last is not None and now > self._last[0]:
+            energy_ws += self._last[1] * (now - self._last[0])
+        duration = max(0.0, now - self.started)
+        return dict(
+            path=self.path,
+            name=self.name,
+            origin=self.origin,
+            device=self.device,
+            result=result,
+            started=self.started,
+            finished=now if result else None,
+            duration=round(duration, 1),
+            energy_wh=round(energy_ws / 3600.0, 4),
+            peak_w=round(self.peak_w, 2),
+            average_w=round(energy_ws / duration, 2) if duration else 0.0,
+            samples=self.samples
+        )
+
+
+class PrintEnergyLedger(object):
+    """Per-print energy figures, kept in a JSON file keyed by file path.
+
+    Every path stores the number of prints, their total energy and the
+    most recent max_runs results. The file is only rewritten when a print
+    ends, so queries never touch the power history.
+    """
+
+    def __init__(self, path, max_runs=20, logger=None):
+        self.path = path
+        self.max_runs = max_runs
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._session = None
+        self._jobs = self._load()
+
+    def start(self, path, name, origin, device_id, timestamp):
+        with self._lock:
+            self._session = PrintSession(path, name, origin, device_id, timestamp)
+
+    def add_sample(self, device_id, timestamp, watts):
+        with self._lock:
+            if self._session is not None and self._session.device == device_id:
+                self._session.add(timestamp, watts)
+
+    def finish(self, result, timestamp):
+        """End the running print and store its figures. Returns them, or None without a print"""
+        with self._lock:
+            session, self._session = self._session, None
+            if session is None:
+                return None
+
+            record = session.to_dict(timestamp, result)
+            job = self._jobs.setdefault(session.path, dict(prints=0, energy_wh=0.0, runs=[]))
+            job["prints"] += 1
+            job["energy_wh"] = round(job["energy_wh"] + record["energy_wh"], 4)
+            job["runs"].append(record)
+            del job["runs"][:-self.max_runs]
+            self._save()
+            return record
+
+    def active(self, now):
+        """Figures of the running print so far, or None"""
+        with self._lock:
+            return self._session.to_dict(now) if self._session is not None else None
+
+    def get(self, path=None):
+        with self._lock:
+            if path is not None:
+                job = self._jobs.get(path)
+                return json.loads(json.dumps(job)) if job is not None else None
+            return json.loads(json.dumps(self._jobs))
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            self._log_error(f"Could not read print energy from {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        temp = self.path + ".tmp"
+        try:
+            with open(temp, "w") as f:
+                json.dump(self._jobs, f)
+            os.replace(temp, self.path)
+        except (IOError, OSError) as e:
+            self._log_error(f"Could not write print energy to {self.path}: {e}")
+
+    def _log_error(self, message):
+        if self._logger is not None:
+            self._logger.error(message)
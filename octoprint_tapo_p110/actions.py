@@ -0,0 +1,174 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+
+ACTION_TURN_ON = "turn_on"
+ACTION_TURN_OFF = "turn_off"
+
+
+class PowerAction(object):
+    """A plug command to run at a given wall clock time"""
+
+    def __init__(self, device_id, action, due, reason=None, action_id=None, created=None):
+        self.id = action_id or uuid.uuid4().hex[:12]
+        self.device = device_id
+        self.action = action
+        self.due = due
+        self.reason = reason
+        self.created = created if created is not None else time.time()
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["device"], data["action"], float(data["due"]), reason=data.get("reason"),
+                   action_id=data.get("id"), created=data.get("created"))
+
+    def to_dict(self):
+        return dict(id=self.id, device=self.device, action=self.action, due=self.due,
+                    reason=self.reason, created=self.created)
+
+
+class PowerActionScheduler(object):
+    """Runs pending power actions from a priority queue on a single thread.
+
+    Pending actions are saved to a JSON file whenever they change, so they
+    survive a restart. An action is removed from the file before it runs:
+    a crash mid-action can lose it, but never run it twice. Actions that
+    fell due while OctoPrint was down run right after start.
+
+    execute(action) performs the action, on_change(actions) is called with
+    the pending actions whenever they change.
+    """
+
+    def __init__(self, path, execute, on_change=None, logger=None, clock=time.time):
+        self.path = path
+        self._execute = execute
+        self._on_change = on_change
+        self._logger = logger
+        self._clock = clock
+
+        self._condition = threading.Condition()
+        self._heap = []
+        self._actions = {}
+        self._sequence = itertools.count()
+        self._thread = None
+        self._stopped = False
+
+        for action in self._load():
+            self._push(action)
+
+    def schedule(self, device_id, action, delay, reason=None):
+        """Queue action for device_id in delay seconds and return it"""
+        entry = PowerAction(device_id, action, self._clock() + max(0.0, delay), reason=reason)
+        with self._condition:
+            self._push(entry)
+            self._save()
+            self._condition.notify()
+        self._notify()
+        return entry
+
+    def cancel(self, action_id):
+        """Cancel one pending action, returning it or None if there is no such action"""
+        with self._condition:
+            entry = self._actions.pop(action_id, None)
+            if entry is not None:
+                self._save()
+                self._condition.notify()
+        if entry is not None:
+            self._notify()
+        return entry
+
+    def cancel_matching(self, device_id=None, action=None):
+        """Cancel every pending action for device_id and/or of the given kind"""
+        with self._condition:
+            cancelled = [entry for entry in self._actions.values()
+                         if (device_id is None or entry.device == device_id)
+                         and (action is None or entry.action == action)]
+            for entry in cancelled:
+                del self._actions[entry.id]
+            if cancelled:
+                self._save()
+                self._condition.notify()
+        if cancelled:
+            self._notify()
+        return cancelled
+
+    def list(self):
+        """Pending actions, soonest first"""
+        with self._condition:
+            return sorted(self._actions.values(), key=lambda entry: entry.due)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="tapo_p110_actions", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def _push(self, entry):
+        self._actions[entry.id] = entry
+        heapq.heappush(self._heap, (entry.due, next(self._sequence), entry.id))
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                entry = None
+                while not self._stopped:
+                    # Cancelled actions stay in the heap until they come up
+                    while self._heap and self._heap[0][2] not in self._actions:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    remaining = self._heap[0][0] - self._clock()
+                    if remaining > 0:
+                        self._condition.wait(remaining)
+                        continue
+                    entry = self._actions.pop(heapq.heappop(self._heap)[2])
+                    self._save()
+                    break
+                if self._stopped:
+                    return
+
+            self._notify()
+            try:
+                self._execute(entry)
+            except Exception as e:
+                self._log_error(f"Scheduled {entry.action} of {entry.device} failed: {e}")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path) as f:
+                return [PowerAction.from_dict(data) for data in json.load(f)]
+        except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+            self._log_error(f"Could not read scheduled actions from {self.path}: {e}")
+            return []
+
+    def _save(self):
+        temp = self.path + ".tmp"
+        try:
+            with open(temp, "w") as f:
+                json.dump([entry.to_dict() for entry in self._actions.values()], f)
+            os.replace(temp, self.path)
+        except (IOError, OSError) as e:
+            self._log_error(f"Could not save scheduled actions to {self.path}: {e}")
+
+    def _notify(self):
+        if self._on_change is not None:
+            self._on_change(self.list())
+
+    def _log_error(self, message):
+        if self._logger is not None:
+            self._logger.error(message)
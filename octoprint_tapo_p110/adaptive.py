@@ -0,0 +1,147 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import math
+import threading
+import time
+
+# What the printer behind a plug is doing, from busiest to quietest
+ACTIVITY_PRINTING = "printing"
+ACTIVITY_HEATING = "heating"
+ACTIVITY_IDLE = "idle"
+
+# Smoothing of the power mean/variance estimate, per sample
+VARIANCE_ALPHA = 0.3
+
+# Coefficient of variation above which an idle plug is polled faster
+VARIANCE_THRESHOLD = 0.1
+
+
+class TokenBucket(object):
+    """Request budget: rate tokens per second, at most capacity saved up"""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+
+    def consume(self, tokens):
+        """Spend tokens. The balance may go negative, which delays the next poll"""
+        self._refill()
+        self._tokens -= tokens
+
+    def delay(self, tokens):
+        """Seconds until tokens are available"""
+        self._refill()
+        if self._tokens >= tokens or self.rate <= 0:
+            return 0.0
+        return (tokens - self._tokens) / self.rate
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class _DeviceSchedule(object):
+    def __init__(self, budget):
+        self.budget = budget
+        self.mean = None
+        self.variance = 0.0
+        self.cost = 1  # requests the last poll needed
+        self.interval = None
+        self.reason = None
+
+    def add_power(self, watts):
+        if self.mean is None:
+            self.mean = watts
+            return
+        # Exponentially weighted mean and variance
+        delta = watts - self.mean
+        self.mean += VARIANCE_ALPHA * delta
+        self.variance = (1 - VARIANCE_ALPHA) * (self.variance + VARIANCE_ALPHA * delta * delta)
+
+    def variation(self):
+        """Standard deviation relative to the mean power"""
+        if self.mean is None:
+            return 0.0
+        return math.sqrt(self.variance) / max(1.0, abs(self.mean))
+
+
+class AdaptiveSchedule(object):
+    """Picks each plug's next poll interval from what its printer is doing.
+
+    Printing or heating printers are sampled every active_interval seconds,
+    idle ones every idle_interval seconds, faster while their power keeps
+    changing, and switched-off plugs only every off_interval seconds. On
+    top of that every plug has a budget of requests per minute that no
+    interval may exceed.
+    """
+
+    def __init__(self, active_interval=2.0, idle_interval=30.0, off_interval=300.0, budget=60,
+                 clock=time.monotonic):
+        self.active_interval = active_interval
+        self.idle_interval = idle_interval
+        self.off_interval = off_interval
+        self.budget = budget
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._devices = {}
+
+    def configure(self, active_interval, idle_interval, off_interval, budget):
+        with self._lock:
+            self.active_interval = active_interval
+            self.idle_interval = idle_interval
+            self.off_interval = off_interval
+            if budget != self.budget:
+                self.budget = budget
+                self._devices = {}
+
+    def record_poll(self, device_id, requests, watts=None):
+        """Account for a finished poll: the requests it took and the power it read"""
+        with self._lock:
+            state = self._get(device_id)
+            state.cost = max(1, requests)
+            state.budget.consume(requests)
+            if watts is not None:
+                state.add_power(watts)
+
+    def interval(self, device_id, activity, plug_on=True):
+        """Seconds until the plug should be polled again"""
+        with self._lock:
+            state = self._get(device_id)
+            if not plug_on:
+                interval, reason = self.off_interval, "off"
+            elif activity in (ACTIVITY_PRINTING, ACTIVITY_HEATING):
+                interval, reason = self.active_interval, activity
+            else:
+                interval, reason = self.idle_interval, ACTIVITY_IDLE
+                variation = state.variation()
+                if variation > VARIANCE_THRESHOLD:
+                    # The more the power moves, the closer to the active rate
+                    interval = max(self.active_interval, interval * VARIANCE_THRESHOLD / variation)
+                    reason = "changing"
+
+            wait = state.budget.delay(state.cost)
+            if wait > interval:
+                interval, reason = wait, "budget"
+
+            state.interval = interval
+            state.reason = reason
+            return interval
+
+    def get_stats(self):
+        with self._lock:
+            return dict((device_id, dict(interval=round(state.interval, 1) if state.interval is not None else None,
+                                         reason=state.reason,
+                                         variation=round(state.variation(), 3)))
+                        for device_id, state in self._devices.items())
+
+    def _get(self, device_id):
+        state = self._devices.get(device_id)
+        if state is None:
+            budget = TokenBucket(self.budget / 60.0, max(1.0, self.budget / 6.0), clock=self._clock)
+            state = self._devices[device_id] = _DeviceSchedule(budget)
+        return state
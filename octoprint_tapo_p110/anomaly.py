@@ -0,0 +1,208 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import math
+import threading
+
+ANOMALY_OVERDRAW = "overdraw"          # heaters stuck near full power, possible thermal runaway
+ANOMALY_POWER_LOSS = "power_loss"      # power dropped to zero mid-print, PSU or heater failure
+ANOMALY_IDLE_HEATING = "idle_heating"  # drawing heater power with no print running
+
+ANOMALIES = (ANOMALY_OVERDRAW, ANOMALY_POWER_LOSS, ANOMALY_IDLE_HEATING)
+
+# What to do about an anomaly, each includes the ones before it
+ANOMALY_ACTION_NONE = "none"      # only log it
+ANOMALY_ACTION_EVENT = "event"    # fire an OctoPrint event and notify the UI
+ANOMALY_ACTION_PAUSE = "pause"    # also pause the print
+ANOMALY_ACTION_CUTOFF = "cutoff"  # also switch the plug off right away
+
+ANOMALY_ACTIONS = (ANOMALY_ACTION_NONE, ANOMALY_ACTION_EVENT, ANOMALY_ACTION_PAUSE, ANOMALY_ACTION_CUTOFF)
+
+
+class RollingStats(object):
+    """Exponentially weighted mean and variance over roughly the last window seconds.
+
+    Samples may arrive at any interval, each one is weighted by the time
+    since the previous one. Updating is O(1) and keeps no history.
+    """
+
+    __slots__ = ("window", "mean", "variance", "count", "_last")
+
+    def __init__(self, window=60.0):
+        self.window = window
+        self.mean = None
+        self.variance = 0.0
+        self.count = 0
+        self._last = None
+
+    def update(self, timestamp, value):
+        self.count += 1
+        if self.mean is None:
+            self.mean = value
+        else:
+            elapsed = max(0.0, timestamp - self._last)
+            alpha = 1.0 - math.exp(-elapsed / self.window) if self.window > 0 else 1.0
+            diff = value - self.mean
+            increment = alpha * diff
+            self.mean += increment
+            self.variance = (1.0 - alpha) * (self.variance + diff * increment)
+        self._last = timestamp
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+
+class Anomaly(object):
+    def __init__(self, kind, device_id, timestamp, watts, mean, std, rate, message):
+        self.kind = kind
+        self.device = device_id
+        self.timestamp = timestamp
+        self.watts = watts
+        self.mean = mean
+        self.std = std
+        self.rate = rate
+        self.message = message
+
+    def to_dict(self):
+        return dict(kind=self.kind, device=self.device, timestamp=self.timestamp, watts=self.watts,
+                    mean=round(self.mean, 1), std=round(self.std, 1), rate=round(self.rate, 1),
+                    message=self.message)
+
+
+class _DeviceState(object):
+    def __init__(self, window):
+        self.stats = RollingStats(window)
+        self.last_watts = None
+        self.last_time = None
+        self.rate = 0.0
+        self.peak = 0.0
+        self.over_since = None
+        self.idle_since = None
+        self.active = set()
+
+
+class PowerAnomalyDetector(object):
+    """Watches a plug's power samples for signs that the printer is in trouble.
+
+    Every sample updates a rolling mean and variance and the rate of change
+    in constant time, then three checks run against it:
+
+    - over-draw: the rolling mean stays above the limit for overdraw_time
+      seconds while no heater is heating up towards its target. The limit
+      is max_power, or if that is 0, peak_fraction of the highest power
+      drawn while heating up: heaters that stay near full power once at
+      temperature point at thermal runaway.
+    - power loss: power drops to drop_threshold or below mid-print, from a
+      rolling mean well above it. Flagged on the first such sample.
+    - idle heating: the rolling mean stays above idle_max_power for
+      idle_time seconds while no print runs and no heater has a target.
+
+    on_anomaly(anomaly) is called once when a check trips, and again only
+    after its condition cleared in between.
+    """
+
+    def __init__(self, on_anomaly, max_power=0.0, peak_fraction=0.9, overdraw_time=120.0, drop_threshold=2.0,
+                 idle_max_power=60.0, idle_time=120.0, window=30.0):
+        self._on_anomaly = on_anomaly
+        self.max_power = max_power
+        self.peak_fraction = peak_fraction
+        self.overdraw_time = overdraw_time
+        self.drop_threshold = drop_threshold
+        self.idle_max_power = idle_max_power
+        self.idle_time = idle_time
+        self.window = window
+
+        self._lock = threading.Lock()
+        self._devices = {}
+
+    def configure(self, max_power, overdraw_time, drop_threshold, idle_max_power, idle_time):
+        self.max_power = max(0.0, max_power)
+        self.overdraw_time = max(0.0, overdraw_time)
+        self.drop_threshold = max(0.0, drop_threshold)
+        self.idle_max_power = max(0.0, idle_max_power)
+        self.idle_time = max(0.0, idle_time)
+
+    def reset(self, device_id):
+        """Forget a plug's samples, e.g. after it was switched off. Its heat-up peak is kept"""
+        with self._lock:
+            state = self._devices.get(device_id)
+            if state is not None:
+                peak = state.peak
+                state = self._devices[device_id] = _DeviceState(self.window)
+                state.peak = peak
+
+    def update(self, device_id, timestamp, watts, printing=False, heaters_on=False, heating_up=False):
+        """Check one power sample and return the anomalies it raised.
+
+        heaters_on tells whether any heater has a target temperature,
+        heating_up whether one is still below it.
+        """
+        with self._lock:
+            state = self._devices.get(device_id)
+            if state is None:
+                state = self._devices[device_id] = _DeviceState(self.window)
+            anomalies = self._check(device_id, state, timestamp, watts, printing, heaters_on, heating_up)
+
+        for anomaly in anomalies:
+            self._on_anomaly(anomaly)
+        return anomalies
+
+    def get_state(self):
+        with self._lock:
+            return dict((device_id, dict(mean=state.stats.mean, std=state.stats.std, rate=state.rate,
+                                         peak=state.peak, samples=state.stats.count, limit=self._limit(state),
+                                         active=sorted(state.active)))
+                        for device_id, state in self._devices.items())
+
+    def _limit(self, state):
+        if self.max_power > 0:
+            return self.max_power
+        if state.peak > 0:
+            return self.peak_fraction * state.peak
+        return None
+
+    def _check(self, device_id, state, timestamp, watts, printing, heaters_on, heating_up):
+        if state.last_time is not None and timestamp > state.last_time:
+            state.rate = (watts - state.last_watts) / (timestamp - state.last_time)
+        previous_mean = state.stats.mean
+        state.stats.update(timestamp, watts)
+        mean, std = state.stats.mean, state.stats.std
+        if heating_up:
+            state.peak = max(state.peak, watts)
+
+        raised = []
+
+        def trip(kind, condition, message):
+            if not condition:
+                state.active.discard(kind)
+            elif kind not in state.active:
+                state.active.add(kind)
+                raised.append(Anomaly(kind, device_id, timestamp, watts, mean, std, state.rate, message))
+
+        limit = self._limit(state)
+        if limit is not None and mean > limit and not heating_up:
+            if state.over_since is None:
+                state.over_since = timestamp
+        else:
+            state.over_since = None
+        trip(ANOMALY_OVERDRAW, state.over_since is not None and timestamp - state.over_since >= self.overdraw_time,
+             f"Drawing {mean:.0f} W for {0 if state.over_since is None else timestamp - state.over_since:.0f}s "
+             f"with the heaters at temperature (limit {limit or 0:.0f} W)")
+
+        dropped = (printing and watts <= self.drop_threshold and previous_mean is not None
+                   and previous_mean > 5 * max(1.0, self.drop_threshold))
+        trip(ANOMALY_POWER_LOSS, dropped or (printing and ANOMALY_POWER_LOSS in state.active and watts <= self.drop_threshold),
+             f"Power dropped from {previous_mean or 0:.0f} W to {watts:.0f} W while printing")
+
+        if self.idle_max_power > 0 and not printing and not heaters_on and mean > self.idle_max_power:
+            if state.idle_since is None:
+                state.idle_since = timestamp
+        else:
+            state.idle_since = None
+        trip(ANOMALY_IDLE_HEATING, state.idle_since is not None and timestamp - state.idle_since >= self.idle_time,
+             f"Drawing {mean:.0f} W with no print running and no heater target set")
+
+        state.last_watts = watts
+        state.last_time = timestamp
+        return raised
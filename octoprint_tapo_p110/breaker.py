@@ -0,0 +1,146 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import random
+import threading
+import time
+
+# Connection states, from healthy to given up on
+STATE_CONNECTED = "connected"   # last call succeeded
+STATE_DEGRADED = "degraded"     # some calls failed, still trying every call
+STATE_OPEN = "open"             # too many failures, calls fail fast until the next probe
+STATE_HALF_OPEN = "half_open"   # one probe call is allowed through to test the plug
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of talking to a plug that is known to be unreachable"""
+
+    def __init__(self, retry_in, last_error=None):
+        if retry_in > 0:
+            message = f"Device unreachable, next connection attempt in {retry_in:.0f}s"
+        else:
+            message = "Device unreachable, a connection attempt is in progress"
+        if last_error:
+            message += f" (last error: {last_error})"
+        super(CircuitOpenError, self).__init__(message)
+        self.retry_in = retry_in
+
+
+class CircuitBreaker(object):
+    """Connection state machine with exponential backoff and jitter.
+
+    After failure_threshold consecutive failures the circuit opens and
+    every call is rejected without touching the network. Once the backoff
+    delay has passed a single probe call is let through (half-open): if it
+    succeeds the circuit closes again, if it fails the delay doubles, up to
+    max_delay, with +/- jitter so a farm of plugs doesn't retry in lockstep.
+    """
+
+    def __init__(self, failure_threshold=3, base_delay=5.0, max_delay=300.0, jitter=0.2,
+                 probe_timeout=60.0, on_change=None, clock=time.monotonic):
+        self.failure_threshold = max(1, failure_threshold)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.probe_timeout = probe_timeout
+        self.on_change = on_change
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._state = STATE_CONNECTED
+        self._failures = 0
+        self._opens = 0
+        self._retry_at = 0.0
+        self._probe_started = 0.0
+        self._last_error = None
+
+    @property
+    def state(self):
+        return self._state
+
+    def before_call(self, force=False):
+        """Raise CircuitOpenError if the plug must not be contacted right now.
+
+        force lets an explicit user action (like a connection test) through
+        as the half-open probe even while the backoff delay is running.
+        """
+        with self._lock:
+            now = self._clock()
+            if self._state == STATE_OPEN:
+                if now < self._retry_at and not force:
+                    raise CircuitOpenError(self._retry_at - now, self._last_error)
+                self._probe_started = now
+                changed = self._set_state(STATE_HALF_OPEN)
+            elif self._state == STATE_HALF_OPEN:
+                # Only one probe at a time, unless the last one never reported back
+                if now - self._probe_started < self.probe_timeout and not force:
+                    raise CircuitOpenError(0, self._last_error)
+                self._probe_started = now
+                changed = False
+            else:
+                changed = False
+        if changed:
+            self._notify()
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opens = 0
+            self._last_error = None
+            changed = self._set_state(STATE_CONNECTED)
+        if changed:
+            self._notify()
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self._failures += 1
+            if error is not None:
+                self._last_error = str(error)
+
+            if self._state == STATE_HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opens += 1
+                delay = min(self.max_delay, self.base_delay * 2 ** (self._opens - 1))
+                delay *= 1 + self.jitter * (2 * random.random() - 1)
+                self._retry_at = self._clock() + delay
+                self._set_state(STATE_OPEN)
+                changed = True  # the next probe time moved even if it was open already
+            else:
+                changed = self._set_state(STATE_DEGRADED)
+        if changed:
+            self._notify()
+
+    def configure(self, failure_threshold, base_delay, max_delay):
+        with self._lock:
+            self.failure_threshold = max(1, failure_threshold)
+            self.base_delay = base_delay
+            self.max_delay = max_delay
+
+    def reset(self):
+        with self._lock:
+            self._failures = 0
+            self._opens = 0
+            self._last_error = None
+            changed = self._set_state(STATE_CONNECTED)
+        if changed:
+            self._notify()
+
+    def snapshot(self):
+        """State for the UI: state name, failure count, seconds until the next probe"""
+        with self._lock:
+            retry_in = max(0.0, self._retry_at - self._clock()) if self._state == STATE_OPEN else 0.0
+            return dict(
+                state=self._state,
+                failures=self._failures,
+                retry_in=round(retry_in, 1),
+                retry_at=time.time() + retry_in if retry_in else None,
+                last_error=self._last_error
+            )
+
+    def _set_state(self, state):
+        changed = state != self._state
+        self._state = state
+        return changed
+
+    def _notify(self):
+        if self.on_change is not None:
+            self.on_change(self.snapshot())
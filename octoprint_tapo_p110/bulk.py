@@ -0,0 +1,49 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BulkRunner(object):
+    """Runs one power command on many plugs at once on a bounded worker pool.
+
+    Every plug gets its own worker, so switching a whole farm off takes
+    about as long as the slowest plug rather than the sum of them. Starts
+    can be staggered so that powering up a bay does not add up the inrush
+    current of every power supply at the same instant.
+    """
+
+    def __init__(self, max_workers):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="tapo_p110_bulk")
+
+    def run(self, devices, func, stagger=0.0):
+        """Call func(device) for every device and return (results, elapsed seconds).
+
+        func returns a dict for the device's result, exceptions are reported
+        as a failed result. Results keep the order of devices and carry when
+        the device's command started and how long it took.
+        """
+        start = time.monotonic()
+        futures = []
+        for index, device in enumerate(devices):
+            if stagger > 0 and index:
+                delay = start + index * stagger - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append(self._executor.submit(self._run_one, device, func, start))
+        results = [future.result() for future in futures]
+        return results, time.monotonic() - start
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def _run_one(self, device, func, start):
+        started = time.monotonic()
+        try:
+            result = func(device)
+        except Exception as e:
+            result = dict(device=device.id, success=False, error=str(e))
+        finished = time.monotonic()
+        result.update(started=round(started - start, 4), duration=round(finished - started, 4))
+        return result
@@ -0,0 +1,67 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+import time
+
+# Field groups kept by the cache. Switch state changes on every write and is
+# worth re-reading often, device info (nickname, firmware, signal) hardly ever
+# changes, energy readings sit somewhere in between.
+GROUP_STATE = "state"
+GROUP_INFO = "info"
+GROUP_ENERGY = "energy"
+
+GROUPS = (GROUP_STATE, GROUP_INFO, GROUP_ENERGY)
+
+
+class Snapshot(object):
+    """A cached value together with the time it was read from the device"""
+
+    __slots__ = ("value", "timestamp")
+
+    def __init__(self, value, timestamp):
+        self.value = value
+        self.timestamp = timestamp
+
+    def age(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        return max(0.0, now - self.timestamp)
+
+
+class DeviceStateCache(object):
+    """Timestamped snapshots of the plug's state, one per field group"""
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._snapshots = {}
+
+    def update(self, group, value):
+        """Store a fresh value for a group and return its snapshot"""
+        snapshot = Snapshot(value, self._clock())
+        with self._lock:
+            self._snapshots[group] = snapshot
+        return snapshot
+
+    def snapshot(self, group):
+        """Return the latest snapshot for a group regardless of its age"""
+        with self._lock:
+            return self._snapshots.get(group)
+
+    def get(self, group, max_age):
+        """Return the snapshot for a group if it is younger than max_age seconds"""
+        snapshot = self.snapshot(group)
+        if snapshot is None or max_age is None or max_age <= 0:
+            return None
+        if snapshot.age(self._clock()) > max_age:
+            return None
+        return snapshot
+
+    def invalidate(self, group=None):
+        """Drop one group, or everything if no group is given"""
+        with self._lock:
+            if group is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(group, None)
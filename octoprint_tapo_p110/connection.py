@@ -0,0 +1,150 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import contextlib
+import queue
+import socket
+import threading
+import time
+
+# Tapo plugs serve their local API over plain HTTP
+TAPO_PORT = 80
+
+
+class ConnectError(Exception):
+    """Connection could not be established. transient tells whether retrying might help"""
+
+    def __init__(self, message, cause=None, transient=True, timeout=False):
+        super(ConnectError, self).__init__(message)
+        self.cause = cause
+        self.transient = transient
+        self.timeout = timeout
+
+
+def is_timeout_error(error):
+    """Whether the error means the plug didn't answer in time"""
+    if isinstance(error, ConnectError):
+        return error.timeout
+    if isinstance(error, (TimeoutError, socket.timeout)):
+        return True
+    message = str(error).lower()
+    return 'timeout' in message or 'timed out' in message
+
+
+def is_transient_error(error):
+    """Timeouts and network errors are worth another attempt, anything else is not"""
+    if isinstance(error, ConnectionError) or is_timeout_error(error):
+        return True
+    # requests' exceptions derive from IOError, authentication and protocol
+    # errors from PyP100 are plain Exceptions
+    return isinstance(error, OSError)
+
+
+def split_address(address):
+    """Split "host" or "host:port" (e.g. a local simulator) into host and port"""
+    host, sep, port = address.rpartition(":")
+    if sep and host and port.isdigit():
+        return host, int(port)
+    return address, TAPO_PORT
+
+
+def probe(host, port=TAPO_PORT, timeout=1.5):
+    """Open and close a TCP connection to the plug, returning the time it took"""
+    start = time.monotonic()
+    try:
+        sock = socket.create_connection((host, port), timeout=timeout)
+    except socket.timeout as e:
+        raise ConnectError(f"{host}:{port} did not answer within {timeout:.1f}s", cause=e, timeout=True)
+    except OSError as e:
+        raise ConnectError(f"{host}:{port} is unreachable: {e}", cause=e)
+    sock.close()
+    return time.monotonic() - start
+
+
+class Connector(object):
+    """Establishes a device session within an overall deadline.
+
+    A quick TCP probe first weeds out plugs that are offline or moved, so
+    those fail in about a second instead of running through a handshake.
+    The handshake itself is hedged: if the first attempt hasn't finished
+    after hedge_delay seconds a second one is started in parallel, and
+    whichever succeeds first wins. Non-transient errors (bad credentials,
+    unexpected responses) end the whole thing right away.
+    """
+
+    def __init__(self, logger, deadline=10.0, hedge_delay=2.0, max_attempts=2, probe_timeout=1.5, on_retry=None):
+        self._logger = logger
+        self.deadline = deadline
+        self.hedge_delay = hedge_delay
+        self.max_attempts = max_attempts
+        self.probe_timeout = probe_timeout
+        # Called for every attempt after the first, hedged or retried
+        self.on_retry = on_retry
+        # Tracer for the reachability probe, attempts are traced by whoever opens the session
+        self.tracer = None
+
+    def establish(self, host, open_session, deadline=None):
+        """Run open_session(timeout) hedged and return the first successful result"""
+        if deadline is None:
+            deadline = self.deadline
+        deadline_at = time.monotonic() + deadline
+
+        address, port = split_address(host)
+        with self.tracer.span("probe", host=host) if self.tracer is not None else contextlib.nullcontext():
+            rtt = probe(address, port, timeout=min(self.probe_timeout, deadline))
+        self._logger.debug(f"{host} is reachable (TCP connect took {rtt * 1000:.0f}ms)")
+
+        results = queue.Queue()
+        state = dict(started=0, finished=0)
+
+        def run(attempt, timeout):
+            try:
+                results.put((attempt, open_session(timeout), None))
+            except Exception as e:
+                results.put((attempt, None, e))
+
+        def launch():
+            state["started"] += 1
+            if state["started"] > 1 and self.on_retry is not None:
+                self.on_retry()
+            timeout = max(0.1, deadline_at - time.monotonic())
+            self._logger.info(f"Connecting to P110 at {host} (attempt {state['started']}/{self.max_attempts}, deadline: {timeout:.1f}s)")
+            threading.Thread(target=run, args=(state["started"], timeout),
+                             name=f"tapo_p110_connect_{host}", daemon=True).start()
+            return time.monotonic() + self.hedge_delay
+
+        next_hedge_at = launch()
+        last_error = None
+        while True:
+            now = time.monotonic()
+            if now >= deadline_at:
+                raise ConnectError(f"No session with {host} within {deadline:.1f}s", cause=last_error, timeout=True)
+
+            wait = deadline_at - now
+            can_hedge = state["started"] < self.max_attempts
+            if can_hedge:
+                wait = min(wait, max(0.0, next_hedge_at - now))
+
+            try:
+                attempt, result, error = results.get(timeout=wait)
+            except queue.Empty:
+                if can_hedge and time.monotonic() >= next_hedge_at:
+                    self._logger.info(f"Attempt {state['started']} to {host} is slow, hedging")
+                    next_hedge_at = launch()
+                continue
+
+            if error is None:
+                return result
+
+            state["finished"] += 1
+            if not is_transient_error(error):
+                raise ConnectError(f"{type(error).__name__}: {error}", cause=error, transient=False)
+
+            self._logger.warning(f"Attempt {attempt} to {host} failed: {error}")
+            last_error = error
+            if state["finished"] == state["started"]:
+                # Nothing left in flight: retry right away while we have attempts left
+                if not can_hedge:
+                    raise ConnectError(f"All {self.max_attempts} attempts to {host} failed: {error}", cause=error,
+                                       timeout=is_timeout_error(error))
+                next_hedge_at = launch()
@@ -0,0 +1,90 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+import time
+
+
+class CooldownMonitor(object):
+    """Decides from the printer's temperature reports when its power can be cut.
+
+    While armed for a plug, every report is checked against the hotend and
+    bed thresholds. The printer counts as cool once every hotend and the
+    bed are at or below their threshold, and as hot again only above
+    threshold + hysteresis, so sensor noise around the threshold doesn't
+    restart the wait. After staying cool for hold seconds on_cool(device_id)
+    is called once and the monitor disarms.
+
+    update() runs on the printer communication thread for every report, so
+    it returns right away while nothing is armed.
+    """
+
+    def __init__(self, on_cool, hotend_threshold=50.0, bed_threshold=40.0, hysteresis=3.0, hold=10.0,
+                 clock=time.monotonic):
+        self._on_cool = on_cool
+        self.hotend_threshold = hotend_threshold
+        self.bed_threshold = bed_threshold
+        self.hysteresis = hysteresis
+        self.hold = hold
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._device = None
+        self._cool_since = None
+
+    @property
+    def armed(self):
+        return self._device
+
+    def configure(self, hotend_threshold, bed_threshold, hysteresis):
+        self.hotend_threshold = hotend_threshold
+        self.bed_threshold = bed_threshold
+        self.hysteresis = max(0.0, hysteresis)
+
+    def arm(self, device_id):
+        with self._lock:
+            if self._device != device_id:
+                self._device = device_id
+                self._cool_since = None
+
+    def disarm(self):
+        with self._lock:
+            self._device = None
+            self._cool_since = None
+
+    def update(self, temperatures):
+        """Check one report of parsed temperatures, {"T0": (actual, target), "B": (actual, target), ...}"""
+        if self._device is None:
+            return
+
+        with self._lock:
+            device_id = self._device
+            if device_id is None:
+                return
+
+            # Once cool, only a clear rise counts as hot again
+            margin = self.hysteresis if self._cool_since is not None else 0.0
+            hot = False
+            for sensor, values in temperatures.items():
+                if not values or values[0] is None:
+                    continue
+                if sensor.startswith("T"):
+                    hot = values[0] > self.hotend_threshold + margin
+                elif sensor == "B":
+                    hot = values[0] > self.bed_threshold + margin
+                if hot:
+                    break
+
+            now = self._clock()
+            if hot:
+                self._cool_since = None
+                return
+            if self._cool_since is None:
+                self._cool_since = now
+            if now - self._cool_since < self.hold:
+                return
+
+            self._device = None
+            self._cool_since = None
+
+        self._on_cool(device_id)
@@ -0,0 +1,40 @@
+# coding=utf-8
+"""Smaller payloads for clients: field projections, entity tags and deltas"""
+from __future__ import absolute_import
+
+import json
+import zlib
+
+
+def read_fields(value):
+    """Requested fields from a list or a comma separated string, None for all of them"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(",")
+    fields = [str(field).strip() for field in value if str(field).strip()]
+    return fields or None
+
+
+def project(payload, fields):
+    """payload cut down to fields, unchanged if fields is None"""
+    if fields is None or not isinstance(payload, dict):
+        return payload
+    return dict((field, payload[field]) for field in fields if field in payload)
+
+
+def payload_etag(payload, ignore=()):
+    """Tag of a payload's content that changes only if a field outside ignore changes"""
+    if payload is None:
+        return None
+    content = {key: value for key, value in payload.items() if key not in ignore}
+    data = json.dumps(content, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    return f"{zlib.crc32(data) & 0xFFFFFFFF:08x}"
+
+
+def diff(previous, current):
+    """Fields of current that differ from previous, and the names of those it no longer has"""
+    changed = dict((key, value) for key, value in current.items()
+                   if key not in previous or previous[key] != value)
+    removed = [key for key in previous if key not in current]
+    return changed, removed
@@ -0,0 +1,582 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+import time
+
+from .breaker import CircuitBreaker, CircuitOpenError
+from .cache import DeviceStateCache, GROUP_STATE, GROUP_INFO, GROUP_ENERGY
+from .connection import Connector, ConnectError, is_transient_error
+from .discovery import normalize_mac
+from .dispatcher import DeviceDispatcher
+from .metrics import PluginMetrics
+from .tracing import Tracer
+
+# Reads that read_snapshot batches into one multipleRequest
+SNAPSHOT_METHODS = ("get_device_info", "get_energy_usage", "get_current_power")
+
+
+def reported_mac(info):
+    """MAC address in a getDeviceInfo result, some library versions hand back the whole envelope"""
+    if not isinstance(info, dict):
+        return None
+    if isinstance(info.get("result"), dict):
+        info = info["result"]
+    return normalize_mac(info.get("mac"))
+
+
+class WrongPlugError(ConnectError):
+    """A different plug answered at the address, e.g. DHCP gave it our plug's old one"""
+
+    def __init__(self, address, found, expected, session):
+        super(WrongPlugError, self).__init__(f"{address} is the plug {found}, not {expected}")
+        self.found = found
+        self.session = session
+
+
+class BatchUnsupported(Exception):
+    """The client library or the plug's firmware can't batch requests"""
+
+
+class SessionUnavailable(Exception):
+    """A queued call found the session gone and couldn't open a new one"""
+
+    # The failed connect or the open breaker was already recorded
+    recorded = True
+
+
+class TapoDevice(object):
+    """One configured plug: its connection, request dispatcher and state cache"""
+
+    def __init__(self, device_id, name, ip, username, password, client_class, logger,
+                 connector=None, breaker=None, metrics=None, tracer=None, group=None, mac=None):
+        self.id = device_id
+        self.name = name or device_id
+        self.ip = ip
+        self.username = username
+        self.password = password
+        # Name of the group bulk commands can address the plug by, e.g. a bay of printers
+        self.group = group or None
+        # Configured or learned from the plug, identifies it if DHCP gives it a new address
+        self.mac = normalize_mac(mac)
+        # A configured MAC is enforced, a learned one gives way if the plug was replaced
+        self._mac_configured = self.mac is not None
+        # resolve_address(mac, timeout) returns the plug's current address or None, asked when it
+        # stopped answering at self.ip. on_located(mac, address) is called for every new session
+        self.resolve_address = None
+        self.on_located = None
+
+        # Callable returning the PyP100 client class, or None if it is unavailable
+        self._client_class = client_class
+        self._logger = logger
+
+        self.client = None
+        self.device_info = None
+        self.last_error = None
+        self.cache = DeviceStateCache()
+        self.dispatcher = DeviceDispatcher()
+        self.connector = connector or Connector(logger)
+        self.breaker = breaker or CircuitBreaker()
+        self.connection_lock = threading.Lock()
+        self.metrics = metrics or PluginMetrics().for_device(device_id)
+        if self.connector.on_retry is None:
+            self.connector.on_retry = self.metrics.retries.inc
+        self.tracer = tracer or Tracer(capacity=0)
+        if self.connector.tracer is None:
+            self.connector.tracer = self.tracer
+        # Whether the plug answers multipleRequest, unknown until the first snapshot
+        self.batch_supported = None
+        self._sessions = 0
+
+    def is_configured(self):
+        return all([self.ip, self.username, self.password])
+
+    def reconfigure(self, name, ip, username, password, group=None, mac=None):
+        """Apply changed settings. Returns whether the address, credentials or configured MAC
+        changed, in which case the session, cached state and breaker are dropped"""
+        mac = normalize_mac(mac)
+        self.name = name or self.id
+        self.group = group or None
+        changed = (ip, username, password) != (self.ip, self.username, self.password)
+        changed = changed or (mac is not None and (mac != self.mac or not self._mac_configured))
+        if mac is None and self._mac_configured:
+            # No longer enforced, still good for finding the plug
+            self._mac_configured = False
+        if not changed:
+            return False
+
+        with self.connection_lock:
+            self.ip, self.username, self.password = ip, username, password
+            if mac is not None:
+                self.mac = mac
+                self._mac_configured = True
+            self.client = None
+            self.device_info = None
+        self.cache.invalidate()
+        self.batch_supported = None
+        self.breaker.reset()
+        return True
+
+    def to_dict(self):
+        return dict(id=self.id, name=self.name, ip=self.ip, mac=self.mac, group=self.group,
+                    connection=self.breaker.snapshot())
+
+    ##~~ Connection
+
+    def connect(self, deadline=None, verbose=False, force=False):
+        """Connect to the P110 device unless the circuit breaker says it's unreachable"""
+        if self.client:
+            return True
+        if not self._guard(force):
+            return False
+        return self._connect(deadline, verbose)
+
+    def _connect(self, deadline=None, verbose=False):
+        """Connect to the P110 device within the connection deadline"""
+        start = time.monotonic()
+        # Looking the plug up and connecting again happen within the same deadline
+        deadline_at = start + (self.connector.deadline if deadline is None else deadline)
+        connected, error = self._connect_locked(deadline, verbose, start, may_relocate=True)
+        if error is None:
+            return connected
+
+        # The plug may just have a new address. It is looked up without holding
+        # connection_lock, so other calls on this plug, urgent writes among them,
+        # don't wait for the scan
+        if self._relocate(deadline_at - time.monotonic()):
+            return self._connect_locked(max(0.5, deadline_at - time.monotonic()), verbose, start)[0]
+        with self.connection_lock:
+            if self.client:
+                return True
+            return self._connect_failed(error, verbose, start)
+
+    def _connect_locked(self, deadline, verbose, start, may_relocate=False):
+        """One connection attempt at self.ip, returns (connected, error).
+
+        error is the failure when looking the plug up by its MAC might help,
+        left for the caller to record. Every other way out records an
+        outcome, or a half-open breaker waits for its probe to time out.
+        """
+        with self.connection_lock:
+            if self.client:
+                # Another call connected while this one waited. Nothing reached the
+                # plug yet, the call about to use the session records the outcome
+                return True, None
+
+            client_class = self._client_class()
+            if client_class is None:
+                self._logger.error("PyP100 library not available. Please install manually: pip install git+https://github.com/almottier/TapoP100.git@main")
+                self._record_failure(ConnectError("PyP100 library not available", transient=False))
+                return False, None
+
+            if not self.is_configured():
+                self._logger.error("Device configuration incomplete")
+                self._record_failure(ConnectError("Device configuration incomplete", transient=False))
+                return False, None
+
+            try:
+                client, info = self._establish(client_class, deadline)
+            except ConnectError as e:
+                if may_relocate and e.transient and self.mac and self.resolve_address is not None:
+                    return False, e
+                return self._connect_failed(e, verbose, start), None
+            return self._connected(client, info, verbose, start), None
+
+    def _connect_failed(self, error, verbose, start):
+        """Record a failed connection, or adopt the session of a replaced plug. Needs connection_lock"""
+        if isinstance(error, WrongPlugError) and not self._mac_configured:
+            self._logger.warning(f"{error}, {self.mac} wasn't found elsewhere - assuming the plug was replaced")
+            self.mac = error.found
+            client, info = error.session
+            return self._connected(client, info, verbose, start)
+        self.metrics.failed("connect", error)
+        self.metrics.latency["connect"].observe(time.monotonic() - start)
+        self._log_connect_error(error, time.monotonic() - start)
+        self._record_failure(error)
+        return False
+
+    def _connected(self, client, info, verbose, start):
+        """Take a new session into use. Needs connection_lock"""
+        self.metrics.latency["connect"].observe(time.monotonic() - start)
+        if self._sessions:
+            self.metrics.reconnects.inc()
+        self._sessions += 1
+
+        self.client = client
+        self.device_info = info
+        self._record_success()
+        if self.mac is None:
+            self.mac = reported_mac(info)
+        if self.mac and self.on_located is not None:
+            self.on_located(self.mac, self.ip)
+
+        # Handle different response formats
+        if isinstance(info, dict):
+            device_model = info.get('model', 'Unknown')
+            firmware_version = info.get('fw_ver', 'Unknown')
+            self.update_status_cache(info)
+            if verbose:
+                self._logger.info(f"Device On: {info.get('device_on', 'Unknown')}")
+        else:
+            # Some firmware versions return different formats
+            self._logger.warning(f"Unexpected device info format: {type(info)}")
+            device_model = 'Unknown'
+            firmware_version = 'Unknown'
+
+        self._logger.info(f"Connected to {device_model} with firmware {firmware_version} in {time.monotonic() - start:.2f}s")
+
+        if device_model != 'P110' and device_model != 'Unknown':
+            self._logger.warning(f"Expected P110, but connected to {device_model}")
+
+        return True
+
+    def _establish(self, client_class, deadline):
+        """Open a session at self.ip, making sure it is the plug with our MAC"""
+        with self.tracer.span("connect", device=self.id, host=self.ip) as span:
+            # Attempts run on their own threads, so they are given their parent
+            client, info = self.connector.establish(
+                self.ip,
+                lambda timeout: self._open_session(client_class, timeout, span),
+                deadline
+            )
+        found = reported_mac(info)
+        if self.mac and found and found != self.mac:
+            raise WrongPlugError(self.ip, found, self.mac, (client, info))
+        return client, info
+
+    def _relocate(self, timeout):
+        """Look the plug up by its MAC within timeout seconds after it stopped answering, True if it has a new address"""
+        if not self.mac or self.resolve_address is None or timeout <= 0:
+            return False
+        with self.tracer.span("resolve", device=self.id, mac=self.mac) as span:
+            address = self.resolve_address(self.mac, timeout)
+            span.set(address=address)
+        with self.connection_lock:
+            if not address or address == self.ip:
+                return False
+            self._logger.info(f"{self.name} moved from {self.ip} to {address}")
+            self.ip = address
+        return True
+
+    def _open_session(self, client_class, timeout, parent=None):
+        """Create a client, handshake, log in and read the device info"""
+        with self.tracer.span("connect.attempt", parent=parent, timeout=round(timeout, 2)):
+            client = client_class(self.ip, self.username, self.password)
+
+            # Try to configure timeout if possible
+            self._configure_timeout(client, timeout)
+
+            self._logger.debug("Performing handshake...")
+            self._call("handshake", client.handshake)
+
+            self._logger.debug("Performing login...")
+            self._call("login", client.login)
+
+            # Get device info to verify it's a P110
+            self._logger.debug("Getting device info...")
+            return client, self._call("get_device_info", client.getDeviceInfo)
+
+    def _call(self, operation, func):
+        """Run one request to the plug, timed and traced"""
+        with self.tracer.span(operation):
+            return self.metrics.timed(operation, func)
+
+    def _on_session(self, operation, func, force=False, drop=True):
+        """func(client) as a dispatcher call, run on the session that is current once the call gets its turn.
+
+        A call queued behind one that dropped the session reconnects instead
+        of using the dead client. A failure is recorded before the next call
+        gets its turn, see _fail.
+        """
+        def run():
+            client = self.client
+            if client is None:
+                if not self._guard(force) or not self._connect():
+                    raise SessionUnavailable(self.last_error)
+                client = self.client
+            try:
+                return self._call(operation, lambda: func(client))
+            except BatchUnsupported:
+                raise
+            except Exception as e:
+                self._fail(e, drop, session=client)
+                raise
+        return run
+
+    def _fail(self, error, drop=True, session=None):
+        """Record a failed call once and, with drop, let its session go.
+
+        Failures on a session that was already dropped aren't counted again,
+        so one expired session doesn't open the breaker however many calls
+        were queued on it.
+        """
+        if getattr(error, "recorded", False):
+            return
+        error.recorded = True
+        with self.connection_lock:
+            if session is not None and session is not self.client:
+                self.last_error = str(error)
+                return
+            if drop:
+                self.client = None
+                self.device_info = None
+        self._record_failure(error)
+
+    def _guard(self, force=False):
+        """Check with the circuit breaker whether the plug may be contacted"""
+        try:
+            self.breaker.before_call(force)
+            return True
+        except CircuitOpenError as e:
+            self._logger.debug(f"Skipping call: {e}")
+            self.last_error = str(e)
+            return False
+
+    def _record_success(self):
+        self.last_error = None
+        self.breaker.record_success()
+
+    def _record_failure(self, error):
+        self.last_error = str(error)
+        self.breaker.record_failure(error)
+
+    def _log_connect_error(self, error, elapsed):
+        if isinstance(error.cause, KeyError):
+            self._logger.error(f"Failed to connect to P110 - Response format error: {error.cause}")
+            self._logger.error("This might be a firmware compatibility issue. Try updating your P110 firmware.")
+        elif error.transient:
+            self._logger.error(f"Failed to connect to P110 after {elapsed:.1f}s: {error}")
+        else:
+            # Non-timeout error, retrying wouldn't help
+            self._logger.error(f"Failed to connect to P110: {error}")
+            if error.cause is not None:
+                self._logger.debug("Full traceback:", exc_info=error.cause)
+
+    def _configure_timeout(self, client, timeout_seconds):
+        """Configure timeout for PyP100 device to handle OctoPrint environment issues"""
+        try:
+            # Try different ways to set timeout based on PyP100 implementation
+            if hasattr(client, 'timeout'):
+                client.timeout = timeout_seconds
+                self._logger.debug(f"Set device.timeout = {timeout_seconds}")
+            elif hasattr(client, '_timeout'):
+                client._timeout = timeout_seconds
+                self._logger.debug(f"Set device._timeout = {timeout_seconds}")
+            elif hasattr(client, 'session'):
+                if hasattr(client.session, 'timeout'):
+                    client.session.timeout = timeout_seconds
+                    self._logger.debug(f"Set session.timeout = {timeout_seconds}")
+
+            # Try to configure requests session if available
+            if hasattr(client, 'session'):
+                import requests.adapters
+                # Configure adapter with timeout
+                adapter = requests.adapters.HTTPAdapter()
+                client.session.mount('http://', adapter)
+                client.session.mount('https://', adapter)
+                self._logger.debug(f"Configured session adapters")
+
+        except Exception as e:
+            self._logger.debug(f"Could not configure timeout: {e}")
+
+    def disconnect(self):
+        """Disconnect from the device"""
+        with self.connection_lock:
+            self.client = None
+            self.device_info = None
+
+    def test_connection(self, deadline=None):
+        """Test connection to device, forcing a fresh session"""
+        self.disconnect()  # Force reconnection
+
+        self._logger.info(f"Testing connection to {self.ip} with user {self.username}")
+        if self.connect(deadline, verbose=True, force=True):
+            self._logger.info("✅ Test connection successful!")
+            return True
+        return False
+
+    ##~~ Device calls
+
+    def turn_on(self):
+        """Turn the device ON"""
+        if not self._guard() or not self._connect():
+            return False
+
+        try:
+            self.dispatcher.write(self._on_session("turn_on", lambda client: client.turnOn()))
+            self.cache.update(GROUP_STATE, True)
+            self._logger.info("P110 turned ON")
+            self._record_success()
+            return True
+        except Exception as e:
+            self._logger.error(f"Failed to turn ON: {e}")
+            self._fail(e)
+            return False
+
+    def turn_off(self, urgent=False):
+        """Turn the device OFF. urgent skips queued requests and tries even while backing off"""
+        if not self._guard(force=urgent) or not self._connect():
+            return False
+
+        try:
+            self.dispatcher.write(self._on_session("turn_off", lambda client: client.turnOff(), force=urgent), urgent)
+            self.cache.update(GROUP_STATE, False)
+            self._logger.info("P110 turned OFF")
+            self._record_success()
+            return True
+        except Exception as e:
+            self._logger.error(f"Failed to turn OFF: {e}")
+            self._fail(e)
+            return False
+
+    def read_status(self):
+        """Read the device info from the plug and refresh the cache"""
+        if not self._guard() or not self._connect():
+            return None
+
+        try:
+            info = self.dispatcher.read("get_device_info",
+                                        self._on_session("get_device_info", lambda client: client.getDeviceInfo()))
+            self._record_success()
+
+            # Handle different response formats
+            if isinstance(info, dict):
+                self.update_status_cache(info)
+                return info
+            else:
+                self._logger.error(f"Unexpected status response format: {type(info)}")
+                self.last_error = f"Unexpected status response format: {type(info).__name__}"
+                return None
+
+        except KeyError as e:
+            self._logger.error(f"Failed to get status - Response format error: {e}")
+            self._logger.error("This might be a firmware compatibility issue.")
+            self._fail(e)
+            return None
+        except Exception as e:
+            self._logger.error(f"Failed to get status: {e}")
+            self._logger.error(f"Error type: {type(e).__name__}")
+            self._fail(e)
+            return None
+
+    def read_energy(self):
+        """Read energy usage from the plug and refresh the cache"""
+        if not self._guard() or not self._connect():
+            return None
+
+        try:
+            energy = self.dispatcher.read("get_energy_usage",
+                                          self._on_session("get_energy_usage", lambda client: client.getEnergyUsage(), drop=False))
+            self.cache.update(GROUP_ENERGY, energy)
+            self._record_success()
+            return energy
+        except Exception as e:
+            self._logger.error(f"Failed to get energy usage: {e}")
+            self._fail(e, drop=False)
+            return None
+
+    def read_snapshot(self):
+        """Read device info, energy usage and current power, in one round-trip where possible.
+
+        Returns dict(status, energy, current_power (W), batched, cached) and
+        refreshes the cache. If the client library or the firmware can't
+        batch, the reads are sent separately, and that is remembered. If
+        only the energy read fails, energy is None and the session is kept.
+        """
+        if not self._guard() or not self._connect():
+            return None
+
+        energy_failed = False
+        try:
+            snapshot = None
+            if self.batch_supported is not False:
+                try:
+                    snapshot = self.dispatcher.read("snapshot", self._on_session("multiple_request", self._read_batch))
+                    self.batch_supported = True
+                except BatchUnsupported as e:
+                    self._logger.info(f"Batched reads are unavailable, reading separately: {e}")
+                    self.batch_supported = False
+
+            if snapshot is None:
+                info = self.dispatcher.read("get_device_info",
+                                            self._on_session("get_device_info", lambda client: client.getDeviceInfo()))
+                try:
+                    # Like read_energy: the failure is recorded, the session and the status kept
+                    energy = self.dispatcher.read(
+                        "get_energy_usage",
+                        self._on_session("get_energy_usage", lambda client: client.getEnergyUsage(), drop=False))
+                except Exception as e:
+                    self._logger.error(f"Failed to get energy usage: {e}")
+                    energy, energy_failed = None, True
+                snapshot = dict(status=info, energy=energy, current_power=None, batched=False, cached=False)
+            if not energy_failed:
+                self._record_success()
+        except Exception as e:
+            self._logger.error(f"Failed to read status and energy: {type(e).__name__}: {e}")
+            self._fail(e)
+            return None
+
+        if not isinstance(snapshot["status"], dict):
+            self._logger.error(f"Unexpected status response format: {type(snapshot['status'])}")
+            self.last_error = f"Unexpected status response format: {type(snapshot['status']).__name__}"
+            return None
+        self.update_status_cache(snapshot["status"])
+
+        energy = snapshot["energy"]
+        if isinstance(energy, dict):
+            self.cache.update(GROUP_ENERGY, energy)
+            if snapshot["current_power"] is None:
+                snapshot["current_power"] = energy.get("current_power", 0) / 1000.0
+        return snapshot
+
+    def _read_batch(self, client):
+        """SNAPSHOT_METHODS in one multipleRequest, BatchUnsupported if that isn't possible"""
+        request = getattr(client, "request", None) or getattr(client, "_request", None)
+        if request is None:
+            raise BatchUnsupported(f"{type(client).__name__} has no generic request method")
+
+        try:
+            result = request("multipleRequest", {"requests": [dict(method=method) for method in SNAPSHOT_METHODS]})
+        except Exception as e:
+            # Once batching worked, an error is a failed read like any other
+            if self.batch_supported or is_transient_error(e):
+                raise
+            raise BatchUnsupported(f"{type(e).__name__}: {e}")
+
+        # Some library versions hand back the whole envelope
+        if isinstance(result, dict) and "responses" not in result and isinstance(result.get("result"), dict):
+            result = result["result"]
+        responses = dict((response.get("method"), response) for response in (result or {}).get("responses", []))
+        values = {}
+        for method in SNAPSHOT_METHODS:
+            response = responses.get(method) or {}
+            values[method] = response.get("result") if response.get("error_code", 0) == 0 else None
+
+        if not isinstance(values["get_device_info"], dict):
+            if not self.batch_supported:
+                raise BatchUnsupported("no device info in the batched response")
+            raise KeyError("get_device_info")
+
+        current = values["get_current_power"]
+        return dict(status=values["get_device_info"], energy=values["get_energy_usage"],
+                    current_power=current.get("current_power") if isinstance(current, dict) else None,
+                    batched=True, cached=False)
+
+    ##~~ Cache
+
+    def update_status_cache(self, info):
+        """Store a getDeviceInfo result in the cache"""
+        self.cache.update(GROUP_INFO, info)
+        self.cache.update(GROUP_STATE, bool(info.get('device_on', False)))
+
+    def cached_status(self, info_max_age, state_max_age):
+        """Return the status from the cache or None if it is missing or too old"""
+        info = self.cache.get(GROUP_INFO, info_max_age)
+        state = self.cache.get(GROUP_STATE, state_max_age)
+        if info is None or state is None:
+            return None
+
+        # Writes only refresh the switch state, so overlay it on the info snapshot
+        status = dict(info.value)
+        status['device_on'] = state.value
+        return status
@@ -0,0 +1,357 @@
+# coding=utf-8
+"""Finds Tapo plugs on the LAN and remembers where each MAC address was seen.
+
+Tapo devices answer a UDP probe on port 20002: a 16 byte header followed
+by a JSON body, with a CRC32 over the whole packet in the header. The
+reply carries the device's MAC, IP, model and HTTP port.
+"""
+from __future__ import absolute_import
+
+import collections
+import json
+import os
+import random
+import re
+import socket
+import struct
+import threading
+import time
+import zlib
+
+from .connection import TAPO_PORT
+
+DISCOVERY_PORT = 20002
+BROADCAST_ADDRESS = "255.255.255.255"
+
+# version, message type, op code, body size, flags, padding, serial, CRC32
+HEADER = struct.Struct(">BBHHBBII")
+HEADER_VERSION = 2
+HEADER_MESSAGE_TYPE = 0
+HEADER_OP_CODE = 1
+HEADER_FLAGS = 17
+# Stands in for the CRC while it is computed
+CRC_SEED = 0x5A6B7C8D
+
+# Seconds between probes while collecting replies, UDP may drop some
+RESEND_INTERVAL = 1.0
+
+
+def normalize_mac(mac):
+    """MAC address as AA:BB:CC:DD:EE:FF, None if it isn't one. Tapo reports AA-BB-CC-DD-EE-FF"""
+    if not mac:
+        return None
+    digits = re.sub(r"[^0-9A-Fa-f]", "", str(mac))
+    if len(digits) != 12:
+        return None
+    return ":".join(digits[i:i + 2] for i in range(0, 12, 2)).upper()
+
+
+def encode_packet(payload, serial=None):
+    """Header and JSON body of a discovery packet, with its CRC filled in"""
+    body = json.dumps(payload).encode("utf-8")
+    if serial is None:
+        serial = random.randint(0, 0xFFFFFFFF)
+    header = HEADER.pack(HEADER_VERSION, HEADER_MESSAGE_TYPE, HEADER_OP_CODE, len(body),
+                         HEADER_FLAGS, 0, serial, CRC_SEED)
+    crc = zlib.crc32(header + body) & 0xFFFFFFFF
+    return header[:-4] + struct.pack(">I", crc) + body
+
+
+def decode_packet(data):
+    """JSON body of a discovery packet, ValueError if it is truncated or corrupt"""
+    if len(data) < HEADER.size:
+        raise ValueError("Packet shorter than its header")
+    version, _, _, size, _, _, _, crc = HEADER.unpack_from(data)
+    if version != HEADER_VERSION:
+        raise ValueError(f"Unsupported discovery version {version}")
+    body = data[HEADER.size:HEADER.size + size]
+    if len(body) != size:
+        raise ValueError("Packet shorter than its body")
+    expected = zlib.crc32(data[:HEADER.size - 4] + struct.pack(">I", CRC_SEED) + body) & 0xFFFFFFFF
+    if crc != expected:
+        raise ValueError("CRC mismatch")
+    return json.loads(body.decode("utf-8"))
+
+
+def build_probe(key=None):
+    """The discovery probe. Newer firmware wants an RSA public key (PEM) to encrypt extra details to"""
+    params = dict(rsa_key=key) if key else {}
+    return encode_packet(dict(params=params))
+
+
+def parse_reply(data, sender):
+    """Device described by a discovery reply, None if it isn't one"""
+    message = decode_packet(data)
+    result = message.get("result") if isinstance(message, dict) else None
+    if not isinstance(result, dict):
+        return None
+    mac = normalize_mac(result.get("mac"))
+    if mac is None:
+        return None
+
+    ip = result.get("ip") or sender[0]
+    port = (result.get("mgt_encrypt_schm") or {}).get("http_port")
+    address = f"{ip}:{port}" if port and int(port) != TAPO_PORT else ip
+    return dict(mac=mac, ip=address, model=result.get("device_model"), type=result.get("device_type"),
+                device_id=result.get("device_id"))
+
+
+def split_target(target, port=DISCOVERY_PORT):
+    """Split "host" or "host:port" into host and port, defaulting to the discovery port"""
+    host, sep, target_port = target.rpartition(":")
+    if sep and host and target_port.isdigit():
+        return host, int(target_port)
+    return target, port
+
+
+def discover(timeout=3.0, targets=(BROADCAST_ADDRESS,), key=None, until=None):
+    """Probe targets and collect the replies arriving before timeout.
+
+    Replies are read as they come in on one socket, so every plug answers
+    concurrently. until(found) can end the wait early, e.g. once a given
+    MAC has replied. Returns the devices found, one per MAC, in the order
+    they answered.
+    """
+    probe = build_probe(key)
+    found = collections.OrderedDict()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        deadline = time.monotonic() + timeout
+        next_probe = 0.0
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if now >= next_probe:
+                for target in targets:
+                    sock.sendto(probe, split_target(target))
+                next_probe = now + RESEND_INTERVAL
+
+            sock.settimeout(max(0.001, min(deadline, next_probe) - now))
+            try:
+                data, sender = sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            try:
+                device = parse_reply(data, sender)
+            except ValueError:
+                continue
+            if device is not None and device["mac"] not in found:
+                found[device["mac"]] = device
+                if until is not None and until(found):
+                    break
+    finally:
+        sock.close()
+    return list(found.values())
+
+
+class DiscoveryCache(object):
+    """Where each MAC address was last seen, saved to a JSON file.
+
+    seen is when the plug last answered a discovery probe, connected when
+    a session was last opened to it at that address. device is the ID of
+    the configured plug with that MAC, so it can be found again after a
+    restart even if it was never given a MAC in the settings.
+    """
+
+    def __init__(self, path, logger=None):
+        self.path = path
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def get(self, mac):
+        with self._lock:
+            entry = self._entries.get(normalize_mac(mac))
+            return dict(entry) if entry is not None else None
+
+    def find_device(self, device_id):
+        """MAC of a configured plug, None if it was never connected to"""
+        with self._lock:
+            for mac, entry in self._entries.items():
+                if entry.get("device") == device_id:
+                    return mac
+        return None
+
+    def list(self):
+        with self._lock:
+            return [dict(entry, mac=mac) for mac, entry in self._entries.items()]
+
+    def update(self, devices):
+        """Record discovery replies"""
+        now = time.time()
+        with self._lock:
+            for device in devices:
+                entry = self._entries.setdefault(device["mac"], {})
+                entry.update(ip=device["ip"], model=device.get("model"), seen=now)
+            self._save()
+
+    def remember(self, mac, ip, device_id=None):
+        """Record that a session was opened to the plug with this MAC at ip"""
+        mac = normalize_mac(mac)
+        if mac is None:
+            return
+        with self._lock:
+            entry = self._entries.setdefault(mac, {})
+            changed = entry.get("ip") != ip or (device_id and entry.get("device") != device_id)
+            entry.update(ip=ip, connected=time.time())
+            if device_id:
+                # A MAC belongs to one configured plug
+                for other in self._entries.values():
+                    if other is not entry and other.get("device") == device_id:
+                        other.pop("device")
+                entry["device"] = device_id
+            if changed:
+                self._save()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return dict((normalize_mac(mac), dict(entry)) for mac, entry in json.load(f).items()
+                            if normalize_mac(mac))
+        except (IOError, OSError, ValueError, AttributeError, TypeError) as e:
+            self._log_error(f"Could not read discovered plugs from {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        temp = self.path + ".tmp"
+        try:
+            with open(temp, "w") as f:
+                json.dump(self._entries, f)
+            os.replace(temp, self.path)
+        except (IOError, OSError) as e:
+            self._log_error(f"Could not save discovered plugs to {self.path}: {e}")
+
+    def _log_error(self, message):
+        if self._logger is not None:
+            self._logger.error(message)
+
+
+class Discovery(object):
+    """Scans for plugs and looks up a plug's current address by its MAC.
+
+    Lookups share scans: when several plugs become unreachable at once the
+    first lookup scans and the others wait for it, then find their answer
+    in the cache. The scan runs outside the lock, so lookups answered from
+    the cache never wait for it. A MAC that didn't answer is not looked for
+    again for min_interval seconds, so a plug that is simply off doesn't
+    flood the LAN.
+    """
+
+    def __init__(self, cache, logger, timeout=3.0, targets=(BROADCAST_ADDRESS,), min_interval=30.0, key_path=None):
+        self.cache = cache
+        self._logger = logger
+        self.timeout = timeout
+        self.targets = tuple(targets)
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._scan_done = threading.Condition(self._lock)
+        self._scanning = False
+        self._last_full_scan = None
+        # Public key sent with probes, kept in key_path across restarts
+        self.key_path = key_path
+        self._key = None
+        self._key_lock = threading.Lock()
+
+    def configure(self, timeout, targets):
+        self.timeout = timeout
+        self.targets = tuple(targets)
+
+    def scan(self, timeout=None, until=None):
+        """Probe the LAN, record and return the plugs that answered"""
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        try:
+            found = discover(timeout, self.targets, self._probe_key(), until)
+        except OSError as e:
+            self._logger.error(f"Discovery failed: {e}")
+            return []
+        if until is None:
+            self._last_full_scan = time.monotonic()
+        self.cache.update(found)
+        self._logger.info(f"Discovery found {len(found)} plug(s) in {time.monotonic() - start:.2f}s")
+        return found
+
+    def resolve(self, mac, timeout=None):
+        """Current address of the plug with this MAC, None if it can't be found within timeout seconds"""
+        mac = normalize_mac(mac)
+        if mac is None:
+            return None
+        timeout = self.timeout if timeout is None else min(self.timeout, timeout)
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                entry = self.cache.get(mac)
+                if entry is not None and entry.get("seen") and time.time() - entry["seen"] < self.min_interval:
+                    return entry["ip"]
+                if self._last_full_scan is not None and time.monotonic() - self._last_full_scan < self.min_interval:
+                    return None
+                if not self._scanning:
+                    break
+                # Another lookup is scanning, its replies may include this MAC
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._scan_done.wait(remaining)
+            self._scanning = True
+
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self._logger.info(f"Looking for {mac} on the network")
+            found = self.scan(remaining, until=lambda devices: mac in devices)
+        finally:
+            with self._lock:
+                self._scanning = False
+                self._scan_done.notify_all()
+        for device in found:
+            if device["mac"] == mac:
+                return device["ip"]
+        # Only a lookup given the configured time tells the plug is off
+        if timeout >= self.timeout:
+            with self._lock:
+                self._last_full_scan = time.monotonic()
+        return None
+
+    def prepare(self):
+        """Load or generate the probe key on a background thread, generating it takes seconds on a Pi"""
+        threading.Thread(target=self._probe_key, name="tapo_p110_discovery_key", daemon=True).start()
+
+    def _probe_key(self):
+        """RSA public key sent with the probe, loaded or generated once. None without pycryptodome"""
+        with self._key_lock:
+            if self._key is None:
+                self._key = self._load_key() or self._generate_key()
+            return self._key or None
+
+    def _load_key(self):
+        if not self.key_path or not os.path.exists(self.key_path):
+            return None
+        try:
+            with open(self.key_path) as f:
+                key = f.read()
+        except (IOError, OSError) as e:
+            self._logger.error(f"Could not read the discovery key from {self.key_path}: {e}")
+            return None
+        return key if key.startswith("-----BEGIN PUBLIC KEY-----") else None
+
+    def _generate_key(self):
+        try:
+            from Crypto.PublicKey import RSA
+        except ImportError:
+            return ""
+        # Replies aren't decrypted, so only the public half is kept
+        key = RSA.generate(1024).publickey().export_key("PEM").decode("ascii")
+        if self.key_path:
+            temp = self.key_path + ".tmp"
+            try:
+                with open(temp, "w") as f:
+                    f.write(key)
+                os.replace(temp, self.key_path)
+            except (IOError, OSError) as e:
+                self._logger.error(f"Could not save the discovery key to {self.key_path}: {e}")
+        return key
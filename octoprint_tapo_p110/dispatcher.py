@@ -0,0 +1,118 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+
+
+class _PendingCall(object):
+    """Result slot shared by every caller waiting on the same read"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def resolve(self, result):
+        self._result = result
+        self._done.set()
+
+    def fail(self, error):
+        self._error = error
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class DeviceDispatcher(object):
+    """Serialises every call on one device session.
+
+    Calls run one at a time in the order they were submitted. A read that
+    arrives while an identical read is queued or running doesn't go to the
+    device again but shares that call's result (or exception). Writes are
+    never coalesced, and a read submitted after a write never shares the
+    result of a read submitted before it. Urgent writes, such as an
+    emergency power cut, skip the queue and only wait for the running call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._turn = threading.Condition(self._lock)
+        self._next_ticket = 0
+        self._now_serving = 0
+        self._busy = False
+        self._urgent = 0
+        self._inflight = {}
+
+        self._reads = 0
+        self._writes = 0
+        self._coalesced = 0
+
+    def read(self, key, func):
+        """Run a read, or join an identical one that is already in flight"""
+        with self._lock:
+            self._reads += 1
+            pending = self._inflight.get(key)
+            leader = pending is None
+            if leader:
+                pending = _PendingCall()
+                self._inflight[key] = pending
+            else:
+                self._coalesced += 1
+        if not leader:
+            return pending.wait()
+
+        try:
+            result = self._run(func)
+        except Exception as e:
+            pending.fail(e)
+            raise
+        else:
+            pending.resolve(result)
+            return result
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is pending:
+                    del self._inflight[key]
+
+    def write(self, func, urgent=False):
+        """Run a write after everything submitted before it, or before anything queued if urgent"""
+        with self._lock:
+            self._writes += 1
+            # Reads issued from now on must observe this write
+            self._inflight.clear()
+        return self._run(func, urgent)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(
+                reads=self._reads,
+                writes=self._writes,
+                coalesced=self._coalesced,
+                device_calls=self._reads + self._writes - self._coalesced,
+                queued=self._next_ticket - self._now_serving
+            )
+
+    def _run(self, func, urgent=False):
+        with self._turn:
+            if urgent:
+                self._urgent += 1
+                while self._busy:
+                    self._turn.wait()
+                self._urgent -= 1
+            else:
+                ticket = self._next_ticket
+                self._next_ticket += 1
+                while ticket != self._now_serving or self._busy or self._urgent:
+                    self._turn.wait()
+                self._now_serving += 1
+            self._busy = True
+        try:
+            return func()
+        finally:
+            with self._turn:
+                self._busy = False
+                self._turn.notify_all()
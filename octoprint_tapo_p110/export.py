@@ -0,0 +1,65 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import datetime
+import json
+
+# Export format -> mimetype
+EXPORT_FORMATS = dict(csv="text/csv; charset=utf-8", ndjson="application/x-ndjson; charset=utf-8")
+
+RAW_COLUMNS = ("timestamp", "time", "watts")
+DOWNSAMPLED_COLUMNS = ("timestamp", "time", "watts", "min", "max", "samples")
+
+# Bytes of rows collected before a chunk is handed to the response
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def downsample(samples, resolution):
+    """Average samples into resolution second buckets, yielding (start, avg, min, max, count)"""
+    bucket, total, low, high, count = None, 0.0, 0.0, 0.0, 0
+    for timestamp, watts in samples:
+        start = int(timestamp) - int(timestamp) % resolution
+        if start != bucket:
+            if count:
+                yield bucket, total / count, low, high, count
+            bucket, total, low, high, count = start, 0.0, watts, watts, 0
+        total += watts
+        low = min(low, watts)
+        high = max(high, watts)
+        count += 1
+    if count:
+        yield bucket, total / count, low, high, count
+
+
+def export_rows(samples, resolution=0):
+    """Rows of an export: the raw samples, or per bucket averages if resolution is set"""
+    for row in (downsample(samples, resolution) if resolution else samples):
+        timestamp = int(row[0])
+        iso = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        yield (timestamp, iso, round(row[1], 2)) + tuple(round(value, 2) for value in row[2:4]) + row[4:]
+
+
+def stream_export(samples, fmt, resolution=0, chunk_size=EXPORT_CHUNK_SIZE):
+    """Encode samples as CSV or NDJSON, yielding chunks of about chunk_size bytes.
+
+    Nothing is held beyond the chunk being filled, so exporting a year
+    takes as much memory as exporting an hour.
+    """
+    columns = DOWNSAMPLED_COLUMNS if resolution else RAW_COLUMNS
+    if fmt == "csv":
+        encode = lambda row: ",".join(str(value) for value in row) + "\n"
+        chunk = [encode(columns)]
+    else:
+        encode = lambda row: json.dumps(dict(zip(columns, row))) + "\n"
+        chunk = []
+
+    size = sum(len(line) for line in chunk)
+    for row in export_rows(samples, resolution):
+        line = encode(row)
+        chunk.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield "".join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield "".join(chunk)
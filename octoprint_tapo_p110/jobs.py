@@ -0,0 +1,110 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import collections
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class Job(object):
+    """A device command running in the background"""
+
+    def __init__(self, command, device_id):
+        self.id = uuid.uuid4().hex[:12]
+        self.command = command
+        self.device = device_id
+        self.status = JOB_PENDING
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def done(self):
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    def to_dict(self):
+        return dict(
+            id=self.id,
+            command=self.command,
+            device=self.device,
+            status=self.status,
+            result=self.result,
+            error=self.error,
+            created=self.created,
+            started=self.started,
+            finished=self.finished
+        )
+
+
+class JobManager(object):
+    """Runs device commands on a dedicated executor so API requests return at once.
+
+    on_update(job) is called whenever a job starts or finishes. Only the
+    most recent max_finished finished jobs are kept for job_status queries.
+    """
+
+    def __init__(self, max_workers=4, on_update=None, max_finished=100):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tapo_p110_job")
+        self._on_update = on_update
+        self._max_finished = max_finished
+        self._lock = threading.Lock()
+        self._jobs = collections.OrderedDict()
+
+    def submit(self, command, device_id, func):
+        """Queue func() and return its Job.
+
+        func's return value becomes the job result. A result with success
+        false fails the job, with the result's error as the job's.
+        """
+        job = Job(command, device_id)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, func)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def _run(self, job, func):
+        job.status = JOB_RUNNING
+        job.started = time.time()
+        self._notify(job)
+        try:
+            job.result = func()
+            if isinstance(job.result, dict) and job.result.get("success") is False:
+                job.error = job.result.get("error") or "Command failed"
+                job.status = JOB_FAILED
+            else:
+                job.status = JOB_DONE
+        except Exception as e:
+            job.error = str(e)
+            job.status = JOB_FAILED
+        job.finished = time.time()
+        self._notify(job)
+
+    def _notify(self, job):
+        if self._on_update is not None:
+            self._on_update(job)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - self._max_finished)]:
+            del self._jobs[job_id]
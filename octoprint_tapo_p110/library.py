@@ -0,0 +1,121 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import importlib
+import subprocess
+import sys
+import threading
+import time
+
+PYP100_PACKAGE = "git+https://github.com/almottier/TapoP100.git@main"
+
+# Seconds a pip install may take before it is given up
+INSTALL_TIMEOUT = 600
+
+LIBRARY_UNCHECKED = "unchecked"
+LIBRARY_AVAILABLE = "available"
+LIBRARY_MISSING = "missing"
+LIBRARY_INSTALLING = "installing"
+
+
+class ClientLoader(object):
+    """Imports the PyP100 client library on first use instead of at plugin import.
+
+    The outcome is remembered, so a missing library costs one failed import
+    and not one per device call. install() runs pip on demand and retries
+    the import afterwards.
+    """
+
+    def __init__(self, logger, module="PyP100"):
+        self._logger = logger
+        self._module_name = module
+        self._lock = threading.Lock()
+        self._module = None
+        self._status = LIBRARY_UNCHECKED
+        self._error = None
+        self._checked = None
+        self._package = None
+
+    def get_client_class(self):
+        """The P110 client class, or None if PyP100 can't be imported"""
+        module = self._load()
+        return module.P110 if module is not None else None
+
+    def check(self):
+        """Import the library now and log the outcome, meant for a background thread"""
+        module = self._load()
+        if module is None:
+            self._logger.error(f"PyP100 library is not available: {self._error}. "
+                               f"Install it from the plugin settings or with: pip install {PYP100_PACKAGE}")
+        else:
+            self._logger.info(f"PyP100 library loaded successfully from: {getattr(module, '__file__', '?')}")
+        return module is not None
+
+    def status(self):
+        with self._lock:
+            module = self._module
+            return dict(
+                status=self._status,
+                error=self._error,
+                checked=self._checked,
+                location=getattr(module, "__file__", None),
+                version=self._version() if module is not None else None,
+                package=PYP100_PACKAGE
+            )
+
+    def install(self):
+        """pip install PyP100 into OctoPrint's environment and load it"""
+        with self._lock:
+            if self._status == LIBRARY_INSTALLING:
+                raise RuntimeError("PyP100 is already being installed")
+            self._status = LIBRARY_INSTALLING
+
+        self._logger.info(f"Installing {PYP100_PACKAGE}")
+        try:
+            result = subprocess.run([sys.executable, "-m", "pip", "install", PYP100_PACKAGE],
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    universal_newlines=True, timeout=INSTALL_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            self._set_failed(f"pip install failed: {e}")
+            raise RuntimeError(self._error)
+        if result.returncode != 0:
+            self._logger.error(f"pip install failed:\n{result.stdout}")
+            self._set_failed(f"pip install failed with exit code {result.returncode}")
+            raise RuntimeError(self._error)
+
+        with self._lock:
+            self._status = LIBRARY_UNCHECKED
+        importlib.invalidate_caches()
+        if not self.check():
+            raise RuntimeError(self._error)
+        return self.status()
+
+    def _load(self):
+        with self._lock:
+            if self._status in (LIBRARY_AVAILABLE, LIBRARY_MISSING, LIBRARY_INSTALLING):
+                return self._module
+
+            self._checked = time.time()
+            try:
+                package = importlib.import_module(self._module_name)
+                self._module = importlib.import_module(self._module_name + ".PyP110")
+                self._status = LIBRARY_AVAILABLE
+                self._error = None
+                self._package = package
+            except Exception as e:
+                self._module = None
+                self._status = LIBRARY_MISSING
+                self._error = f"{type(e).__name__}: {e}"
+            return self._module
+
+    def _set_failed(self, error):
+        with self._lock:
+            self._status = LIBRARY_MISSING
+            self._error = error
+
+    def _version(self):
+        try:
+            from importlib import metadata
+            return metadata.version(self._module_name)
+        except Exception:
+            return getattr(self._package, "__version__", None)
@@ -0,0 +1,219 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import bisect
+import threading
+import time
+
+from .connection import is_timeout_error
+
+# Histogram bucket upper bounds in seconds, from a quick LAN reply to a hung handshake
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Device operations with their own latency histogram
+OPERATIONS = ("connect", "handshake", "login", "get_device_info", "get_energy_usage", "multiple_request",
+              "turn_on", "turn_off")
+
+COUNTER = "counter"
+HISTOGRAM = "histogram"
+
+
+class Counter(object):
+    __slots__ = ("_lock", "_value")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def get(self):
+        return self._value
+
+
+class Histogram(object):
+    """Observations counted into fixed buckets, so recording is one bisect and one increment"""
+
+    __slots__ = ("bounds", "_lock", "_counts", "_sum")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.bounds) + 1)  # the last one is +Inf
+        self._sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def get(self):
+        """count, sum and cumulative bucket counts, like Prometheus exposes them"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative, running = [], 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return dict(count=running, sum=total, buckets=cumulative)
+
+    def quantile(self, q, data=None):
+        """Estimate a quantile by interpolating within its bucket, None without observations"""
+        data = data or self.get()
+        if not data["count"]:
+            return None
+        rank = q * data["count"]
+        lower, previous = 0.0, 0
+        for bound, cumulative in zip(self.bounds + (None,), data["buckets"]):
+            if cumulative >= rank:
+                if bound is None:
+                    return lower  # beyond the last bucket, the best we can say
+                inside = cumulative - previous
+                return lower + (bound - lower) * ((rank - previous) / inside if inside else 1.0)
+            lower, previous = bound, cumulative
+        return lower
+
+
+class MetricFamily(object):
+    """One metric name with a child Counter or Histogram per combination of label values"""
+
+    def __init__(self, name, kind, description, labels, factory):
+        self.name = name
+        self.kind = kind
+        self.description = description
+        self.labels = tuple(labels)
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def child(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._factory())
+        return child
+
+    def children(self):
+        with self._lock:
+            return sorted(self._children.items())
+
+
+class MetricsRegistry(object):
+    """In-process metrics, exported as a dict for the API and as Prometheus text"""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._families = []
+
+    def counter(self, name, description, labels=()):
+        return self._add(MetricFamily(f"{self.prefix}_{name}", COUNTER, description, labels, Counter))
+
+    def histogram(self, name, description, labels=(), bounds=LATENCY_BUCKETS):
+        return self._add(MetricFamily(f"{self.prefix}_{name}", HISTOGRAM, description, labels,
+                                      lambda: Histogram(bounds)))
+
+    def _add(self, family):
+        self._families.append(family)
+        return family
+
+    def to_dict(self):
+        result = {}
+        for family in self._families:
+            samples = []
+            for values, child in family.children():
+                sample = dict(labels=dict(zip(family.labels, values)))
+                if family.kind == HISTOGRAM:
+                    data = child.get()
+                    sample.update(count=data["count"], sum=data["sum"],
+                                  p50=child.quantile(0.5, data), p95=child.quantile(0.95, data),
+                                  p99=child.quantile(0.99, data))
+                else:
+                    sample["value"] = child.get()
+                samples.append(sample)
+            result[family.name] = dict(type=family.kind, help=family.description, samples=samples)
+        return result
+
+    def to_prometheus(self):
+        """Text exposition format 0.0.4"""
+        lines = []
+        for family in self._families:
+            lines.append(f"# HELP {family.name} {family.description}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for values, child in family.children():
+                labels = [f'{name}="{_escape(value)}"' for name, value in zip(family.labels, values)]
+                if family.kind == HISTOGRAM:
+                    data = child.get()
+                    for bound, cumulative in zip(child.bounds + (None,), data["buckets"]):
+                        le = "+Inf" if bound is None else repr(float(bound))
+                        bucket = labels + [f'le="{le}"']
+                        lines.append(f"{family.name}_bucket{_labels(bucket)} {cumulative}")
+                    lines.append(f"{family.name}_sum{_labels(labels)} {data['sum']!r}")
+                    lines.append(f"{family.name}_count{_labels(labels)} {data['count']}")
+                else:
+                    lines.append(f"{family.name}{_labels(labels)} {child.get()}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels):
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class PluginMetrics(MetricsRegistry):
+    """The plugin's metrics, recorded through DeviceMetrics bound to one plug"""
+
+    def __init__(self):
+        super(PluginMetrics, self).__init__("tapo_p110")
+        self.latency = self.histogram("request_duration_seconds",
+                                      "Time spent in device operations, failed ones included",
+                                      ("device", "operation"))
+        self.errors = self.counter("errors_total", "Device operations that failed", ("device", "operation"))
+        self.timeouts = self.counter("timeouts_total", "Device operations that timed out", ("device", "operation"))
+        self.retries = self.counter("connect_retries_total",
+                                    "Connection attempts beyond the first, hedged or retried", ("device",))
+        self.reconnects = self.counter("reconnects_total", "Sessions opened again after one was lost", ("device",))
+        self.cache = self.counter("cache_requests_total", "Reads that could be served from the state cache",
+                                  ("device", "group", "result"))
+        self.anomalies = self.counter("power_anomalies_total", "Power anomalies detected", ("device", "kind"))
+
+    def for_device(self, device_id):
+        return DeviceMetrics(self, device_id)
+
+
+class DeviceMetrics(object):
+    """Metric children of one plug, looked up once so recording skips the label lookup"""
+
+    def __init__(self, metrics, device_id):
+        self.latency = dict((operation, metrics.latency.child(device_id, operation)) for operation in OPERATIONS)
+        self._errors = dict((operation, metrics.errors.child(device_id, operation)) for operation in OPERATIONS)
+        self._timeouts = dict((operation, metrics.timeouts.child(device_id, operation)) for operation in OPERATIONS)
+        self.retries = metrics.retries.child(device_id)
+        self.reconnects = metrics.reconnects.child(device_id)
+        self._cache = metrics.cache
+        self._device_id = device_id
+
+    def timed(self, operation, func):
+        """Call func, recording its duration and whether it failed or timed out"""
+        start = time.perf_counter()
+        try:
+            return func()
+        except Exception as e:
+            self.failed(operation, e)
+            raise
+        finally:
+            self.latency[operation].observe(time.perf_counter() - start)
+
+    def failed(self, operation, error):
+        self._errors[operation].inc()
+        if is_timeout_error(error):
+            self._timeouts[operation].inc()
+
+    def cache(self, group, hit):
+        self._cache.child(self._device_id, group, "hit" if hit else "miss").inc()
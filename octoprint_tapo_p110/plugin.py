@@ -0,0 +1,1132 @@
+# coding=utf-8
+from __future__ import absolute_import
+import collections
+import math
+import os
+import threading
+import time
+
+import octoprint.plugin
+import flask
+from octoprint.access.permissions import Permissions
+
+from .actions import PowerActionScheduler, ACTION_TURN_ON, ACTION_TURN_OFF
+from .accounting import PrintEnergyLedger, RESULT_DONE, RESULT_FAILED, RESULT_CANCELLED
+from .adaptive import AdaptiveSchedule, ACTIVITY_PRINTING, ACTIVITY_HEATING, ACTIVITY_IDLE
+from .anomaly import (PowerAnomalyDetector, ANOMALY_ACTIONS, ANOMALY_ACTION_NONE, ANOMALY_ACTION_EVENT,
+                      ANOMALY_ACTION_PAUSE, ANOMALY_ACTION_CUTOFF)
+from .breaker import CircuitBreaker
+from .bulk import BulkRunner
+from .cache import GROUP_STATE, GROUP_INFO, GROUP_ENERGY
+from .connection import Connector
+from .cooldown import CooldownMonitor
+from .delta import read_fields, project, payload_etag, diff
+from .device import TapoDevice
+from .discovery import Discovery, DiscoveryCache, BROADCAST_ADDRESS, normalize_mac
+from .export import EXPORT_FORMATS, stream_export
+from .jobs import JobManager
+from .library import ClientLoader
+from .metrics import PluginMetrics
+from .polling import PollingEngine
+from .timeseries import PowerStore
+from .tracing import Tracer
+
+# Status fields that change on every read and would defeat change detection
+VOLATILE_STATUS_FIELDS = ("on_time", "rssi", "signal_level", "time_diff", "local_time")
+
+# Fields that change on every read but no client shows, they don't change an etag unless asked for
+UNDISPLAYED_FIELDS = ("rssi", "time_diff", "local_time")
+
+# Pushed updates sent as the fields changed since the previous one, once a client has that one
+DELTA_PUSH_KINDS = ("status", "energy")
+
+# Commands that talk to the plug and run as background jobs in async mode
+ASYNC_COMMANDS = ("turn_on", "turn_off", "toggle", "test_connection")
+
+# Commands that switch several plugs at once, picked by ID or group
+BULK_COMMANDS = ("bulk_turn_on", "bulk_turn_off")
+
+# Print end events and the result they record for the print's energy
+PRINT_END_EVENTS = dict(PrintDone=RESULT_DONE, PrintFailed=RESULT_FAILED, PrintCancelled=RESULT_CANCELLED)
+
+# auto_off_mode values: turn off a fixed delay after the print, or once the printer has cooled down
+AUTO_OFF_DELAY = "delay"
+AUTO_OFF_TEMPERATURE = "temperature"
+
+# Reason of the turn off that caps the wait for the printer to cool down
+REASON_COOLDOWN = "cooldown"
+
+# Events after which the printer plug's poll interval is worked out again
+PRINTER_STATE_EVENTS = ("PrintStarted", "PrintPaused", "PrintResumed", "PrintDone", "PrintFailed", "PrintCancelled")
+
+# Most buckets a get_history reply holds, coarser resolutions are used beyond that
+MAX_HISTORY_BUCKETS = 1000
+
+# Device ID used for the single plug configured through device_ip/username/password
+DEFAULT_DEVICE_ID = "default"
+
+# Custom event fired for power anomalies, as plugin_tapo_p110_power_anomaly
+EVENT_POWER_ANOMALY = "power_anomaly"
+
+# Degrees below its target at which a heater still counts as heating up
+HEAT_UP_MARGIN = 5
+
+
+class TapoP110Plugin(octoprint.plugin.StartupPlugin,
+                     octoprint.plugin.TemplatePlugin,
+                     octoprint.plugin.SettingsPlugin,
+                     octoprint.plugin.AssetPlugin,
+                     octoprint.plugin.SimpleApiPlugin,
+                     octoprint.plugin.EventHandlerPlugin,
+                     octoprint.plugin.BlueprintPlugin,
+                     octoprint.plugin.ShutdownPlugin):
+
+    def __init__(self):
+        self.devices = collections.OrderedDict()
+        self.devices_lock = threading.Lock()
+        self.polling = None
+        self.schedule = AdaptiveSchedule()
+        self.jobs = None
+        self.bulk = None
+        self.discovery = None
+        self.library = None
+        self.power_stores = {}
+        self.power_stores_lock = threading.Lock()
+        self.print_energy = None
+        self.actions = None
+        self.cooldown = CooldownMonitor(self._on_cooled_down)
+        self.anomalies = PowerAnomalyDetector(self._on_power_anomaly)
+        self.metrics = PluginMetrics()
+        self.tracer = Tracer()
+        self._published = {}
+
+    def initialize(self):
+        # PyP100 is imported on first use, so loading the plugin never waits for it
+        self.library = ClientLoader(self._logger)
+        self.tracer.configure(self._settings.get_int(["trace_buffer_size"]))
+        self.jobs = JobManager(on_update=self._publish_job)
+        self.bulk = BulkRunner(self._settings.get_int(["bulk_workers"]))
+        self.discovery = Discovery(DiscoveryCache(os.path.join(self.get_plugin_data_folder(), "discovery.json"),
+                                                  logger=self._logger),
+                                   self._logger,
+                                   key_path=os.path.join(self.get_plugin_data_folder(), "discovery_key.pem"))
+        self._configure_discovery()
+        self.print_energy = PrintEnergyLedger(os.path.join(self.get_plugin_data_folder(), "print_energy.json"),
+                                              logger=self._logger)
+        self.actions = PowerActionScheduler(os.path.join(self.get_plugin_data_folder(), "actions.json"),
+                                            self._run_action, on_change=self._on_actions_changed, logger=self._logger)
+        self._configure_cooldown()
+        self._sync_cooldown(self.actions.list())
+        self._configure_anomalies()
+        self._load_devices()
+
+    ##~~ SettingsPlugin mixin
+
+    def get_settings_defaults(self):
+        return dict(
+            device_ip='',
+            device_mac='',  # finds the plug again if its IP changes, learned on the first connection if blank
+            username='',
+            password='',
+            # Additional plugs: list of dicts with id, name, ip and optionally
+            # username/password (blank ones fall back to the account above),
+            # mac and a group for bulk commands
+            devices=[],
+            printer_device='',  # plug switched by print events, first one if blank
+            auto_on_print_start=False,
+            auto_off_print_end=False,
+            auto_off_delay=300,  # 5 minutes
+            auto_off_mode=AUTO_OFF_DELAY,
+            auto_off_hotend_temp=50,  # turn off once every hotend is at or below this...
+            auto_off_bed_temp=40,  # ...and the bed at or below this (degrees Celsius)
+            auto_off_hysteresis=3,  # degrees above the thresholds that count as heating up again
+            auto_off_max_wait=1800,  # turn off after this many seconds even if still warm
+            enable_energy_monitoring=True,
+            energy_update_interval=30,  # poll interval while the printer is idle
+            poll_interval_active=2,  # poll interval while the printer is heating or printing
+            poll_interval_off=300,  # poll interval while the plug is switched off
+            poll_budget=60,  # most requests per minute and plug
+            poll_workers=8,  # plugs polled at the same time
+            bulk_workers=32,  # plugs switched at the same time by bulk commands
+            bulk_stagger=0,  # seconds between plugs when bulk switching on, limits combined inrush current
+            connect_deadline=10,  # give up connecting after this many seconds
+            connect_hedge_delay=2,  # start a second handshake if the first is this slow
+            connect_probe_timeout=1.5,  # TCP reachability check before the handshake
+            auto_rediscover=True,  # look a plug up by MAC when it stops answering at its IP
+            discovery_address=BROADCAST_ADDRESS,  # where discovery probes go, host or host:port
+            discovery_timeout=3,  # seconds to wait for plugs to answer a discovery probe
+            breaker_failure_threshold=3,  # consecutive failures before calls fail fast
+            breaker_base_delay=5,  # first backoff delay, doubled after every failed probe
+            breaker_max_delay=300,
+            async_commands=False,  # device commands return a job ID right away, per request with async
+            cache_max_age_state=15,  # switch state
+            cache_max_age_info=300,  # nickname, firmware, signal...
+            cache_max_age_energy=30,
+            toggle_max_age=15,  # trust the cached switch state this long when toggling
+            anomaly_detection=True,  # watch the printer plug's power for signs of trouble
+            anomaly_max_power=0,  # over-draw limit in watts, 0 learns it from the heat-up peak
+            anomaly_overdraw_time=120,  # seconds above the limit with the heaters at temperature
+            anomaly_drop_threshold=2,  # watts or less mid-print count as a power loss
+            anomaly_idle_max_power=60,  # most watts drawn with no print running and no heater target
+            anomaly_idle_time=120,  # seconds above that before it counts
+            anomaly_action_overdraw=ANOMALY_ACTION_EVENT,  # none, event, pause or cutoff
+            anomaly_action_power_loss=ANOMALY_ACTION_EVENT,
+            anomaly_action_idle_heating=ANOMALY_ACTION_EVENT,
+            history_raw_days=7,  # keep every power sample this long, then minute averages
+            history_retention_days=90,  # delete power history older than this
+            trace_buffer_size=2000  # spans of recent requests kept for get_traces, 0 turns tracing off
+        )
+
+    def on_settings_save(self, data):
+        octoprint.plugin.SettingsPlugin.on_settings_save(self, data)
+        # Apply the new settings, plugs only reconnect if how to reach them changed
+        self._configure_schedule()
+        self._configure_cooldown()
+        self._configure_anomalies()
+        self.tracer.configure(self._settings.get_int(["trace_buffer_size"]))
+        self._configure_discovery()
+        self._configure_history()
+        self._load_devices()
+
+    ##~~ AssetPlugin mixin
+
+    def get_assets(self):
+        return dict(
+            js=["js/tapo_p110.js"],
+            css=["css/tapo_p110.css"]
+        )
+
+    ##~~ TemplatePlugin mixin
+
+    def get_template_configs(self):
+        return [
+            dict(type="settings", custom_bindings=False),
+            dict(type="tab", custom_bindings=False)
+        ]
+
+    ##~~ SimpleApiPlugin mixin
+
+    def get_api_commands(self):
+        return dict(
+            turn_on=[],
+            turn_off=[],
+            toggle=[],
+            get_status=[],
+            get_energy=[],
+            get_snapshot=[],
+            get_history=[],
+            test_connection=[],
+            bulk_turn_on=[],
+            bulk_turn_off=[],
+            discover_devices=[],
+            get_devices=[],
+            get_stats=[],
+            get_metrics=[],
+            get_traces=[],
+            get_job_energy=[],
+            get_scheduled_actions=[],
+            get_library_status=[],
+            install_library=[],
+            cancel_action=["action"],
+            job_status=["job"]
+        )
+
+    def on_api_command(self, command, data):
+        if command == "get_traces":
+            return self._get_traces(data)
+        with self.tracer.span(f"api.{command}", device=data.get("device")):
+            return self._on_api_command(command, data)
+
+    def _on_api_command(self, command, data):
+        if command == "get_devices":
+            return flask.jsonify(devices=self._describe_devices())
+        elif command == "get_stats":
+            devices = self._get_devices()
+            return flask.jsonify(dispatcher=dict((device.id, device.dispatcher.get_stats()) for device in devices),
+                                 polling=self.schedule.get_stats(),
+                                 tracing=self.tracer.get_stats(),
+                                 anomalies=self.anomalies.get_state(),
+                                 history=dict((device.id, self._get_power_store(device).get_stats()) for device in devices))
+        elif command == "get_metrics":
+            return flask.jsonify(metrics=self.metrics.to_dict())
+        elif command == "get_job_energy":
+            if data.get("path"):
+                job = self.print_energy.get(data["path"])
+                if job is None:
+                    return flask.make_response(flask.jsonify(error=f"No energy recorded for {data['path']}"), 404)
+                return flask.jsonify(path=data["path"], job=job)
+            return flask.jsonify(jobs=self.print_energy.get(), active=self.print_energy.active(time.time()))
+        elif command == "get_library_status":
+            return flask.jsonify(library=self.library.status(), can_install=self._can_install_library())
+        elif command == "install_library":
+            if not self._can_install_library():
+                return flask.make_response(flask.jsonify(error="Installing PyP100 needs the permission to install plugins"), 403)
+            job = self.jobs.submit(command, None, self.library.install)
+            return flask.make_response(flask.jsonify(job=job.to_dict()), 202)
+        elif command == "get_scheduled_actions":
+            return flask.jsonify(actions=[action.to_dict() for action in self.actions.list()])
+        elif command == "cancel_action":
+            action = self.actions.cancel(data.get("action"))
+            if action is None:
+                return flask.make_response(flask.jsonify(error=f"Unknown action: {data.get('action')}"), 404)
+            self._logger.info(f"Cancelled scheduled {action.action} of {action.device}")
+            return flask.jsonify(success=True, action=action.to_dict())
+        elif command == "job_status":
+            job = self.jobs.get(data.get("job"))
+            if job is None:
+                return flask.make_response(flask.jsonify(error=f"Unknown job: {data.get('job')}"), 404)
+            return flask.jsonify(job=job.to_dict())
+
+        elif command == "discover_devices":
+            return self._discover_devices(data)
+        elif command in BULK_COMMANDS:
+            return self._on_bulk_command(command, data)
+
+        # Everything else acts on a single plug, the first one unless specified
+        device = self._get_device(data.get("device"))
+        if device is None:
+            return flask.make_response(flask.jsonify(error=f"Unknown device: {data.get('device')}"), 404)
+
+        if command in ASYNC_COMMANDS and self._is_async(data):
+            parent = self.tracer.current()
+            job = self.jobs.submit(command, device.id, lambda: self._run_job(command, device, data, parent))
+            return flask.make_response(flask.jsonify(job=job.to_dict()), 202)
+        return flask.jsonify(**self._run_device_command(command, device, data))
+
+    def _run_job(self, command, device, data, parent):
+        with self.tracer.span(f"job.{command}", parent=parent, device=device.id):
+            return self._run_device_command(command, device, data)
+
+    def _on_bulk_command(self, command, data):
+        """Switch the plugs listed in devices, those of a group or all of them at once"""
+        if data.get("devices"):
+            device_ids = data["devices"]
+            if isinstance(device_ids, str):
+                device_ids = [device_id.strip() for device_id in device_ids.split(",")]
+            device_ids = list(collections.OrderedDict.fromkeys(device_ids))
+            with self.devices_lock:
+                unknown = [device_id for device_id in device_ids if device_id not in self.devices]
+                devices = [self.devices[device_id] for device_id in device_ids if device_id in self.devices]
+            if unknown:
+                return flask.make_response(flask.jsonify(error=f"Unknown devices: {', '.join(map(str, unknown))}"), 404)
+        elif data.get("group"):
+            devices = [device for device in self._get_devices() if device.group == data["group"]]
+            if not devices:
+                return flask.make_response(flask.jsonify(error=f"No plugs in group: {data['group']}"), 404)
+        elif data.get("all"):
+            devices = self._get_devices(configured_only=True)
+        else:
+            return flask.make_response(flask.jsonify(error="Pass devices, group or all"), 400)
+
+        stagger = self._read_stagger(data) if command == "bulk_turn_on" else 0.0
+        if self._is_async(data):
+            parent = self.tracer.current()
+            job = self.jobs.submit(command, data.get("group"),
+                                   lambda: self._run_bulk(command, devices, stagger, parent))
+            return flask.make_response(flask.jsonify(job=job.to_dict()), 202)
+        return flask.jsonify(**self._run_bulk(command, devices, stagger))
+
+    def _run_bulk(self, command, devices, stagger, parent=None):
+        """Switch all devices in parallel, returning each one's result and timing"""
+        action = self._turn_on if command == "bulk_turn_on" else self._turn_off
+        with self.tracer.span(f"bulk.{command}", parent=parent, devices=len(devices), stagger=stagger) as span:
+            def run(device):
+                with self.tracer.span("bulk.device", parent=span, device=device.id):
+                    return self._device_result(device, success=action(device))
+
+            results, elapsed = self.bulk.run(devices, run, stagger)
+            succeeded = sum(1 for result in results if result.get("success"))
+            failed = len(results) - succeeded
+            span.set(succeeded=succeeded, failed=failed)
+            if failed:
+                span.fail(f"{failed} of {len(results)} plugs failed")
+
+        self._logger.info(f"{command} of {len(results)} plugs took {elapsed:.2f}s, {failed} failed")
+        result = dict(command=command, success=not failed, succeeded=succeeded, failed=failed,
+                      stagger=stagger, duration=round(elapsed, 4), devices=results)
+        if failed:
+            result["error"] = f"{failed} of {len(results)} plugs failed"
+        return result
+
+    def _read_stagger(self, data):
+        """Seconds between plugs when bulk switching on, from the request or the settings"""
+        if data.get("stagger") is not None:
+            try:
+                return max(0.0, float(data["stagger"]))
+            except (TypeError, ValueError):
+                self._logger.warning(f"Ignoring invalid stagger: {data['stagger']!r}")
+        return max(0.0, self._settings.get_float(["bulk_stagger"]))
+
+    def _discover_devices(self, data):
+        """Plugs answering a discovery probe, or those found before with cached=true"""
+        start = time.monotonic()
+        if data.get("cached"):
+            found = self.discovery.cache.list()
+        else:
+            try:
+                timeout = min(30.0, max(0.1, float(data.get("timeout", self.discovery.timeout))))
+            except (TypeError, ValueError):
+                return flask.make_response(flask.jsonify(error="timeout must be a number"), 400)
+            with self.tracer.span("discovery.scan", timeout=timeout) as span:
+                found = self.discovery.scan(timeout)
+                span.set(found=len(found))
+
+        configured = dict((device.mac, device.id) for device in self._get_devices() if device.mac)
+        for entry in found:
+            entry["configured"] = configured.get(entry["mac"])
+        return flask.jsonify(devices=found, duration=round(time.monotonic() - start, 3))
+
+    def _get_traces(self, data):
+        """Recent traces as JSON, or in Chrome's trace format with format=chrome"""
+        try:
+            limit = int(data.get("limit", 50))
+            min_duration = float(data.get("min_duration", 0)) / 1000.0
+        except (TypeError, ValueError):
+            return flask.make_response(flask.jsonify(error="limit and min_duration must be numbers"), 400)
+
+        traces = self.tracer.traces(data.get("trace"), limit, min_duration)
+        if data.get("trace") and not traces:
+            return flask.make_response(flask.jsonify(error=f"Unknown trace: {data['trace']}"), 404)
+        if data.get("format") == "chrome":
+            return flask.jsonify(**self.tracer.to_chrome(traces))
+        return flask.jsonify(traces=traces, stats=self.tracer.get_stats())
+
+    def _is_async(self, data):
+        """Whether to run a device command as a job, per request or from the settings"""
+        value = data.get("async")
+        if value is None:
+            return self._settings.get_boolean(["async_commands"])
+        if isinstance(value, str):
+            # Parsed like a boolean setting, so "false" from a form or query string is false
+            return value.strip().lower() in ("true", "yes", "y", "on", "1")
+        return bool(value)
+
+    def _run_device_command(self, command, device, data):
+        if command == "turn_on":
+            return self._device_result(device, success=self._turn_on(device))
+        elif command == "turn_off":
+            return self._device_result(device, success=self._turn_off(device))
+        elif command == "toggle":
+            return self._device_result(device, success=self._toggle(device))
+        elif command == "get_status":
+            fields = read_fields(data.get("fields"))
+            status = project(self._get_status(device, **self._read_options(data)), fields)
+            etag = self._etag(status, fields)
+            if etag is not None and data.get("etag") == etag:
+                return self._not_modified(device, etag)
+            return self._device_result(device, status=status, etag=etag)
+        elif command == "get_energy":
+            energy = self._get_energy_usage(device, **self._read_options(data))
+            etag = self._etag(energy)
+            if etag is not None and data.get("etag") == etag:
+                return self._not_modified(device, etag)
+            return self._device_result(device, energy=energy, etag=etag)
+        elif command == "get_snapshot":
+            snapshot = self._get_snapshot(device, **self._read_options(data))
+            if snapshot is None:
+                return self._device_result(device, snapshot=snapshot)
+            fields = read_fields(data.get("fields"))
+            snapshot = dict(snapshot, status=project(snapshot["status"], fields))
+            etag = dict(status=self._etag(snapshot["status"], fields), energy=self._etag(snapshot["energy"]))
+            if data.get("etag") == etag:
+                return self._not_modified(device, etag)
+            return self._device_result(device, snapshot=snapshot, etag=etag)
+        elif command == "get_history":
+            start, end, resolution = self._read_history_range(data)
+            history, resolution = self._get_power_store(device).history(start, end, resolution)
+            return dict(device=device.id, start=start, end=end, resolution=resolution, history=history)
+        elif command == "test_connection":
+            deadline = self._read_deadline(data)
+            return self._device_result(device, success=device.test_connection(deadline))
+
+    def _can_install_library(self):
+        """Whether the current user may pip install into OctoPrint's environment, as the plugin manager allows"""
+        permission = Permissions.find("PLUGIN_PLUGINMANAGER_INSTALL") or Permissions.ADMIN
+        return permission.can()
+
+    def _device_result(self, device, **result):
+        """Reply for a device command, explaining failures and the connection state"""
+        failed = any(value is None or value is False for value in result.values())
+        if failed and device.last_error:
+            result["error"] = device.last_error
+            span = self.tracer.current()
+            if span is not None:
+                span.fail(device.last_error)
+        return dict(device=device.id, connection=device.breaker.snapshot(), **result)
+
+    def _etag(self, payload, fields=None):
+        """Etag of a reply's payload, as cut down to fields. Undisplayed fields only count if asked for"""
+        return payload_etag(payload, [field for field in UNDISPLAYED_FIELDS if not fields or field not in fields])
+
+    def _not_modified(self, device, etag):
+        """Reply for a read whose result the client already has, as told by the etag it sent"""
+        return dict(device=device.id, connection=device.breaker.snapshot(), etag=etag, not_modified=True)
+
+    def _read_options(self, data):
+        """Extract the cache options (force, max_age) from an API request"""
+        options = dict(force=bool(data.get("force", False)), max_age=None)
+        if data.get("max_age") is not None:
+            try:
+                options["max_age"] = max(0.0, float(data["max_age"]))
+            except (TypeError, ValueError):
+                self._logger.warning(f"Ignoring invalid max_age: {data['max_age']!r}")
+        return options
+
+    def _read_deadline(self, data):
+        """Connection deadline requested by an API client, if any"""
+        if data.get("deadline") is None:
+            return None
+        try:
+            return max(0.5, float(data["deadline"]))
+        except (TypeError, ValueError):
+            self._logger.warning(f"Ignoring invalid deadline: {data['deadline']!r}")
+            return None
+
+    def _read_history_range(self, data):
+        """start, end and resolution of a get_history request, defaulting to the last 24 hours"""
+        now = time.time()
+        values = dict(start=now - 86400, end=now, resolution=None)
+        for key in values:
+            if data.get(key) is not None:
+                try:
+                    values[key] = float(data[key])
+                except (TypeError, ValueError):
+                    self._logger.warning(f"Ignoring invalid {key}: {data[key]!r}")
+
+        start, end = values["start"], max(values["start"], values["end"])
+        minimum = (end - start) / MAX_HISTORY_BUCKETS
+        resolution = max(60, minimum, values["resolution"] or 0)
+        return int(start), int(end), int(math.ceil(resolution))
+
+    ##~~ EventHandlerPlugin mixin
+
+    def on_event(self, event, payload):
+        device = self._get_device(self._settings.get(["printer_device"]) or None)
+        if device is None:
+            return
+
+        if event == "PrintStarted":
+            self.print_energy.start(payload.get("path"), payload.get("name"), payload.get("origin"),
+                                    device.id, time.time())
+        elif event in PRINT_END_EVENTS:
+            result = PRINT_END_EVENTS[event]
+            if event == "PrintFailed" and payload.get("reason") == "cancelled":
+                result = RESULT_CANCELLED
+            self._finish_print_energy(result)
+
+        if event in PRINTER_STATE_EVENTS:
+            self._reschedule(device)
+
+        if event == "PrintStarted":
+            # A new print must never lose its power to the previous print's auto-off
+            if self.actions.cancel_matching(device.id, ACTION_TURN_OFF):
+                self._logger.info(f"Print started - cancelled scheduled turn off of {device.name}")
+
+        if event == "PrintStarted" and self._settings.get_boolean(["auto_on_print_start"]):
+            self._logger.info(f"Print started - turning on {device.name}")
+            self._turn_on(device)
+        elif event == "PrintDone" and self._settings.get_boolean(["auto_off_print_end"]):
+            self.actions.cancel_matching(device.id, ACTION_TURN_OFF)
+            if self._settings.get(["auto_off_mode"]) == AUTO_OFF_TEMPERATURE:
+                max_wait = self._settings.get_int(["auto_off_max_wait"])
+                self._logger.info(f"Print done - turning off {device.name} once cooled down, at most in {max_wait} seconds")
+                self.actions.schedule(device.id, ACTION_TURN_OFF, max_wait, reason=REASON_COOLDOWN)
+            else:
+                delay = self._settings.get_int(["auto_off_delay"])
+                self._logger.info(f"Print done - turning off {device.name} in {delay} seconds")
+                self.actions.schedule(device.id, ACTION_TURN_OFF, delay, reason="print_done")
+
+    def _run_action(self, action):
+        """Carry out a scheduled power action"""
+        device = self._get_device(action.device)
+        if device is None:
+            self._logger.warning(f"Dropping scheduled {action.action}: unknown device {action.device}")
+            return
+        self._logger.info(f"Running scheduled {action.action} of {device.name}")
+        with self.tracer.span(f"action.{action.action}", device=device.id, reason=action.reason):
+            if action.action == ACTION_TURN_ON:
+                self._turn_on(device)
+            elif action.action == ACTION_TURN_OFF:
+                self._turn_off(device)
+
+    ##~~ Temperature-aware auto-off
+
+    def _configure_cooldown(self):
+        self.cooldown.configure(self._settings.get_float(["auto_off_hotend_temp"]),
+                                self._settings.get_float(["auto_off_bed_temp"]),
+                                self._settings.get_float(["auto_off_hysteresis"]))
+
+    def _sync_cooldown(self, actions):
+        """Watch the temperatures exactly while a cooldown turn off is pending"""
+        waiting = [action.device for action in actions if action.reason == REASON_COOLDOWN]
+        if waiting:
+            self.cooldown.arm(waiting[0])
+        else:
+            self.cooldown.disarm()
+
+    def _on_cooled_down(self, device_id):
+        self._logger.info(f"Printer cooled down - turning off {device_id}")
+        self.actions.cancel_matching(device_id, ACTION_TURN_OFF)
+        self.actions.schedule(device_id, ACTION_TURN_OFF, 0, reason="cooled_down")
+
+    def on_temperatures_received(self, comm_instance, parsed_temperatures, *args, **kwargs):
+        self.cooldown.update(parsed_temperatures)
+        return parsed_temperatures
+
+    def _finish_print_energy(self, result):
+        record = self.print_energy.finish(result, time.time())
+        if record is None:
+            return
+        self._logger.info(f"Print of {record['path']} {result}: {record['energy_wh']:.1f} Wh in {record['duration']:.0f}s "
+                          f"(average {record['average_w']:.1f} W, peak {record['peak_w']:.1f} W)")
+        self._plugin_manager.send_plugin_message(self._identifier, dict(type="print_energy", print_energy=record))
+
+    ##~~ Device registry
+
+    def _load_devices(self):
+        """(Re)build the device registry from the settings.
+
+        Plugs that were configured before are updated in place, so they
+        keep their session, cached state and connection state unless the
+        way to reach them changed.
+        """
+        username = self._settings.get(["username"])
+        password = self._settings.get(["password"])
+
+        configs = []
+        if self._settings.get(["device_ip"]) or not self._settings.get(["devices"]):
+            configs.append(dict(id=DEFAULT_DEVICE_ID, name="P110", ip=self._settings.get(["device_ip"]),
+                                mac=self._settings.get(["device_mac"])))
+        configs.extend(self._settings.get(["devices"]) or [])
+
+        with self.devices_lock:
+            existing = dict(self.devices)
+        devices = collections.OrderedDict()
+        for index, config in enumerate(configs):
+            device_id = str(config.get("id") or f"plug{index}").strip()
+            if device_id in devices:
+                self._logger.warning(f"Ignoring duplicate device ID {device_id}")
+                continue
+
+            # A MAC learned on an earlier connection only helps finding the plug, it isn't enforced
+            learned_mac = self.discovery.cache.find_device(device_id)
+            mac = normalize_mac(config.get("mac"))
+            name = config.get("name") or device_id
+            ip = self._last_known_address(device_id, config.get("ip"), mac or learned_mac)
+            group = str(config.get("group") or "").strip()
+            device = existing.get(device_id)
+            if device is not None:
+                if device.reconfigure(name, ip, config.get("username") or username,
+                                      config.get("password") or password, group=group, mac=mac):
+                    self._logger.info(f"Connection settings of {device_id} changed, it reconnects on next use")
+                self._configure_connection(device)
+            else:
+                device = TapoDevice(
+                    device_id,
+                    name,
+                    ip,
+                    config.get("username") or username,
+                    config.get("password") or password,
+                    self._get_client_class,
+                    self._logger.getChild(device_id),
+                    connector=self._create_connector(device_id),
+                    breaker=self._create_breaker(),
+                    metrics=self.metrics.for_device(device_id),
+                    tracer=self.tracer,
+                    group=group,
+                    mac=mac
+                )
+                device.breaker.on_change = self._connection_listener(device)
+                device.on_located = self._location_listener(device)
+            device.mac = device.mac or learned_mac
+            device.resolve_address = self.discovery.resolve if self._settings.get_boolean(["auto_rediscover"]) else None
+            devices[device_id] = device
+
+        with self.devices_lock:
+            self.devices = devices
+        for device_id, device in existing.items():
+            if device_id not in devices:
+                device.disconnect()
+        self._published = dict((key, value) for key, value in self._published.items() if key[0] in devices)
+
+        if self.polling is not None:
+            self.polling.set_devices(self._get_devices(configured_only=True))
+
+    def _last_known_address(self, device_id, ip, mac):
+        """The address the plug with this MAC was last found at, the configured one otherwise"""
+        entry = self.discovery.cache.get(mac) if mac else None
+        if entry is None or not entry.get("ip") or entry["ip"] == ip:
+            return ip
+        self._logger.info(f"Using {entry['ip']}, where {device_id} was last found, instead of {ip or 'no address'}")
+        return entry["ip"]
+
+    def _get_devices(self, configured_only=False):
+        with self.devices_lock:
+            devices = list(self.devices.values())
+        if configured_only:
+            devices = [device for device in devices if device.is_configured()]
+        return devices
+
+    def _get_device(self, device_id=None):
+        """Look up a device by ID, defaulting to the first configured one"""
+        with self.devices_lock:
+            if device_id:
+                return self.devices.get(device_id)
+            devices = list(self.devices.values())
+        configured = [device for device in devices if device.is_configured()]
+        if configured:
+            return configured[0]
+        return devices[0] if devices else None
+
+    def _describe_devices(self):
+        result = []
+        for device in self._get_devices():
+            entry = device.to_dict()
+            entry["configured"] = device.is_configured()
+            entry["status"] = device.cached_status(float("inf"), float("inf"))
+            snapshot = device.cache.snapshot(GROUP_ENERGY)
+            entry["energy"] = snapshot.value if snapshot is not None else None
+            entry["etag"] = dict(status=self._etag(entry["status"]), energy=self._etag(entry["energy"]))
+            result.append(entry)
+        return result
+
+    def _create_connector(self, device_id):
+        return Connector(self._logger.getChild(device_id),
+                         deadline=self._settings.get_float(["connect_deadline"]),
+                         hedge_delay=self._settings.get_float(["connect_hedge_delay"]),
+                         probe_timeout=self._settings.get_float(["connect_probe_timeout"]))
+
+    def _configure_connection(self, device):
+        """Apply the connection and breaker settings to a plug created earlier"""
+        device.connector.deadline = self._settings.get_float(["connect_deadline"])
+        device.connector.hedge_delay = self._settings.get_float(["connect_hedge_delay"])
+        device.connector.probe_timeout = self._settings.get_float(["connect_probe_timeout"])
+        device.breaker.configure(self._settings.get_int(["breaker_failure_threshold"]),
+                                 self._settings.get_float(["breaker_base_delay"]),
+                                 self._settings.get_float(["breaker_max_delay"]))
+
+    def _create_breaker(self):
+        return CircuitBreaker(failure_threshold=self._settings.get_int(["breaker_failure_threshold"]),
+                              base_delay=self._settings.get_float(["breaker_base_delay"]),
+                              max_delay=self._settings.get_float(["breaker_max_delay"]))
+
+    def _connection_listener(self, device):
+        def on_change(snapshot):
+            self._logger.info(f"{device.name} connection is now {snapshot['state']}")
+            self._publish(device, "connection", snapshot)
+        return on_change
+
+    def _location_listener(self, device):
+        def on_located(mac, address):
+            self.discovery.cache.remember(mac, address, device.id)
+        return on_located
+
+    def _configure_discovery(self):
+        targets = [target.strip() for target in (self._settings.get(["discovery_address"]) or BROADCAST_ADDRESS).split(",")]
+        self.discovery.configure(self._settings.get_float(["discovery_timeout"]), [target for target in targets if target])
+
+    def _get_client_class(self):
+        """PyP100 client class used to talk to the plugs, None if unavailable"""
+        return self.library.get_client_class()
+
+    ##~~ Device Control Methods
+
+    def _max_age(self, group, force=False, max_age=None):
+        """How old a cached group may be to still answer a read"""
+        if force:
+            return 0
+        if max_age is not None:
+            return max_age
+        return self._settings.get_float([f"cache_max_age_{group}"])
+
+    def _cached_status(self, device, force=False, max_age=None):
+        return device.cached_status(self._max_age(GROUP_INFO, force, max_age),
+                                    self._max_age(GROUP_STATE, force, max_age))
+
+    def _turn_on(self, device):
+        """Turn the device ON"""
+        if not device.turn_on():
+            return False
+        self._publish_status(device)
+        self._reschedule(device)
+        return True
+
+    def _turn_off(self, device):
+        """Turn the device OFF"""
+        if not device.turn_off():
+            return False
+        self._publish_status(device)
+        self._reschedule(device)
+        return True
+
+    def _toggle(self, device):
+        """Toggle the device state, deciding from the cached state while it is fresh"""
+        state = device.cache.get(GROUP_STATE, self._settings.get_float(["toggle_max_age"]))
+        if state is not None:
+            device_on = state.value
+        else:
+            status = self._get_status(device, force=True)
+            if status is None:
+                return False
+            device_on = status.get('device_on', False)
+
+        if device_on:
+            return self._turn_off(device)
+        else:
+            return self._turn_on(device)
+
+    def _get_status(self, device, force=False, max_age=None):
+        """Get device status, served from the cache while it is fresh enough"""
+        status = self._cached_status(device, force, max_age)
+        if not force:
+            device.metrics.cache(GROUP_INFO, status is not None)
+        if status is not None:
+            return status
+
+        if not device.connect():
+            return None
+
+        # A fresh connection has just read the device info
+        status = self._cached_status(device, force, max_age)
+        if status is not None:
+            return status
+
+        return device.read_status()
+
+    def _get_energy_usage(self, device, force=False, max_age=None):
+        """Get energy usage data, served from the cache while it is fresh enough"""
+        cached = device.cache.get(GROUP_ENERGY, self._max_age(GROUP_ENERGY, force, max_age))
+        if not force:
+            device.metrics.cache(GROUP_ENERGY, cached is not None)
+        if cached is not None:
+            return cached.value
+        return device.read_energy()
+
+    def _get_snapshot(self, device, force=False, max_age=None):
+        """Status and energy together, from the cache while both are fresh, else in one batched read"""
+        status = self._cached_status(device, force, max_age)
+        energy = device.cache.get(GROUP_ENERGY, self._max_age(GROUP_ENERGY, force, max_age))
+        if status is not None and energy is not None:
+            return dict(status=status, energy=energy.value, current_power=energy.value.get("current_power", 0) / 1000.0,
+                        batched=False, cached=True)
+        return device.read_snapshot()
+
+    ##~~ Startup
+
+    def on_after_startup(self):
+        self._logger.info("Tapo P110 Plugin started")
+
+        # Check PyP100 availability without holding up the server start
+        threading.Thread(target=self.library.check, name="tapo_p110_library_check", daemon=True).start()
+        # Likewise the discovery probe's key, so the first lookup of a moved plug doesn't wait for it
+        self.discovery.prepare()
+
+        # Status is always monitored so open browsers get pushed updates,
+        # energy readings only if enabled
+        self._start_monitoring()
+        self.actions.start()
+
+    def _start_monitoring(self):
+        """Start polling all plugs concurrently, pushing changes to the UI"""
+        self._configure_schedule()
+        self.polling = PollingEngine(self._poll_device,
+                                     self._poll_interval,
+                                     self._settings.get_int(["poll_workers"]),
+                                     self._logger)
+        self.polling.set_devices(self._get_devices(configured_only=True))
+        self.polling.start()
+
+    def _configure_schedule(self):
+        self.schedule.configure(self._settings.get_float(["poll_interval_active"]),
+                                self._settings.get_float(["energy_update_interval"]),
+                                self._settings.get_float(["poll_interval_off"]),
+                                self._settings.get_int(["poll_budget"]))
+
+    def _reschedule(self, device):
+        """Poll the plug soon so its interval is worked out again, e.g. after its state changed"""
+        if self.polling is not None:
+            self.polling.reschedule(device.id, self._settings.get_float(["poll_interval_active"]))
+
+    def _poll_interval(self, device):
+        state = device.cache.snapshot(GROUP_STATE)
+        plug_on = state.value if state is not None else True
+        return self.schedule.interval(device.id, self._printer_activity(device), plug_on)
+
+    def _printer_activity(self, device):
+        """What the printer powered by this plug is doing"""
+        printer_device = self._get_device(self._settings.get(["printer_device"]) or None)
+        if printer_device is None or printer_device.id != device.id:
+            return ACTIVITY_IDLE
+        if self._printer.is_printing():
+            return ACTIVITY_PRINTING
+
+        temperatures = self._printer.get_current_temperatures() or {}
+        if any((values or {}).get("target") for values in temperatures.values()):
+            return ACTIVITY_HEATING
+        return ACTIVITY_IDLE
+
+    def _poll_device(self, device):
+        """One monitoring tick for one plug"""
+        with self.tracer.span("monitor.poll", device=device.id) as span:
+            calls = device.dispatcher.get_stats()["device_calls"]
+
+            # The switch state rarely changes, fast polls take it from the cache
+            status_max_age = self._settings.get_float(["energy_update_interval"]) / 2
+            watts = None
+            if self._settings.get_boolean(["enable_energy_monitoring"]):
+                # Energy is read on every tick, the status along with it in the same request when it is due
+                status = self._cached_status(device, max_age=status_max_age)
+                if status is None and device.connect():
+                    # A fresh connection has just read the device info
+                    status = self._cached_status(device, max_age=status_max_age)
+                if status is None:
+                    snapshot = device.read_snapshot()
+                    energy = snapshot["energy"] if snapshot is not None else None
+                else:
+                    energy = self._get_energy_usage(device, force=True)
+
+                if energy:
+                    current_power = energy.get('current_power', 0)
+                    self._logger.debug(f"{device.name} current power: {current_power} mW")
+                    self._publish(device, "energy", energy)
+                    watts = current_power / 1000.0
+                    self._record_power(device, time.time(), watts)
+                status = device.cached_status(status_max_age, status_max_age)
+            else:
+                status = self._get_status(device, max_age=status_max_age)
+
+            if status is not None:
+                self._publish_status(device)
+            else:
+                span.fail(device.last_error)
+
+            self.schedule.record_poll(device.id, device.dispatcher.get_stats()["device_calls"] - calls, watts)
+
+    ##~~ Power history
+
+    def _get_power_store(self, device):
+        """Power sample store of a plug, created on first use"""
+        with self.power_stores_lock:
+            store = self.power_stores.get(device.id)
+            if store is None:
+                raw_days, retention_days = self._history_settings()
+                store = PowerStore(os.path.join(self.get_plugin_data_folder(), "power", device.id),
+                                   raw_days=raw_days, retention_days=retention_days, logger=self._logger)
+                self.power_stores[device.id] = store
+            return store
+
+    def _history_settings(self):
+        return (self._settings.get_int(["history_raw_days"]),
+                self._settings.get_int(["history_retention_days"]))
+
+    def _configure_history(self):
+        """Apply the history settings to the stores already open, like the plugs they are kept in place"""
+        raw_days, retention_days = self._history_settings()
+        with self.power_stores_lock:
+            stores = list(self.power_stores.values())
+        for store in stores:
+            store.configure(raw_days, retention_days)
+
+    def _record_power(self, device, timestamp, watts):
+        try:
+            self._get_power_store(device).append(timestamp, watts)
+        except Exception as e:
+            self._logger.error(f"Could not record power sample for {device.name}: {e}")
+        self.print_energy.add_sample(device.id, timestamp, watts)
+        self._check_power(device, timestamp, watts)
+
+    ##~~ Power anomalies
+
+    def _configure_anomalies(self):
+        self.anomalies.configure(self._settings.get_float(["anomaly_max_power"]),
+                                 self._settings.get_float(["anomaly_overdraw_time"]),
+                                 self._settings.get_float(["anomaly_drop_threshold"]),
+                                 self._settings.get_float(["anomaly_idle_max_power"]),
+                                 self._settings.get_float(["anomaly_idle_time"]))
+
+    def _check_power(self, device, timestamp, watts):
+        """Run the printer plug's power sample through the anomaly detector, right as it comes in"""
+        if not self._settings.get_boolean(["anomaly_detection"]):
+            return
+        printer_device = self._get_device(self._settings.get(["printer_device"]) or None)
+        if printer_device is None or printer_device.id != device.id:
+            return
+
+        state = device.cache.snapshot(GROUP_STATE)
+        if state is not None and not state.value:
+            # Switched off on purpose, not a power loss
+            self.anomalies.reset(device.id)
+            return
+
+        heaters_on, heating_up = self._heater_state()
+        self.anomalies.update(device.id, timestamp, watts, printing=self._printer.is_printing(),
+                              heaters_on=heaters_on, heating_up=heating_up)
+
+    def _heater_state(self):
+        """Whether any heater has a target temperature, and whether one is still heating up to it"""
+        heaters_on = heating_up = False
+        for values in (self._printer.get_current_temperatures() or {}).values():
+            target = (values or {}).get("target") or 0
+            actual = (values or {}).get("actual")
+            if target:
+                heaters_on = True
+                if actual is not None and actual < target - HEAT_UP_MARGIN:
+                    heating_up = True
+        return heaters_on, heating_up
+
+    def _on_power_anomaly(self, anomaly):
+        """React to a power anomaly as configured, on the polling thread that spotted it"""
+        action = self._settings.get([f"anomaly_action_{anomaly.kind}"])
+        if action not in ANOMALY_ACTIONS:
+            action = ANOMALY_ACTION_EVENT
+        self._logger.warning(f"Power anomaly on {anomaly.device}: {anomaly.message} - action: {action}")
+        self.metrics.anomalies.child(anomaly.device, anomaly.kind).inc()
+        if action == ANOMALY_ACTION_NONE:
+            return
+
+        device = self._get_device(anomaly.device)
+        with self.tracer.span(f"anomaly.{anomaly.kind}", device=anomaly.device, action=action) as span:
+            # The plug is cut first, everything else can wait
+            if action == ANOMALY_ACTION_CUTOFF and device is not None:
+                self.actions.cancel_matching(device.id, ACTION_TURN_ON)
+                if device.turn_off(urgent=True):
+                    self.anomalies.reset(device.id)
+                    self._publish_status(device)
+                    self._reschedule(device)
+                else:
+                    self._logger.error(f"Emergency power cut of {device.name} failed: {device.last_error}")
+                    span.fail(device.last_error)
+            elif action == ANOMALY_ACTION_PAUSE and self._printer.is_printing():
+                self._printer.pause_print()
+
+            payload = dict(anomaly.to_dict(), action=action)
+            self._event_bus.fire(f"plugin_{self._identifier}_{EVENT_POWER_ANOMALY}", payload)
+            self._plugin_manager.send_plugin_message(self._identifier, dict(type="anomaly", anomaly=payload))
+
+    def register_custom_events(self, *args, **kwargs):
+        return [EVENT_POWER_ANOMALY]
+
+    ##~~ BlueprintPlugin mixin
+
+    @octoprint.plugin.BlueprintPlugin.route("/metrics", methods=["GET"])
+    def get_prometheus_metrics(self):
+        """Metrics in Prometheus text format, for scraping with an API key"""
+        return flask.Response(self.metrics.to_prometheus(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+    @octoprint.plugin.BlueprintPlugin.route("/history/export", methods=["GET"])
+    def export_history(self):
+        """Power samples of a plug as CSV or NDJSON, streamed from disk.
+
+        Query parameters: device, format (csv or ndjson), start and end
+        (Unix timestamps, defaulting to the last 24 hours) and resolution
+        (seconds to average samples over, raw samples if 0).
+        """
+        args = flask.request.args
+        device = self._get_device(args.get("device"))
+        if device is None:
+            return flask.make_response(flask.jsonify(error=f"Unknown device: {args.get('device')}"), 404)
+        fmt = args.get("format", "csv")
+        if fmt not in EXPORT_FORMATS:
+            return flask.make_response(flask.jsonify(error=f"Unknown format: {fmt}"), 400)
+        start, end, resolution = self._read_export_range(args)
+
+        store = self._get_power_store(device)
+        # Samples still waiting for the next batch write go to disk first
+        store.flush()
+        chunks = stream_export(store.iter_samples(start, end), fmt, resolution)
+        filename = f"{self._identifier}_{device.id}_{start}_{end}.{fmt}"
+        return flask.Response(chunks, mimetype=EXPORT_FORMATS[fmt],
+                              headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+    def _read_export_range(self, args):
+        """start, end and resolution of a history export, defaulting to the raw samples of the last 24 hours"""
+        now = time.time()
+        values = dict(start=now - 86400, end=now, resolution=0)
+        for key in values:
+            if args.get(key) not in (None, ""):
+                try:
+                    values[key] = max(0.0, float(args[key]))
+                except (TypeError, ValueError):
+                    self._logger.warning(f"Ignoring invalid {key}: {args[key]!r}")
+        start, end = values["start"], max(values["start"], values["end"])
+        return int(start), int(math.ceil(end)), int(values["resolution"])
+
+    def is_blueprint_csrf_protected(self):
+        return True
+
+    ##~~ ShutdownPlugin mixin
+
+    def on_shutdown(self):
+        self.actions.stop()
+        # Nothing may record power samples once the stores are closed
+        if self.polling is not None:
+            self.polling.stop(wait=True)
+        self.jobs.shutdown()
+        self.bulk.shutdown()
+        with self.power_stores_lock:
+            stores = list(self.power_stores.values())
+        for store in stores:
+            store.close()
+
+    ##~~ Push updates
+
+    def _publish_status(self, device):
+        """Push the latest known device status to connected clients"""
+        status = device.cached_status(float("inf"), float("inf"))
+        if status is not None:
+            self._publish(device, "status", status)
+
+    def _publish_job(self, job):
+        """Tell clients a background command started or finished"""
+        self._plugin_manager.send_plugin_message(self._identifier, {"type": "job", "job": job.to_dict()})
+
+    def _on_actions_changed(self, actions):
+        self._sync_cooldown(actions)
+        self._publish_actions(actions)
+
+    def _publish_actions(self, actions):
+        """Tell clients which power actions are pending"""
+        self._plugin_manager.send_plugin_message(self._identifier, {"type": "actions",
+                                                                    "actions": [action.to_dict() for action in actions]})
+
+    def _publish(self, device, kind, payload):
+        """Send a plugin message, unless nothing changed since the last one of this kind.
+
+        Status and energy are sent as the fields that changed since the
+        previous message, tagged with that message's etag as base: clients
+        holding a different version fetch the full payload instead.
+        """
+        if not isinstance(payload, dict):
+            return False
+
+        fingerprint = {key: value for key, value in payload.items() if key not in VOLATILE_STATUS_FIELDS}
+        previous = self._published.get((device.id, kind))
+        if previous is not None and previous[1] == fingerprint:
+            return False
+        etag = self._etag(payload)
+        self._published[(device.id, kind)] = (payload, fingerprint, etag)
+
+        message = {"type": kind, "device": device.id, "etag": etag}
+        if previous is not None and kind in DELTA_PUSH_KINDS:
+            changed, removed = diff(previous[0], payload)
+            message.update(delta=changed, removed=removed, base=previous[2])
+        else:
+            message[kind] = payload
+        self._plugin_manager.send_plugin_message(self._identifier, message)
+        return True
+
+    ##~~ Software Update Hook
+
+    def get_update_information(self):
+        return dict(
+            tapo_p110=dict(
+                displayName="Tapo P110",
+                displayVersion=self._plugin_version,
+                type="github_release",
+                user="gaurav-pangam",
+                repo="OctoPrint-Tapo-P110",
+                current=self._plugin_version,
+                pip="https://github.com/gaurav-pangam/OctoPrint-Tapo-P110/archive/{target_version}.zip"
+            )
+        )
+
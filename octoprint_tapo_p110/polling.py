@@ -0,0 +1,107 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class PollingEngine(object):
+    """Polls every registered device concurrently on a bounded worker pool.
+
+    Each device has its own due time, so a slow or unreachable plug only
+    delays its own next poll and never holds up the others. A device is
+    never polled twice at the same time.
+    """
+
+    def __init__(self, poll, interval, max_workers, logger):
+        # poll(device) does the actual work, interval(device) returns the
+        # number of seconds until that device is due again
+        self._poll = poll
+        self._interval = interval
+        self._logger = logger
+
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="tapo_p110_poll")
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._devices = {}
+        self._due = {}
+        self._running = set()
+        self._thread = None
+        self._stopped = False
+
+    def set_devices(self, devices):
+        """Replace the polled devices, polling new ones right away"""
+        with self._lock:
+            self._devices = dict((device.id, device) for device in devices)
+            now = time.monotonic()
+            self._due = dict((device_id, self._due.get(device_id, now)) for device_id in self._devices)
+        self._wakeup.set()
+
+    def reschedule(self, device_id, delay=0):
+        """Move a device's next poll closer, e.g. after the schedule changed"""
+        with self._lock:
+            if device_id in self._due:
+                self._due[device_id] = min(self._due[device_id], time.monotonic() + delay)
+        self._wakeup.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="tapo_p110_polling", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=False):
+        """Stop polling, with wait until the polls already running have finished"""
+        self._stopped = True
+        self._wakeup.set()
+        self._executor.shutdown(wait=wait)
+
+    def poll_all(self):
+        """Poll every device once, concurrently, and return the elapsed seconds"""
+        with self._lock:
+            devices = list(self._devices.values())
+        start = time.monotonic()
+        wait([self._executor.submit(self._poll_device, device) for device in devices])
+        return time.monotonic() - start
+
+    def _loop(self):
+        while not self._stopped:
+            now = time.monotonic()
+            with self._lock:
+                due = [self._devices[device_id] for device_id, when in self._due.items()
+                       if when <= now and device_id not in self._running]
+                for device in due:
+                    self._running.add(device.id)
+                pending = [when for device_id, when in self._due.items() if device_id not in self._running]
+
+            for device in due:
+                if self._stopped:
+                    return
+                try:
+                    self._executor.submit(self._poll_device, device, True)
+                except RuntimeError:
+                    # stop() shut the executor down since the check
+                    return
+
+            timeout = max(0.0, min(pending) - now) if pending else None
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def _poll_device(self, device, scheduled=False):
+        try:
+            self._poll(device)
+        except Exception as e:
+            self._logger.error(f"Polling {device.id} failed: {e}")
+        finally:
+            if scheduled:
+                try:
+                    interval = max(0.1, float(self._interval(device)))
+                except Exception as e:
+                    self._logger.error(f"Could not determine poll interval for {device.id}: {e}")
+                    interval = 60
+                with self._lock:
+                    self._running.discard(device.id)
+                    if device.id in self._due:
+                        self._due[device.id] = time.monotonic() + interval
+                self._wakeup.set()
@@ -0,0 +1,284 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import os
+import struct
+import threading
+
+# Rollup files hold fixed-size bucket records for one resolution, oldest first:
+# bucket start, sample count, min/max/mean watts (float32), energy in Wh (float64)
+ROLLUP_MAGIC = b"TPRU"
+ROLLUP_VERSION = 1
+ROLLUP_HEADER = struct.Struct("<4sBBH")  # magic, version, reserved, reserved
+ROLLUP_RECORD = struct.Struct("<IIfffd")
+
+# 1 minute, 1 hour, 1 day. Each level is fed from the buckets of the one before
+ROLLUP_RESOLUTIONS = (60, 3600, 86400)
+
+
+class Bucket(object):
+    """Aggregate of the power samples within one time bucket"""
+
+    __slots__ = ("start", "count", "min", "max", "total", "energy_wh")
+
+    def __init__(self, start):
+        self.start = start
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.total = 0.0
+        self.energy_wh = 0.0
+
+    @classmethod
+    def from_record(cls, data, offset=0):
+        start, count, low, high, mean, energy_wh = ROLLUP_RECORD.unpack_from(data, offset)
+        bucket = cls(start)
+        bucket.count = count
+        bucket.min = low
+        bucket.max = high
+        bucket.total = mean * count
+        bucket.energy_wh = energy_wh
+        return bucket
+
+    def add(self, watts, energy_wh):
+        self.count += 1
+        self.min = watts if self.min is None else min(self.min, watts)
+        self.max = watts if self.max is None else max(self.max, watts)
+        self.total += watts
+        self.energy_wh += energy_wh
+
+    def merge(self, other):
+        if not other.count:
+            self.energy_wh += other.energy_wh
+            return
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.count += other.count
+        self.total += other.total
+        self.energy_wh += other.energy_wh
+
+    def copy(self):
+        bucket = Bucket(self.start)
+        bucket.merge(self)
+        return bucket
+
+    def to_record(self):
+        mean = self.total / self.count if self.count else 0.0
+        return ROLLUP_RECORD.pack(self.start, self.count, self.min or 0.0, self.max or 0.0, mean, self.energy_wh)
+
+    def to_dict(self, resolution):
+        return dict(
+            start=self.start,
+            end=self.start + resolution,
+            samples=self.count,
+            min=round(self.min, 2) if self.min is not None else None,
+            max=round(self.max, 2) if self.max is not None else None,
+            avg=round(self.total / self.count, 2) if self.count else None,
+            energy_wh=round(self.energy_wh, 4)
+        )
+
+
+class RollupLevel(object):
+    """One resolution: the bucket being filled plus its append-only file"""
+
+    def __init__(self, path, resolution):
+        self.path = path
+        self.resolution = resolution
+        self.current = None
+        self._pending = bytearray()
+
+    def align(self, timestamp):
+        return int(timestamp) - int(timestamp) % self.resolution
+
+    def close_current(self):
+        """Queue the current bucket for writing and return it"""
+        bucket, self.current = self.current, None
+        if bucket is not None:
+            self._pending.extend(bucket.to_record())
+        return bucket
+
+    def flush(self):
+        if not self._pending:
+            return
+        data, self._pending = self._pending, bytearray()
+        if not os.path.exists(self.path):
+            data[:0] = ROLLUP_HEADER.pack(ROLLUP_MAGIC, ROLLUP_VERSION, 0, 0)
+        else:
+            # Cut off a partial record left by an interrupted write
+            size = os.path.getsize(self.path)
+            misaligned = (size - ROLLUP_HEADER.size) % ROLLUP_RECORD.size
+            if size >= ROLLUP_HEADER.size and misaligned:
+                with open(self.path, "r+b") as f:
+                    f.truncate(size - misaligned)
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def size(self):
+        return os.path.getsize(self.path) if self.exists() else 0
+
+    def read(self, start, end):
+        """Stored buckets with start <= bucket start < end, found by binary search"""
+        if not self.exists():
+            return []
+        with open(self.path, "rb") as f:
+            header = f.read(ROLLUP_HEADER.size)
+            if len(header) < ROLLUP_HEADER.size or header[:4] != ROLLUP_MAGIC:
+                return []
+            count = (self.size() - ROLLUP_HEADER.size) // ROLLUP_RECORD.size
+            first = self._lower_bound(f, count, start)
+            last = self._lower_bound(f, count, end)
+            if first >= last:
+                return []
+            f.seek(ROLLUP_HEADER.size + first * ROLLUP_RECORD.size)
+            data = f.read((last - first) * ROLLUP_RECORD.size)
+        return [Bucket.from_record(data, offset)
+                for offset in range(0, len(data) - ROLLUP_RECORD.size + 1, ROLLUP_RECORD.size)]
+
+    def _lower_bound(self, f, count, timestamp):
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            f.seek(ROLLUP_HEADER.size + middle * ROLLUP_RECORD.size)
+            if struct.unpack("<I", f.read(4))[0] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def prune(self, before):
+        """Drop stored buckets older than before, rewriting the file only if needed"""
+        if not self.exists() or not self.read(0, before):
+            return
+        with open(self.path, "rb") as f:
+            f.seek(ROLLUP_HEADER.size)
+            data = f.read()
+        data = data[:len(data) - len(data) % ROLLUP_RECORD.size]
+        keep = bytearray(ROLLUP_HEADER.pack(ROLLUP_MAGIC, ROLLUP_VERSION, 0, 0))
+        for offset in range(0, len(data), ROLLUP_RECORD.size):
+            if ROLLUP_RECORD.unpack_from(data, offset)[0] >= before:
+                keep.extend(data[offset:])
+                break
+        temp = self.path + ".tmp"
+        with open(temp, "wb") as f:
+            f.write(keep)
+        os.replace(temp, self.path)
+
+
+class PowerRollups(object):
+    """Minute, hour and day aggregates of a plug's power, updated per sample.
+
+    Each sample updates the open minute bucket. When a bucket closes it is
+    queued for disk and merged into the next coarser level, so answering a
+    query only reads the few stored buckets covering its range. Energy is
+    integrated between consecutive samples; gaps longer than max_gap (plug
+    unreachable, OctoPrint stopped) count as no energy.
+    """
+
+    def __init__(self, folder, resolutions=ROLLUP_RESOLUTIONS, max_gap=900):
+        self.max_gap = max_gap
+        self.levels = [RollupLevel(os.path.join(folder, f"rollup_{resolution}.bin"), resolution)
+                       for resolution in resolutions]
+        self._lock = threading.RLock()
+        self._last = None
+
+    def exists(self):
+        return any(level.exists() for level in self.levels)
+
+    def add(self, timestamp, watts):
+        with self._lock:
+            energy_wh = 0.0
+            if self._last is not None:
+                elapsed = timestamp - self._last[0]
+                if elapsed <= 0:
+                    return
+                if elapsed <= self.max_gap:
+                    energy_wh = (watts + self._last[1]) / 2.0 * elapsed / 3600.0
+            self._last = (timestamp, watts)
+
+            bucket = Bucket(self.levels[0].align(timestamp))
+            bucket.add(watts, energy_wh)
+            self._feed(0, bucket)
+
+    def _feed(self, index, bucket):
+        level = self.levels[index]
+        start = level.align(bucket.start)
+        if level.current is not None and level.current.start != start:
+            closed = level.close_current()
+            if index + 1 < len(self.levels):
+                self._feed(index + 1, closed)
+        if level.current is None:
+            level.current = Bucket(start)
+        level.current.merge(bucket)
+
+    def flush(self):
+        with self._lock:
+            for level in self.levels:
+                level.flush()
+
+    def close(self):
+        """Write out the open buckets too, e.g. on shutdown.
+
+        Buckets continued after a restart are stored as a second record
+        with the same start, which queries merge back together.
+        """
+        with self._lock:
+            for index, level in enumerate(self.levels):
+                closed = level.close_current()
+                if closed is not None and index + 1 < len(self.levels):
+                    self._feed(index + 1, closed)
+            self.flush()
+            self._last = None
+
+    def prune(self, before):
+        """Forget minute buckets older than before. Coarser levels are small enough to keep"""
+        with self._lock:
+            self.flush()
+            self.levels[0].prune(before)
+
+    def query(self, start, end, resolution):
+        """Buckets of resolution seconds covering [start, end), oldest first.
+
+        Served from the coarsest level that is at least as fine as the
+        requested resolution, including the data not yet written to disk.
+        """
+        with self._lock:
+            index = 0
+            for candidate, level in enumerate(self.levels):
+                if level.resolution <= resolution:
+                    index = candidate
+            level = self.levels[index]
+            # Output buckets must be made of whole buckets of the level
+            resolution = -(-int(resolution) // level.resolution) * level.resolution
+
+            first = int(start) - int(start) % resolution
+            buckets = level.read(level.align(first), end)
+            buckets.extend(self._pending_buckets(index))
+
+        result = {}
+        for bucket in buckets:
+            if bucket.start < first or bucket.start >= end:
+                continue
+            key = bucket.start - bucket.start % resolution
+            if key not in result:
+                result[key] = Bucket(key)
+            result[key].merge(bucket)
+        return [result[key].to_dict(resolution) for key in sorted(result)], resolution
+
+    def _pending_buckets(self, index):
+        """Data of level index that isn't in its file yet, as buckets"""
+        level = self.levels[index]
+        buckets = [Bucket.from_record(level._pending, offset)
+                   for offset in range(0, len(level._pending), ROLLUP_RECORD.size)]
+        # Closed buckets have been merged upwards, only the open ones of the
+        # finer levels hold data this level hasn't seen yet
+        for candidate in self.levels[:index + 1]:
+            if candidate.current is not None:
+                buckets.append(candidate.current.copy())
+        return buckets
+
+    def get_stats(self):
+        with self._lock:
+            return dict((str(level.resolution), level.size()) for level in self.levels)
@@ -0,0 +1,661 @@
+# coding=utf-8
+"""Local stand-in for a Tapo P110, for tests and benchmarks without a real plug.
+
+SimulatedPlug holds the plug's state (switch, power curve, energy counters)
+and the faults to inject. It can be reached two ways:
+
+- SimulatorServer serves it over HTTP with the protocol PyP100 speaks: an
+  RSA handshake handing out an AES session key and a TP_SESSIONID cookie,
+  then login_device and every other call as AES encrypted
+  securePassthrough requests. Point a plug's IP setting at its address.
+  This needs pycryptodome, which PyP100 depends on anyway.
+- client_class(plug) returns an in-process client with PyP100's P110
+  interface, for tests that don't need the network or crypto.
+
+DiscoveryResponder answers discovery probes on behalf of simulated plugs,
+so their addresses can be looked up by MAC as on a real LAN.
+
+Run it standalone with: python -m octoprint_tapo_p110.simulator --port 8080
+"""
+from __future__ import absolute_import
+
+import base64
+import collections
+import hashlib
+import json
+import math
+import os
+import random
+import socketserver
+import threading
+import time
+import uuid
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from .connection import split_address
+from .discovery import DISCOVERY_PORT, decode_packet, encode_packet
+
+DEFAULT_EMAIL = "tapo@example.com"
+DEFAULT_PASSWORD = "simulated"
+
+SESSION_COOKIE = "TP_SESSIONID"
+
+# Error codes as the plug reports them
+ERROR_SUCCESS = 0
+ERROR_INVALID_CREDENTIALS = -1501
+ERROR_INCORRECT_REQUEST = 1002
+ERROR_SESSION_TIMEOUT = 9999
+
+# Injectable faults
+FAULT_LATENCY = "latency"                  # answer value seconds late
+FAULT_TIMEOUT = "timeout"                  # don't answer for value seconds, then drop the connection
+FAULT_MALFORMED = "malformed"              # answer without a "result", PyP100 raises KeyError
+FAULT_ERROR = "error"                      # answer with error code value
+FAULT_SESSION_EXPIRED = "session_expired"  # drop the session first, as if it timed out
+
+FAULTS = (FAULT_LATENCY, FAULT_TIMEOUT, FAULT_MALFORMED, FAULT_ERROR, FAULT_SESSION_EXPIRED)
+
+
+##~~ Power curves, watts as a function of seconds since the plug was switched on
+
+def constant_curve(watts):
+    return lambda elapsed: watts
+
+
+def printer_curve(idle=8.0, heating=250.0, heat_time=180.0, printing=110.0, noise=0.1):
+    """Heat-up peak, then a bed heater cycling on top of a printing baseline"""
+    def curve(elapsed):
+        if elapsed < heat_time:
+            watts = heating
+        else:
+            # Bed heater duty cycle of roughly a third, switching every few seconds
+            watts = printing + (heating - printing) * (math.sin(elapsed / 4.0) > 0.5)
+        return max(idle, watts * random.uniform(1 - noise, 1 + noise))
+    return curve
+
+
+POWER_CURVES = dict(
+    idle=lambda: constant_curve(8.0),
+    printer=printer_curve,
+    heater=lambda: constant_curve(1200.0)
+)
+
+
+class Fault(object):
+    def __init__(self, kind, value=None, count=1, method=None):
+        if kind not in FAULTS:
+            raise ValueError(f"Unknown fault: {kind}")
+        self.kind = kind
+        self.value = value
+        self.count = count  # None injects it into every matching request
+        self.method = method  # None matches every method
+
+
+class SimulatedPlug(object):
+    """State and behaviour of one simulated P110"""
+
+    def __init__(self, email=DEFAULT_EMAIL, password=DEFAULT_PASSWORD, nickname="Simulated P110",
+                 device_on=False, power_curve=None, latency=0.0, jitter=0.0, session_ttl=None,
+                 clock=time.time):
+        self.email = email
+        self.password = password
+        self.nickname = nickname
+        self.model = "P110"
+        self.fw_ver = "1.1.3 Build 230905 Rel.152200"
+        self.hw_ver = "1.0"
+        self.mac = "5C-62-8B-" + "-".join(f"{random.randint(0, 255):02X}" for _ in range(3))
+        self.device_id = uuid.uuid4().hex.upper()
+        self.power_curve = power_curve or constant_curve(8.0)
+        self.latency = latency
+        self.jitter = jitter
+        self.session_ttl = session_ttl  # seconds until a session expires, None for never
+        self._clock = clock
+
+        self._lock = threading.RLock()
+        self._faults = []
+        self.requests = collections.Counter()
+
+        self.device_on = device_on
+        self._on_since = clock() if device_on else None
+        self._updated = clock()
+        self._power = float(self.power_curve(0.0)) if device_on else 0.0
+        self.today_energy = 0.0  # Wh
+        self.month_energy = 0.0
+        self.today_runtime = 0.0  # minutes
+        self.month_runtime = 0.0
+
+    ##~~ Control
+
+    def set_on(self, on):
+        with self._lock:
+            self._advance()
+            if on and not self.device_on:
+                self._on_since = self._clock()
+                self._power = float(self.power_curve(0.0))
+            self.device_on = bool(on)
+
+    def inject(self, kind, value=None, count=1, method=None):
+        """Make the next count requests (of method, if given) fail with the given fault"""
+        with self._lock:
+            self._faults.append(Fault(kind, value, count, method))
+
+    def clear_faults(self):
+        with self._lock:
+            del self._faults[:]
+
+    def take_fault(self, method):
+        """The fault to apply to this request, if any"""
+        with self._lock:
+            for fault in self._faults:
+                if fault.method is not None and fault.method != method:
+                    continue
+                if fault.count is not None:
+                    fault.count -= 1
+                    if fault.count <= 0:
+                        self._faults.remove(fault)
+                return fault
+        return None
+
+    def response_delay(self):
+        return max(0.0, self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def check_credentials(self, username, password):
+        return username == encode_username(self.email) and password == encode_password(self.password)
+
+    ##~~ Device state
+
+    def power(self):
+        """Current power draw in watts"""
+        with self._lock:
+            self._advance()
+            return self._power
+
+    def _advance(self):
+        """Integrate energy and runtime up to now"""
+        now = self._clock()
+        elapsed = max(0.0, now - self._updated)
+        if self.device_on:
+            power = float(self.power_curve(now - self._on_since))
+            self.today_energy += (power + self._power) / 2.0 * elapsed / 3600.0
+            self.month_energy += (power + self._power) / 2.0 * elapsed / 3600.0
+            self.today_runtime += elapsed / 60.0
+            self.month_runtime += elapsed / 60.0
+        else:
+            power = 0.0
+        self._power = power
+        self._updated = now
+
+    def device_info(self):
+        with self._lock:
+            self._advance()
+            return dict(
+                device_id=self.device_id,
+                fw_ver=self.fw_ver,
+                hw_ver=self.hw_ver,
+                type="SMART.TAPOPLUG",
+                model=self.model,
+                mac=self.mac,
+                nickname=base64.b64encode(self.nickname.encode("utf-8")).decode("ascii"),
+                ip="127.0.0.1",
+                ssid=base64.b64encode(b"simulated").decode("ascii"),
+                signal_level=3,
+                rssi=random.randint(-55, -40),
+                device_on=self.device_on,
+                on_time=int(self._clock() - self._on_since) if self.device_on else 0,
+                overheated=False,
+                power_protection_status="normal",
+                time_diff=0
+            )
+
+    def energy_usage(self):
+        with self._lock:
+            self._advance()
+            return dict(
+                today_runtime=int(self.today_runtime),
+                month_runtime=int(self.month_runtime),
+                today_energy=int(self.today_energy),
+                month_energy=int(self.month_energy),
+                local_time=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self._clock())),
+                current_power=int(self._power * 1000)  # mW
+            )
+
+    ##~~ Requests
+
+    def call(self, method, params=None):
+        """Run one device method, returning (error_code, result)"""
+        self.requests[method] += 1
+        return self._dispatch(method, params or {})
+
+    def _dispatch(self, method, params):
+        if method == "get_device_info":
+            return ERROR_SUCCESS, self.device_info()
+        elif method == "get_energy_usage":
+            return ERROR_SUCCESS, self.energy_usage()
+        elif method == "get_current_power":
+            return ERROR_SUCCESS, dict(current_power=int(round(self.power())))
+        elif method == "set_device_info":
+            if "device_on" in params:
+                self.set_on(params["device_on"])
+            return ERROR_SUCCESS, {}
+        elif method == "multipleRequest":
+            responses = []
+            for request in params.get("requests", []):
+                error_code, result = self._dispatch(request.get("method"), request.get("params") or {})
+                responses.append(dict(method=request.get("method"), result=result, error_code=error_code))
+            return ERROR_SUCCESS, dict(responses=responses)
+        return ERROR_INCORRECT_REQUEST, None
+
+
+def encode_username(email):
+    """Username as login_device expects it: base64 of the hex SHA1 of the email"""
+    return base64.b64encode(hashlib.sha1(email.encode("utf-8")).hexdigest().encode("utf-8")).decode("utf-8")
+
+
+def encode_password(password):
+    return base64.b64encode(password.encode("utf-8")).decode("utf-8")
+
+
+##~~ HTTP front end
+
+def _load_crypto():
+    try:
+        from Crypto.Cipher import AES, PKCS1_v1_5
+        from Crypto.PublicKey import RSA
+    except ImportError:
+        raise RuntimeError("The simulator's HTTP server needs pycryptodome: pip install pycryptodome")
+    return AES, PKCS1_v1_5, RSA
+
+
+class _Session(object):
+    def __init__(self, key, iv, created):
+        self.id = uuid.uuid4().hex.upper()
+        self.key = key
+        self.iv = iv
+        self.created = created
+        self.token = None
+
+    def encrypt(self, aes, text):
+        data = text.encode("utf-8")
+        padding = 16 - len(data) % 16
+        data += bytes([padding]) * padding
+        return base64.b64encode(aes.new(self.key, aes.MODE_CBC, self.iv).encrypt(data)).decode("ascii")
+
+    def decrypt(self, aes, text):
+        data = aes.new(self.key, aes.MODE_CBC, self.iv).decrypt(base64.b64decode(text))
+        # PyP100 leaves block aligned requests unpadded, so only strip valid padding
+        padding = data[-1] if data else 0
+        if 0 < padding <= 16 and data.endswith(bytes([padding]) * padding):
+            data = data[:-padding]
+        return data.decode("utf-8")
+
+
+class SimulatorServer(object):
+    """Serves a SimulatedPlug over HTTP the way a P110 with the old protocol does"""
+
+    def __init__(self, plug=None, host="127.0.0.1", port=0):
+        self.plug = plug or SimulatedPlug()
+        self._crypto = _load_crypto()
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes, don't let them wait for a delayed ACK
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                simulator._serve(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        """host:port to use as the plug's IP"""
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="tapo_p110_simulator", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def expire_sessions(self):
+        """Forget every session, the next request of each client fails with a session timeout"""
+        with self._lock:
+            self._sessions.clear()
+
+    def _serve(self, handler):
+        url = urlparse(handler.path)
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else b""
+        if url.path != "/app":
+            # Newer protocols (KLAP) live elsewhere, clients fall back to this one
+            return self._reply(handler, 404, {"error_code": -1})
+
+        try:
+            request = json.loads(body.decode("utf-8"))
+        except ValueError:
+            return self._reply(handler, 200, {"error_code": -1003})
+
+        method = request.get("method")
+        if method == "handshake":
+            fault = self._apply_fault(handler, method)
+            if fault is False:
+                return
+            response, headers = self._handshake(request.get("params") or {}) if fault is None else (fault, {})
+            return self._reply(handler, 200, response, headers)
+        if method != "securePassthrough":
+            return self._reply(handler, 200, {"error_code": ERROR_INCORRECT_REQUEST})
+
+        session = self._get_session(handler)
+        if session is None:
+            return self._reply(handler, 200, {"error_code": ERROR_SESSION_TIMEOUT})
+        aes = self._crypto[0]
+        inner = json.loads(session.decrypt(aes, (request.get("params") or {}).get("request", "")))
+        response = self._apply_fault(handler, inner.get("method"))
+        if response is False:
+            return
+        if response is None:
+            token = parse_qs(url.query).get("token", [None])[0]
+            result = self._call(session, inner, token)
+            response = {"error_code": 0, "result": {"response": session.encrypt(aes, json.dumps(result))}}
+        self._reply(handler, 200, response)
+
+    def _apply_fault(self, handler, method):
+        """Delay or fail the request as injected. Returns a response to send instead,
+        False if the connection was dropped, or None to answer normally"""
+        plug = self.plug
+        delay = plug.response_delay()
+        fault = plug.take_fault(method)
+        if fault is not None and fault.kind == FAULT_LATENCY:
+            delay += float(fault.value or 1.0)
+            fault = None
+        if delay:
+            time.sleep(delay)
+        if fault is None:
+            return None
+
+        if fault.kind == FAULT_TIMEOUT:
+            time.sleep(float(fault.value or 30.0))
+            handler.close_connection = True
+            return False
+        elif fault.kind == FAULT_MALFORMED:
+            return {"error_code": 0}
+        elif fault.kind == FAULT_ERROR:
+            return {"error_code": int(fault.value if fault.value is not None else ERROR_INCORRECT_REQUEST)}
+        elif fault.kind == FAULT_SESSION_EXPIRED:
+            self.expire_sessions()
+            return {"error_code": ERROR_SESSION_TIMEOUT}
+
+    def _handshake(self, params):
+        aes, pkcs1, rsa = self._crypto
+        key, iv = os.urandom(16), os.urandom(16)
+        session = _Session(key, iv, time.time())
+        public_key = rsa.importKey(params.get("key", ""))
+        encrypted = pkcs1.new(public_key).encrypt(key + iv)
+        with self._lock:
+            self._sessions[session.id] = session
+        return ({"error_code": 0, "result": {"key": base64.b64encode(encrypted).decode("ascii")}},
+                {"Set-Cookie": f"{SESSION_COOKIE}={session.id};TIMEOUT=1440"})
+
+    def _get_session(self, handler):
+        cookies = handler.headers.get("Cookie") or ""
+        for cookie in cookies.split(";"):
+            name, _, value = cookie.strip().partition("=")
+            if name == SESSION_COOKIE:
+                with self._lock:
+                    session = self._sessions.get(value)
+                    ttl = self.plug.session_ttl
+                    if session is not None and ttl is not None and time.time() - session.created > ttl:
+                        del self._sessions[value]
+                        session = None
+                return session
+        return None
+
+    def _call(self, session, request, token):
+        method = request.get("method")
+        params = request.get("params") or {}
+        if method == "login_device":
+            if not self.plug.check_credentials(params.get("username"), params.get("password")):
+                return {"error_code": ERROR_INVALID_CREDENTIALS}
+            session.token = uuid.uuid4().hex.upper()
+            return {"error_code": 0, "result": {"token": session.token}}
+
+        if session.token is None or token != session.token:
+            return {"error_code": ERROR_SESSION_TIMEOUT}
+        error_code, result = self.plug.call(method, params)
+        if error_code != ERROR_SUCCESS:
+            return {"error_code": error_code}
+        return {"error_code": 0, "result": result}
+
+    def _reply(self, handler, status, response, headers=None):
+        body = json.dumps(response).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json;charset=UTF-8")
+        handler.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+##~~ Discovery
+
+class DiscoveryResponder(object):
+    """Answers discovery probes on UDP for the simulated plugs added to it.
+
+    Every plug answers with the address it was added with, the HTTP port
+    included. add() it again with a new address to simulate DHCP moving
+    it, remove() it to simulate it dropping off the network.
+    """
+
+    def __init__(self, host="127.0.0.1", port=DISCOVERY_PORT):
+        self._plugs = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.probes = 0
+
+        responder = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                data, sock = self.request
+                responder._answer(data, sock, self.client_address)
+
+        self._server = socketserver.ThreadingUDPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        """host:port to send discovery probes to"""
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def add(self, plug, address):
+        with self._lock:
+            self._plugs[id(plug)] = (plug, address)
+
+    def remove(self, plug):
+        with self._lock:
+            self._plugs.pop(id(plug), None)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="tapo_p110_discovery", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _answer(self, data, sock, sender):
+        try:
+            probe = decode_packet(data)
+        except ValueError:
+            return
+        if "params" not in probe:
+            return
+        with self._lock:
+            self.probes += 1
+            plugs = list(self._plugs.values())
+        for plug, address in plugs:
+            ip, port = split_address(address)
+            result = dict(
+                device_id=plug.device_id,
+                owner=hashlib.md5(plug.email.encode("utf-8")).hexdigest().upper(),
+                device_type="SMART.TAPOPLUG",
+                device_model=f"{plug.model}(EU)",
+                ip=ip,
+                mac=plug.mac,
+                is_support_iot_cloud=True,
+                obd_src="tplink",
+                factory_default=False,
+                mgt_encrypt_schm=dict(is_support_https=False, encrypt_type="AES", http_port=port)
+            )
+            sock.sendto(encode_packet(dict(error_code=ERROR_SUCCESS, result=result)), sender)
+
+
+##~~ In-process client
+
+def client_class(plug):
+    """A class with PyP100's P110 interface talking straight to plug.
+
+    Faults behave like their network counterparts: timeouts raise
+    TimeoutError after the client's timeout, malformed answers KeyError,
+    expired sessions an "Error Code: 9999" until the next handshake.
+    """
+
+    class SimulatedP110(object):
+        timeout = 2.0
+
+        def __init__(self, address, email, password):
+            self.address = address
+            self.email = email
+            self.password = password
+            self._session = False
+            self._token = None
+
+        def handshake(self):
+            self._roundtrip("handshake")
+            self._session = True
+            self._token = None
+
+        def login(self):
+            self._roundtrip("login_device")
+            if not plug.check_credentials(encode_username(self.email), encode_password(self.password)):
+                raise Exception(f"Error Code: {ERROR_INVALID_CREDENTIALS}, Invalid Request or Credentials")
+            self._token = uuid.uuid4().hex
+
+        def _request(self, method, params=None):
+            if self._token is None:
+                raise Exception(f"Error Code: {ERROR_SESSION_TIMEOUT}, session timeout")
+            self._roundtrip(method)
+            error_code, result = plug.call(method, params)
+            if error_code != ERROR_SUCCESS:
+                raise Exception(f"Error Code: {error_code}")
+            return result
+
+        def request(self, method, params=None):
+            return self._request(method, params)
+
+        def getDeviceInfo(self):
+            return self._request("get_device_info")
+
+        def getEnergyUsage(self):
+            return self._request("get_energy_usage")
+
+        def getCurrentPower(self):
+            return self._request("get_current_power")
+
+        def turnOn(self):
+            self._request("set_device_info", {"device_on": True})
+
+        def turnOff(self):
+            self._request("set_device_info", {"device_on": False})
+
+        def _roundtrip(self, method):
+            delay = plug.response_delay()
+            fault = plug.take_fault(method)
+            if fault is not None and fault.kind == FAULT_LATENCY:
+                delay += float(fault.value or 1.0)
+                fault = None
+            if delay > self.timeout:
+                time.sleep(self.timeout)
+                raise TimeoutError(f"Simulated plug did not answer within {self.timeout}s")
+            if delay:
+                time.sleep(delay)
+            if fault is None:
+                return
+
+            if fault.kind == FAULT_TIMEOUT:
+                time.sleep(min(self.timeout, float(fault.value or 30.0)))
+                raise TimeoutError(f"Simulated plug did not answer within {self.timeout}s")
+            elif fault.kind == FAULT_MALFORMED:
+                raise KeyError("result")
+            elif fault.kind == FAULT_ERROR:
+                raise Exception(f"Error Code: {fault.value if fault.value is not None else ERROR_INCORRECT_REQUEST}")
+            elif fault.kind == FAULT_SESSION_EXPIRED:
+                self._token = None
+                raise Exception(f"Error Code: {ERROR_SESSION_TIMEOUT}, session timeout")
+
+    return SimulatedP110
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulated Tapo P110 for tests and benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--email", default=DEFAULT_EMAIL)
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--on", action="store_true", help="start switched on")
+    parser.add_argument("--curve", choices=sorted(POWER_CURVES), default="idle", help="power drawn while on")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random latency variation, 0.2 is +/-20%%")
+    parser.add_argument("--session-ttl", type=float, default=None, help="seconds until sessions expire")
+    parser.add_argument("--discovery-port", type=int, default=None,
+                        help=f"also answer discovery probes on this UDP port, e.g. {DISCOVERY_PORT}")
+    args = parser.parse_args()
+
+    plug = SimulatedPlug(args.email, args.password, device_on=args.on, power_curve=POWER_CURVES[args.curve](),
+                         latency=args.latency, jitter=args.jitter, session_ttl=args.session_ttl)
+    server = SimulatorServer(plug, args.host, args.port)
+    print(f"Simulated P110 listening on {server.address}, log in with {args.email} / {args.password}")
+    if args.discovery_port is not None:
+        responder = DiscoveryResponder(args.host, args.discovery_port).start()
+        responder.add(plug, server.address)
+        print(f"Answering discovery probes on {responder.address} as {plug.mac}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
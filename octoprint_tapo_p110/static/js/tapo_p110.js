@@ -14,13 +14,99 @@ $(function() {
         // Observable properties
         self.deviceStatus = ko.observable(null);
         self.energyData = ko.observable(null);
+        self.lastPrintEnergy = ko.observable(null);
+
+        // Power history of the selected plug: range name -> [span, bucket size] in seconds
+        self.historyRanges = {
+            day: [86400, 3600],
+            week: [7 * 86400, 6 * 3600],
+            month: [30 * 86400, 86400],
+            year: [365 * 86400, 7 * 86400]
+        };
+        self.historyRange = ko.observable("day");
+        self.history = ko.observableArray([]);
+        self.historyMax = ko.pureComputed(function() {
+            return _.max(_.pluck(self.history(), "energy_wh").concat([0]));
+        });
+        self.historyTotal = ko.pureComputed(function() {
+            return _.reduce(self.history(), function(total, bucket) {
+                return total + bucket.energy_wh;
+            }, 0);
+        });
         self.isConnecting = ko.observable(false);
         self.lastError = ko.observable("");
         self.lastSuccess = ko.observable("");
-        self.autoRefreshEnergy = ko.observable(false);
 
-        // Auto-refresh timer
-        self.refreshTimer = null;
+        // Configured plugs and the one the tab currently controls
+        self.devices = ko.observableArray([]);
+        self.selectedDevice = ko.observable(null);
+        self.deviceStatuses = {};
+        self.deviceEnergy = {};
+        self.deviceConnections = {};
+
+        // Etags of the status and energy fetched here, sent back so unchanged
+        // reads come back empty, and of the last full payload pushed deltas apply to
+        self.deviceEtags = {};
+        self.pushBases = {};
+        self.resyncing = {};
+
+        // Status fields the tab shows, the rest of the device info isn't fetched
+        self.statusFields = ["device_on", "nickname", "model", "fw_ver", "signal_level", "on_time"];
+
+        // Background jobs started by this browser, and finished jobs whose
+        // 202 reply hasn't arrived yet
+        self.jobCallbacks = {};
+        self.finishedJobs = {};
+
+        // Availability of the PyP100 library, shown in the settings
+        self.libraryStatus = ko.observable(null);
+        self.canInstallLibrary = ko.observable(false);
+
+        // Plugs that answered the last discovery probe
+        self.discoveredPlugs = ko.observableArray([]);
+        self.isDiscovering = ko.observable(false);
+
+        // Pending scheduled power actions of all plugs, soonest first
+        self.scheduledActions = ko.observableArray([]);
+
+        // Connection state of the selected plug, with a countdown to the next attempt
+        self.connectionState = ko.observable(null);
+        self.now = ko.observable(Date.now() / 1000);
+        setInterval(function() {
+            self.now(Date.now() / 1000);
+        }, 1000);
+
+        self.connectionLabel = ko.pureComputed(function() {
+            var connection = self.connectionState();
+            if (!connection) {
+                return "";
+            }
+            switch (connection.state) {
+                case "connected":
+                    return gettext("Connected");
+                case "degraded":
+                    return gettext("Degraded") + " (" + connection.failures + " " + gettext("failures") + ")";
+                case "half_open":
+                    return gettext("Reconnecting...");
+                case "open":
+                    var remaining = connection.retry_at ? Math.max(0, Math.round(connection.retry_at - self.now())) : 0;
+                    return gettext("Unreachable, retrying in") + " " + remaining + "s";
+            }
+            return connection.state;
+        });
+
+        self.connectionCss = ko.pureComputed(function() {
+            var connection = self.connectionState();
+            if (!connection) {
+                return "";
+            }
+            return {
+                connected: "label-success",
+                degraded: "label-warning",
+                half_open: "label-info",
+                open: "label-important"
+            }[connection.state] || "";
+        });
 
         // Clear messages after delay
         self.clearMessages = function() {
@@ -52,13 +138,21 @@ $(function() {
                 url: API_BASEURL + "plugin/tapo_p110",
                 type: "POST",
                 dataType: "json",
-                data: JSON.stringify({
-                    command: command,
-                    ...data
-                }),
+                data: JSON.stringify($.extend({
+                    command: command
+                }, self.selectedDevice() ? {device: self.selectedDevice()} : {}, data)),
                 contentType: "application/json; charset=UTF-8",
-                success: function(response) {
+                success: function(response, status, xhr) {
+                    if (xhr.status === 202 && response.job) {
+                        // Runs in the background, the result arrives as a plugin message
+                        self.trackJob(response.job, successCallback, errorCallback);
+                        return;
+                    }
+
                     self.isConnecting(false);
+                    if (response && response.device && response.connection) {
+                        self.updateDevice(response.device, "connection", response.connection);
+                    }
                     if (successCallback) {
                         successCallback(response);
                     }
@@ -78,14 +172,63 @@ $(function() {
             });
         };
 
+        // Background jobs
+        self.trackJob = function(job, successCallback, errorCallback) {
+            var callbacks = {success: successCallback, error: errorCallback};
+            var finished = self.finishedJobs[job.id];
+            if (finished) {
+                delete self.finishedJobs[job.id];
+                self.finishJob(finished, callbacks);
+            } else {
+                self.jobCallbacks[job.id] = callbacks;
+            }
+        };
+
+        self.finishJob = function(job, callbacks) {
+            self.isConnecting(false);
+            var result = job.result || {};
+            if (result.device && result.connection) {
+                self.updateDevice(result.device, "connection", result.connection);
+            }
+            if (job.status === "done") {
+                if (callbacks.success) {
+                    callbacks.success(result);
+                }
+            } else {
+                var message = job.error || "Command failed";
+                if (callbacks.error) {
+                    callbacks.error(message);
+                } else {
+                    self.showError(message);
+                }
+            }
+        };
+
+        self.onJobUpdate = function(job) {
+            if (job.status !== "done" && job.status !== "failed") {
+                return;
+            }
+
+            var callbacks = self.jobCallbacks[job.id];
+            if (callbacks) {
+                delete self.jobCallbacks[job.id];
+                self.finishJob(job, callbacks);
+            } else {
+                // Either another browser's job or our 202 reply is still on its way
+                self.finishedJobs[job.id] = job;
+                setTimeout(function() {
+                    delete self.finishedJobs[job.id];
+                }, 60000);
+            }
+        };
+
         // Device control functions
         self.turnOn = function() {
             self.apiCall("turn_on", {}, function(response) {
                 if (response.success) {
                     self.showSuccess("Device turned ON");
-                    self.refreshStatus();
                 } else {
-                    self.showError("Failed to turn ON device");
+                    self.showError(response.error || "Failed to turn ON device");
                 }
             });
         };
@@ -94,9 +237,8 @@ $(function() {
             self.apiCall("turn_off", {}, function(response) {
                 if (response.success) {
                     self.showSuccess("Device turned OFF");
-                    self.refreshStatus();
                 } else {
-                    self.showError("Failed to turn OFF device");
+                    self.showError(response.error || "Failed to turn OFF device");
                 }
             });
         };
@@ -105,73 +247,326 @@ $(function() {
             self.apiCall("toggle", {}, function(response) {
                 if (response.success) {
                     self.showSuccess("Device state toggled");
-                    self.refreshStatus();
                 } else {
-                    self.showError("Failed to toggle device");
+                    self.showError(response.error || "Failed to toggle device");
                 }
             });
         };
 
         // Status and monitoring functions
         self.refreshStatus = function() {
-            self.apiCall("get_status", {}, function(response) {
+            self.apiCall("get_status", {fields: self.statusFields, etag: self.etag(self.selectedDevice(), "status")}, function(response) {
+                if (response.not_modified) {
+                    return;
+                }
                 if (response.status) {
-                    self.deviceStatus(response.status);
+                    self.updateDevice(response.device, "status", response.status, response.etag);
                 } else {
-                    self.showError("Failed to get device status");
+                    self.showError(response.error || "Failed to get device status");
+                }
+            });
+        };
+
+        // Status and energy in one request, batched into one round-trip to the plug
+        self.refreshSnapshot = function() {
+            var deviceId = self.selectedDevice();
+            var etag = {status: self.etag(deviceId, "status"), energy: self.etag(deviceId, "energy")};
+            self.apiCall("get_snapshot", {fields: self.statusFields, etag: etag}, function(response) {
+                if (response.not_modified) {
+                    return;
+                }
+                if (response.snapshot) {
+                    self.updateDevice(response.device, "status", response.snapshot.status, response.etag.status);
+                    if (response.snapshot.energy) {
+                        self.updateDevice(response.device, "energy", response.snapshot.energy, response.etag.energy);
+                    }
+                } else {
+                    self.showError(response.error || "Failed to get device status");
                 }
             });
         };
 
         self.refreshEnergy = function() {
-            self.apiCall("get_energy", {}, function(response) {
+            self.apiCall("get_energy", {etag: self.etag(self.selectedDevice(), "energy")}, function(response) {
+                if (response.not_modified) {
+                    return;
+                }
                 if (response.energy) {
-                    self.energyData(response.energy);
+                    self.updateDevice(response.device, "energy", response.energy, response.etag);
                 } else {
-                    self.showError("Failed to get energy data");
+                    self.showError(response.error || "Failed to get energy data");
                 }
             });
         };
 
+        self.refreshHistory = function() {
+            var range = self.historyRanges[self.historyRange()];
+            var now = Math.floor(Date.now() / 1000);
+            var resolution = range[1];
+            var params = {start: Math.floor((now - range[0]) / resolution) * resolution + resolution, end: now, resolution: resolution};
+            self.apiCall("get_history", params, function(response) {
+                self.history(response.history || []);
+            });
+        };
+
+        self.selectHistoryRange = function(range) {
+            self.historyRange(range);
+            self.refreshHistory();
+        };
+
+        // Download the raw samples of the selected range, streamed by the plugin
+        self.exportHistory = function(format) {
+            var now = Math.floor(Date.now() / 1000);
+            var params = {format: format, start: now - self.historyRanges[self.historyRange()][0], end: now};
+            if (self.selectedDevice()) {
+                params.device = self.selectedDevice();
+            }
+            window.location.href = PLUGIN_BASEURL + "tapo_p110/history/export?" + $.param(params);
+        };
+
+        self.historyBarHeight = function(bucket) {
+            var max = self.historyMax();
+            return (max ? Math.max(1, Math.round(bucket.energy_wh / max * 100)) : 0) + "%";
+        };
+
+        self.historyBarTitle = function(bucket) {
+            var title = new Date(bucket.start * 1000).toLocaleString() + ": " + self.formatEnergy(bucket.energy_wh);
+            if (bucket.samples) {
+                title += ", avg " + bucket.avg.toFixed(1) + " W, min " + bucket.min.toFixed(1) + " W, max " + bucket.max.toFixed(1) + " W";
+            }
+            return title;
+        };
+
         self.testConnection = function() {
             self.apiCall("test_connection", {}, function(response) {
                 if (response.success) {
                     self.showSuccess("Connection test successful");
                     self.refreshStatus();
                 } else {
-                    self.showError("Connection test failed");
+                    self.showError(response.error || "Connection test failed");
                 }
             });
         };
 
-        // Auto-refresh functionality
-        self.autoRefreshEnergy.subscribe(function(enabled) {
-            if (enabled) {
-                self.startAutoRefresh();
-            } else {
-                self.stopAutoRefresh();
+        // PyP100 library
+        self.loadLibraryStatus = function() {
+            self.apiCall("get_library_status", {}, function(response) {
+                self.libraryStatus(response.library || null);
+                self.canInstallLibrary(!!response.can_install);
+            });
+        };
+
+        self.installLibrary = function() {
+            self.libraryStatus($.extend({}, self.libraryStatus(), {status: "installing", error: null}));
+            self.apiCall("install_library", {}, function(response) {
+                self.libraryStatus(response);
+                self.showSuccess("PyP100 installed");
+            }, function(message) {
+                self.loadLibraryStatus();
+                self.showError(message);
+            });
+        };
+
+        // Plugs found on the network, for filling in the settings
+        self.discoverPlugs = function() {
+            self.isDiscovering(true);
+            self.apiCall("discover_devices", {}, function(response) {
+                self.isDiscovering(false);
+                self.discoveredPlugs(response.devices || []);
+                if (!self.discoveredPlugs().length) {
+                    self.showError("No plugs answered");
+                }
+            }, function(message) {
+                self.isDiscovering(false);
+                self.showError(message);
+            });
+        };
+
+        self.useDiscoveredPlug = function(plug) {
+            self.settings.settings.plugins.tapo_p110.device_ip(plug.ip);
+            self.settings.settings.plugins.tapo_p110.device_mac(plug.mac);
+        };
+
+        self.addDiscoveredPlug = function(plug) {
+            self.settings.settings.plugins.tapo_p110.devices.push({
+                id: ko.observable(""),
+                name: ko.observable(""),
+                ip: ko.observable(plug.ip),
+                username: ko.observable(""),
+                password: ko.observable(""),
+                mac: ko.observable(plug.mac),
+                group: ko.observable("")
+            });
+        };
+
+        // Scheduled power actions
+        self.loadActions = function() {
+            self.apiCall("get_scheduled_actions", {}, function(response) {
+                self.scheduledActions(response.actions || []);
+            });
+        };
+
+        self.cancelAction = function(action) {
+            self.apiCall("cancel_action", {action: action.id}, function(response) {
+                self.showSuccess("Scheduled action cancelled");
+            });
+        };
+
+        self.actionLabel = function(action) {
+            var device = _.find(self.devices(), function(device) {
+                return device.id === action.device;
+            });
+            var name = device ? device.name : action.device;
+            var label = (action.action === "turn_on" ? gettext("Turn on") : gettext("Turn off")) + " " + name;
+            if (action.reason === "cooldown") {
+                label += " " + gettext("when cooled down, at the latest");
             }
+            return label;
+        };
+
+        self.actionCountdown = function(action) {
+            var remaining = Math.max(0, Math.round(action.due - self.now()));
+            return self.formatOnTime(remaining);
+        };
+
+        // Multiple plugs
+        self.loadDevices = function() {
+            self.apiCall("get_devices", {}, function(response) {
+                var devices = response.devices || [];
+                _.each(devices, function(device) {
+                    self.deviceStatuses[device.id] = device.status;
+                    self.deviceEnergy[device.id] = device.energy;
+                    self.deviceConnections[device.id] = device.connection;
+                    self.pushBases[device.id] = device.etag || {};
+                });
+                self.devices(devices);
+
+                var selected = _.find(devices, function(device) {
+                    return device.id === self.selectedDevice();
+                }) || _.find(devices, function(device) {
+                    return device.configured;
+                }) || devices[0];
+                if (selected) {
+                    self.selectedDevice(selected.id);
+                }
+            });
+        };
+
+        self.selectedDevice.subscribe(function(deviceId) {
+            self.deviceStatus(self.deviceStatuses[deviceId] || null);
+            self.energyData(self.deviceEnergy[deviceId] || null);
+            self.connectionState(self.deviceConnections[deviceId] || null);
+            self.refreshSnapshot();
+            self.refreshHistory();
         });
 
-        self.startAutoRefresh = function() {
-            if (self.refreshTimer) {
-                clearInterval(self.refreshTimer);
+        self.updateDevice = function(deviceId, kind, value, etag, pushBase) {
+            if (etag !== undefined) {
+                self.deviceEtags[deviceId] = self.deviceEtags[deviceId] || {};
+                self.deviceEtags[deviceId][kind] = etag;
             }
-            
-            self.refreshTimer = setInterval(function() {
-                if (self.autoRefreshEnergy()) {
-                    self.refreshEnergy();
+            if (pushBase !== undefined) {
+                self.pushBases[deviceId] = self.pushBases[deviceId] || {};
+                self.pushBases[deviceId][kind] = pushBase;
+            }
+            if (kind === "status") {
+                self.deviceStatuses[deviceId] = value;
+            } else if (kind === "energy") {
+                self.deviceEnergy[deviceId] = value;
+            } else if (kind === "connection") {
+                self.deviceConnections[deviceId] = value;
+            }
+
+            if (!deviceId || deviceId === self.selectedDevice()) {
+                if (kind === "status") {
+                    self.deviceStatus(value);
+                } else if (kind === "energy") {
+                    self.energyData(value);
+                } else if (kind === "connection") {
+                    self.connectionState(value);
+                }
+            }
+        };
+
+        self.etag = function(deviceId, kind) {
+            return (self.deviceEtags[deviceId] || {})[kind] || null;
+        };
+
+        // A pushed status or energy update, either in full or the fields changed since the version
+        // named by base. If that isn't the version held here the full payload is fetched instead.
+        // The value held no longer matches the etag of a projected read, so the next read is unconditional
+        self.applyPush = function(data) {
+            var kind = data.type;
+            if (!data.delta) {
+                self.updateDevice(data.device, kind, data[kind], null, data.etag);
+                return;
+            }
+
+            var current = kind === "status" ? self.deviceStatuses[data.device] : self.deviceEnergy[data.device];
+            if (!current || (self.pushBases[data.device] || {})[kind] !== data.base) {
+                (self.pushBases[data.device] || {})[kind] = null;
+                if (data.device === self.selectedDevice() && !self.resyncing[data.device]) {
+                    // Full payloads, their etags are what the next deltas are based on
+                    self.resyncing[data.device] = true;
+                    self.apiCall("get_snapshot", {device: data.device}, function(response) {
+                        self.resyncing[data.device] = false;
+                        if (response.snapshot) {
+                            self.updateDevice(response.device, "status", response.snapshot.status, null, response.etag.status);
+                            if (response.snapshot.energy) {
+                                self.updateDevice(response.device, "energy", response.snapshot.energy, null, response.etag.energy);
+                            }
+                        }
+                    }, function() {
+                        self.resyncing[data.device] = false;
+                    });
                 }
-            }, 30000); // 30 seconds
+                return;
+            }
+            self.updateDevice(data.device, kind, _.omit(_.extend({}, current, data.delta), data.removed || []), null, data.etag);
+        };
+
+        self.onSettingsShown = function() {
+            self.loadLibraryStatus();
+        };
+
+        self.onSettingsSaved = function() {
+            self.loadDevices();
         };
 
-        self.stopAutoRefresh = function() {
-            if (self.refreshTimer) {
-                clearInterval(self.refreshTimer);
-                self.refreshTimer = null;
+        // Pushed updates from the server's background monitor
+        self.onDataUpdaterPluginMessage = function(plugin, data) {
+            if (plugin !== "tapo_p110" || !data) {
+                return;
+            }
+
+            if ((data.type === "status" || data.type === "energy") && (data[data.type] || data.delta)) {
+                self.applyPush(data);
+            } else if (data.type === "connection" && data.connection) {
+                self.updateDevice(data.device, "connection", data.connection);
+            } else if (data.type === "job" && data.job) {
+                self.onJobUpdate(data.job);
+            } else if (data.type === "actions" && data.actions) {
+                self.scheduledActions(data.actions);
+            } else if (data.type === "print_energy" && data.print_energy) {
+                self.lastPrintEnergy(data.print_energy);
+            } else if (data.type === "anomaly" && data.anomaly) {
+                self.onAnomaly(data.anomaly);
             }
         };
 
+        self.onAnomaly = function(anomaly) {
+            var actions = {
+                pause: gettext("The print was paused."),
+                cutoff: gettext("The plug was switched off.")
+            };
+            new PNotify({
+                title: gettext("Power anomaly on") + " " + anomaly.device,
+                text: anomaly.message + (actions[anomaly.action] ? " " + actions[anomaly.action] : ""),
+                type: "error",
+                hide: false
+            });
+        };
+
         // Formatting functions
         self.formatPower = function(milliwatts) {
             if (!milliwatts) return "0 W";
@@ -197,6 +592,10 @@ $(function() {
             return minutes + " min";
         };
 
+        self.formatDuration = function(seconds) {
+            return self.formatOnTime(Math.round(seconds || 0));
+        };
+
         self.formatOnTime = function(seconds) {
             if (!seconds) return "0s";
             if (seconds >= 3600) {
@@ -216,17 +615,10 @@ $(function() {
         self.onBeforeBinding = function() {
             // Initial status refresh
             setTimeout(function() {
-                self.refreshStatus();
-                self.refreshEnergy();
+                self.loadDevices();
+                self.loadActions();
             }, 1000);
         };
-
-        // Cleanup
-        self.onTabChange = function(current, previous) {
-            if (previous === "#tab_plugin_tapo_p110") {
-                self.stopAutoRefresh();
-            }
-        };
     }
 
     // Register the view model
@@ -0,0 +1,343 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import datetime
+import os
+import struct
+import threading
+import time
+from array import array
+
+from .rollup import PowerRollups
+
+# On-disk segments hold one UTC day each: a small header followed by
+# fixed-size records of (uint32 unix time, float32 watts).
+SEGMENT_MAGIC = b"TPTS"
+SEGMENT_VERSION = 1
+SEGMENT_HEADER = struct.Struct("<4sBBH")  # magic, version, flags, reserved
+SEGMENT_RECORD = struct.Struct("<If")
+SEGMENT_SUFFIX = ".bin"
+
+FLAG_COMPACTED = 0x01  # samples were averaged down to compact_resolution
+
+# Records read from disk per chunk, keeps memory flat for long ranges
+READ_CHUNK_RECORDS = 4096
+
+DAY = 86400
+
+
+class RingBuffer(object):
+    """Fixed-size buffer of (timestamp, value) samples backed by two arrays"""
+
+    def __init__(self, capacity):
+        self.capacity = max(1, int(capacity))
+        self._timestamps = array("d", bytes(8 * self.capacity))
+        self._values = array("f", bytes(4 * self.capacity))
+        self._start = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, value):
+        end = (self._start + self._count) % self.capacity
+        self._timestamps[end] = timestamp
+        self._values[end] = value
+        if self._count < self.capacity:
+            self._count += 1
+        else:
+            self._start = (self._start + 1) % self.capacity
+
+    def oldest(self):
+        return self._timestamps[self._start] if self._count else None
+
+    def latest(self):
+        if not self._count:
+            return None
+        index = (self._start + self._count - 1) % self.capacity
+        return self._timestamps[index], self._values[index]
+
+    def samples(self, start=None, end=None):
+        """Samples with start <= timestamp < end, oldest first"""
+        first = self._find(start) if start is not None else 0
+        last = self._find(end) if end is not None else self._count
+        result = []
+        for offset in range(first, last):
+            index = (self._start + offset) % self.capacity
+            result.append((self._timestamps[index], self._values[index]))
+        return result
+
+    def _find(self, timestamp):
+        """Offset of the first sample at or after timestamp (binary search)"""
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamps[(self._start + middle) % self.capacity] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+class PowerStore(object):
+    """Power samples for one plug: a ring buffer in memory plus daily segments on disk.
+
+    New samples are buffered and appended to disk in batches every
+    flush_interval seconds to spare SD cards. Segments older than
+    raw_days are compacted to compact_resolution averages, segments older
+    than retention_days are deleted. Minute, hour and day rollups are
+    updated with every sample for fast range queries.
+    """
+
+    def __init__(self, folder, capacity=86400, flush_interval=60, raw_days=7, retention_days=90,
+                 compact_resolution=60, maintenance_interval=3600, logger=None):
+        self.folder = folder
+        self.flush_interval = flush_interval
+        self.raw_days = raw_days
+        self.retention_days = retention_days
+        self.compact_resolution = compact_resolution
+        self.maintenance_interval = maintenance_interval
+        self._logger = logger
+
+        self._lock = threading.RLock()
+        self._buffer = RingBuffer(capacity)
+        self._pending = array("d")
+        self._last_flush = time.monotonic()
+        self._last_maintenance = 0.0
+
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        self.rollups = PowerRollups(folder)
+        if not self.rollups.exists():
+            self._build_rollups()
+
+    def configure(self, raw_days, retention_days):
+        """Apply new history settings, the next sample runs the maintenance with them"""
+        with self._lock:
+            changed = (raw_days, retention_days) != (self.raw_days, self.retention_days)
+            self.raw_days = raw_days
+            self.retention_days = retention_days
+            if changed:
+                self._last_maintenance = 0.0
+
+    ##~~ Writing
+
+    def append(self, timestamp, watts):
+        """Record one sample. Samples must arrive in time order"""
+        with self._lock:
+            latest = self._buffer.latest()
+            if latest is not None and timestamp <= latest[0]:
+                return False
+            self._buffer.append(timestamp, watts)
+            self.rollups.add(timestamp, watts)
+            self._pending.append(timestamp)
+            self._pending.append(watts)
+
+            now = time.monotonic()
+            if now - self._last_flush >= self.flush_interval:
+                self.flush()
+            if now - self._last_maintenance >= self.maintenance_interval:
+                self._last_maintenance = now
+                self.maintain()
+            return True
+
+    def flush(self):
+        """Append buffered samples to their day segments"""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            try:
+                self.rollups.flush()
+            except (IOError, OSError) as e:
+                self._log_error(f"Could not write power rollups to {self.folder}: {e}")
+            if not self._pending:
+                return
+
+            by_day = {}
+            pending = self._pending
+            for index in range(0, len(pending), 2):
+                timestamp = int(pending[index])
+                by_day.setdefault(timestamp - timestamp % DAY, bytearray()).extend(
+                    SEGMENT_RECORD.pack(timestamp, pending[index + 1]))
+            self._pending = array("d")
+
+            for day, data in by_day.items():
+                path = self._segment_path(day)
+                try:
+                    if not os.path.exists(path):
+                        data[:0] = SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, 0, 0)
+                    else:
+                        self._repair_tail(path)
+                    with open(path, "ab") as f:
+                        f.write(data)
+                except (IOError, OSError) as e:
+                    self._log_error(f"Could not write power samples to {path}: {e}")
+
+    def close(self):
+        """Write everything out, including the rollup buckets still being filled"""
+        with self._lock:
+            self.flush()
+            try:
+                self.rollups.close()
+            except (IOError, OSError) as e:
+                self._log_error(f"Could not write power rollups to {self.folder}: {e}")
+
+    def _build_rollups(self):
+        """Fill the rollups from the segments recorded before they existed"""
+        if not self._segments():
+            return
+        for timestamp, watts in self.iter_samples(0, float("inf")):
+            self.rollups.add(timestamp, watts)
+        self.rollups.close()
+
+    def _repair_tail(self, path):
+        """Cut off a partial record left by an interrupted write, so appends stay aligned"""
+        size = os.path.getsize(path)
+        misaligned = (size - SEGMENT_HEADER.size) % SEGMENT_RECORD.size
+        if size >= SEGMENT_HEADER.size and misaligned:
+            with open(path, "r+b") as f:
+                f.truncate(size - misaligned)
+
+    ##~~ Reading
+
+    def latest(self):
+        with self._lock:
+            return self._buffer.latest()
+
+    def samples(self, start, end):
+        """All samples in [start, end), from memory if it reaches back far enough"""
+        with self._lock:
+            oldest = self._buffer.oldest()
+            if oldest is not None and start >= oldest:
+                return self._buffer.samples(start, end)
+            self.flush()
+        return list(self.iter_samples(start, end))
+
+    def history(self, start, end, resolution):
+        """min/max/avg/energy buckets for [start, end) from the rollups, and the resolution used"""
+        return self.rollups.query(start, end, resolution)
+
+    def iter_samples(self, start, end, chunk_records=READ_CHUNK_RECORDS):
+        """Stream samples in [start, end) straight from disk, chunk by chunk"""
+        for day, path in self._segments():
+            if day + DAY <= start or day >= end:
+                continue
+            for timestamp, watts in self._read_segment(path, chunk_records):
+                if timestamp < start:
+                    continue
+                if timestamp >= end:
+                    break
+                yield timestamp, watts
+
+    def _read_segment(self, path, chunk_records=READ_CHUNK_RECORDS):
+        try:
+            with open(path, "rb") as f:
+                header = f.read(SEGMENT_HEADER.size)
+                if len(header) < SEGMENT_HEADER.size or header[:4] != SEGMENT_MAGIC:
+                    self._log_error(f"Skipping {path}: not a power sample segment")
+                    return
+                chunk_size = chunk_records * SEGMENT_RECORD.size
+                remainder = b""
+                while True:
+                    data = remainder + f.read(chunk_size)
+                    # A record may be cut by a flush still writing it: carry it over to the next
+                    # read, and at the end of the file drop it like the partial record of a torn write
+                    split = len(data) - len(data) % SEGMENT_RECORD.size
+                    data, remainder = data[:split], data[split:]
+                    if not data:
+                        return
+                    for record in SEGMENT_RECORD.iter_unpack(data):
+                        yield record
+        except (IOError, OSError) as e:
+            self._log_error(f"Could not read {path}: {e}")
+
+    ##~~ Maintenance
+
+    def maintain(self, now=None):
+        """Compact old raw segments and delete expired ones"""
+        if now is None:
+            now = time.time()
+        today = int(now) - int(now) % DAY
+        with self._lock:
+            self.flush()
+            for day, path in self._segments():
+                age_days = (today - day) // DAY
+                try:
+                    if age_days >= self.retention_days:
+                        os.remove(path)
+                    elif age_days >= self.raw_days and not self._is_compacted(path):
+                        self._compact(path)
+                except (IOError, OSError) as e:
+                    self._log_error(f"Maintenance of {path} failed: {e}")
+            try:
+                self.rollups.prune(today - self.retention_days * DAY)
+            except (IOError, OSError) as e:
+                self._log_error(f"Maintenance of the rollups in {self.folder} failed: {e}")
+
+    def _compact(self, path):
+        """Rewrite a segment with one average per compact_resolution seconds"""
+        resolution = self.compact_resolution
+        output = bytearray(SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, FLAG_COMPACTED, 0))
+        bucket, total, count = None, 0.0, 0
+        for timestamp, watts in self._read_segment(path):
+            start = timestamp - timestamp % resolution
+            if start != bucket:
+                if count:
+                    output.extend(SEGMENT_RECORD.pack(bucket, total / count))
+                bucket, total, count = start, 0.0, 0
+            total += watts
+            count += 1
+        if count:
+            output.extend(SEGMENT_RECORD.pack(bucket, total / count))
+
+        temp = path + ".tmp"
+        with open(temp, "wb") as f:
+            f.write(output)
+        os.replace(temp, path)
+
+    def _is_compacted(self, path):
+        with open(path, "rb") as f:
+            header = f.read(SEGMENT_HEADER.size)
+        if len(header) < SEGMENT_HEADER.size:
+            return False
+        return bool(SEGMENT_HEADER.unpack(header)[2] & FLAG_COMPACTED)
+
+    ##~~ Helpers
+
+    def _segments(self):
+        """(day start, path) of every segment, oldest first"""
+        segments = []
+        try:
+            names = os.listdir(self.folder)
+        except OSError:
+            return segments
+        for name in names:
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            try:
+                day = datetime.datetime.strptime(name[:-len(SEGMENT_SUFFIX)], "%Y%m%d")
+            except ValueError:
+                continue
+            timestamp = int(day.replace(tzinfo=datetime.timezone.utc).timestamp())
+            segments.append((timestamp, os.path.join(self.folder, name)))
+        return sorted(segments)
+
+    def _segment_path(self, day):
+        name = datetime.datetime.fromtimestamp(day, datetime.timezone.utc).strftime("%Y%m%d")
+        return os.path.join(self.folder, name + SEGMENT_SUFFIX)
+
+    def get_stats(self):
+        with self._lock:
+            segments = self._segments()
+            return dict(
+                memory_samples=len(self._buffer),
+                memory_capacity=self._buffer.capacity,
+                pending_samples=len(self._pending) // 2,
+                segments=len(segments),
+                disk_bytes=sum(os.path.getsize(path) for _, path in segments),
+                rollup_bytes=self.rollups.get_stats()
+            )
+
+    def _log_error(self, message):
+        if self._logger is not None:
+            self._logger.error(message)
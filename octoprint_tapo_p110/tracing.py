@@ -0,0 +1,190 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import collections
+import itertools
+import os
+import threading
+import time
+
+OUTCOME_OK = "ok"
+OUTCOME_ERROR = "error"
+
+
+class Span(object):
+    """One timed step of a request, usable as a context manager.
+
+    Entering makes it the current span of the thread, so spans opened
+    inside it become its children. An exception leaving the block marks it
+    failed; fail() does so for errors that are handled inside.
+    """
+
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "attributes",
+                 "start", "duration", "outcome", "error", "thread", "thread_id", "_started")
+
+    def __init__(self, tracer, name, trace_id, span_id, parent_id, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = None
+        self.duration = None
+        self.outcome = OUTCOME_OK
+        self.error = None
+        self.thread = None
+        self.thread_id = None
+        self._started = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def fail(self, error):
+        self.outcome = OUTCOME_ERROR
+        self.error = str(error)
+
+    def __enter__(self):
+        self.thread = threading.current_thread().name
+        self.thread_id = threading.get_ident()
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.tracer._push(self)
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        self.duration = time.perf_counter() - self._started
+        if error is not None:
+            self.fail(f"{kind.__name__}: {error}")
+        self.tracer._pop(self)
+        return False
+
+    def to_dict(self):
+        return dict(name=self.name, trace=self.trace_id, span=self.span_id, parent=self.parent_id,
+                    start=self.start, duration=self.duration, outcome=self.outcome, error=self.error,
+                    thread=self.thread, thread_id=self.thread_id, attributes=self.attributes)
+
+
+class _NullSpan(object):
+    """Stands in for a span while tracing is off"""
+
+    trace_id = span_id = None
+
+    def set(self, **attributes):
+        pass
+
+    def fail(self, error):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer(object):
+    """Keeps the last capacity finished spans in memory.
+
+    Spans nest per thread on their own. Work handed to another thread
+    (connection attempts, background jobs) passes its parent explicitly.
+    A capacity of 0 turns tracing off, span() then costs one check.
+    """
+
+    def __init__(self, capacity=2000):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._prefix = os.urandom(4).hex()
+        self._spans = collections.deque(maxlen=max(1, capacity))
+        self.capacity = capacity
+        self.dropped = 0
+
+    def configure(self, capacity):
+        with self._lock:
+            if capacity != self.capacity:
+                self._spans = collections.deque(self._spans, maxlen=max(1, capacity))
+                self.capacity = capacity
+
+    def span(self, name, parent=None, **attributes):
+        """A new span, child of parent or else of the thread's current span"""
+        if not self.capacity:
+            return NULL_SPAN
+        if parent is None:
+            parent = self.current()
+        span_id = f"{self._prefix}{next(self._ids):x}"
+        if parent is None or parent.trace_id is None:
+            return Span(self, name, span_id, span_id, None, attributes)
+        return Span(self, name, parent.trace_id, span_id, parent.span_id, attributes)
+
+    def current(self):
+        stack = getattr(self._local, "stack", None)
+        return stack[-1] if stack else None
+
+    def _push(self, span):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(span)
+
+    def _pop(self, span):
+        stack = self._local.stack
+        if stack and stack[-1] is span:
+            stack.pop()
+        elif span in stack:
+            stack.remove(span)
+        with self._lock:
+            if len(self._spans) == self._spans.maxlen:
+                self.dropped += 1
+            self._spans.append(span)
+
+    def spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def traces(self, trace_id=None, limit=50, min_duration=0.0):
+        """Finished traces, newest first, each with its spans in start order"""
+        grouped = collections.OrderedDict()
+        for span in self.spans():
+            if trace_id is None or span.trace_id == trace_id:
+                grouped.setdefault(span.trace_id, []).append(span)
+
+        result = []
+        for trace, spans in grouped.items():
+            spans.sort(key=lambda span: span.start)
+            root = next((span for span in spans if span.span_id == trace), None)
+            if root is None:
+                # The root is still running or was dropped from the buffer
+                continue
+            if root.duration < min_duration:
+                continue
+            result.append(dict(trace=trace, name=root.name, start=root.start, duration=root.duration,
+                               outcome=root.outcome, spans=[span.to_dict() for span in spans]))
+        result.sort(key=lambda trace: trace["start"], reverse=True)
+        return result[:limit] if limit else result
+
+    def to_chrome(self, traces):
+        """Traces in Chrome's trace event format, for chrome://tracing or Perfetto"""
+        events = []
+        threads = {}
+        for trace in traces:
+            for span in trace["spans"]:
+                # Hedged attempts run on threads of the same name, so tell them apart by ident
+                key = (span["thread_id"], span["thread"])
+                tid = threads.setdefault(key, len(threads) + 1)
+                args = dict(span["attributes"], trace=span["trace"], span=span["span"], outcome=span["outcome"])
+                if span["error"]:
+                    args["error"] = span["error"]
+                events.append(dict(name=span["name"], cat=trace["name"], ph="X", pid=1, tid=tid,
+                                   ts=span["start"] * 1e6, dur=span["duration"] * 1e6, args=args))
+        for (ident, name), tid in threads.items():
+            events.append(dict(name="thread_name", ph="M", pid=1, tid=tid, args=dict(name=name)))
+        return dict(traceEvents=events, displayTimeUnit="ms")
+
+    def get_stats(self):
+        with self._lock:
+            return dict(capacity=self.capacity, spans=len(self._spans) if self.capacity else 0,
+                        dropped=self.dropped)
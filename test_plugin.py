@@ -6,7 +6,7 @@ Tests basic functionality without OctoPrint
 
 import sys
 import os
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'octoprint_tapo_p110'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from PyP100 import PyP110
 import time
@@ -144,6 +144,14 @@ def main():
     print("🚀 OctoPrint Tapo P110 Plugin Test")
     print("=" * 50)
     
+    simulated = '--simulator' in sys.argv
+    if simulated:
+        # Run against a local simulated plug instead of real hardware
+        from octoprint_tapo_p110.simulator import SimulatorServer, SimulatedPlug, DEFAULT_EMAIL, DEFAULT_PASSWORD
+        server = SimulatorServer(SimulatedPlug(device_on=True)).start()
+        TEST_CONFIG.update(device_ip=server.address, username=DEFAULT_EMAIL, password=DEFAULT_PASSWORD)
+        print(f"🧪 Using simulated P110 at {server.address}")
+
     # Check configuration
     if (TEST_CONFIG['device_ip'] == '192.168.1.100' or 
         TEST_CONFIG['username'] == 'your@email.com'):
@@ -169,7 +177,10 @@ def main():
         print("\n⚠️  Energy monitoring test failed (may not be supported)")
     
     # Test power control (optional - will change device state)
-    response = input("\n🔄 Test power control? This will turn your device on/off (y/N): ")
+    if simulated:
+        response = 'y'
+    else:
+        response = input("\n🔄 Test power control? This will turn your device on/off (y/N): ")
     if response.lower() in ['y', 'yes']:
         test_power_control(device)
     else:
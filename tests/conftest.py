@@ -0,0 +1,6 @@
+# coding=utf-8
+import os
+import sys
+
+# Run against the checkout, installed or not. None of the tests need OctoPrint
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,62 @@
+# coding=utf-8
+import pytest
+
+from octoprint_tapo_p110.accounting import PrintEnergyLedger, RESULT_DONE, RESULT_CANCELLED
+
+
+def run_print(ledger, path, start, samples, end, result=RESULT_DONE, device="plug"):
+    ledger.start(path, path, "local", device, start)
+    for timestamp, watts in samples:
+        ledger.add_sample(device, timestamp, watts)
+    return ledger.finish(result, end)
+
+
+def test_energy_covers_the_whole_print(tmp_path):
+    ledger = PrintEnergyLedger(str(tmp_path / "ledger.json"))
+    record = run_print(ledger, "cube.gcode", 0, [(10, 100.0), (20, 200.0)], 30)
+
+    # 100 W back to the start, 150 W average in between, 200 W up to the end
+    assert record["energy_wh"] == pytest.approx((1000 + 1500 + 2000) / 3600.0, abs=1e-4)
+    assert record["peak_w"] == 200.0
+    assert record["duration"] == 30.0
+    assert record["average_w"] == 150.0
+
+
+def test_totals_per_file(tmp_path):
+    ledger = PrintEnergyLedger(str(tmp_path / "ledger.json"))
+    first = run_print(ledger, "cube.gcode", 0, [(3600, 100.0)], 3600)
+    second = run_print(ledger, "cube.gcode", 4000, [(7600, 50.0)], 7600, RESULT_CANCELLED)
+
+    job = ledger.get("cube.gcode")
+    assert job["prints"] == 2
+    assert job["energy_wh"] == pytest.approx(first["energy_wh"] + second["energy_wh"])
+    assert [run["result"] for run in job["runs"]] == [RESULT_DONE, RESULT_CANCELLED]
+
+
+def test_runs_are_capped_but_totals_are_not(tmp_path):
+    ledger = PrintEnergyLedger(str(tmp_path / "ledger.json"), max_runs=2)
+    for index in range(5):
+        run_print(ledger, "cube.gcode", index * 100, [(index * 100 + 36, 100.0)], index * 100 + 36)
+    job = ledger.get("cube.gcode")
+    assert job["prints"] == 5
+    assert len(job["runs"]) == 2
+    assert job["energy_wh"] == pytest.approx(5.0)
+
+
+def test_samples_of_other_plugs_are_ignored(tmp_path):
+    ledger = PrintEnergyLedger(str(tmp_path / "ledger.json"))
+    ledger.start("cube.gcode", "cube", "local", "plug", 0)
+    ledger.add_sample("other", 10, 1000.0)
+    assert ledger.finish(RESULT_DONE, 20)["samples"] == 0
+
+
+def test_ledger_is_reloaded(tmp_path):
+    path = str(tmp_path / "ledger.json")
+    run_print(PrintEnergyLedger(path), "cube.gcode", 0, [(36, 100.0)], 36)
+    assert PrintEnergyLedger(path).get("cube.gcode")["prints"] == 1
+
+
+def test_finish_without_a_print(tmp_path):
+    ledger = PrintEnergyLedger(str(tmp_path / "ledger.json"))
+    assert ledger.finish(RESULT_DONE, 10) is None
+    assert ledger.get() == {}
@@ -0,0 +1,78 @@
+# coding=utf-8
+import threading
+
+from octoprint_tapo_p110.actions import PowerActionScheduler, ACTION_TURN_OFF, ACTION_TURN_ON
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_pending_actions_are_persisted(tmp_path):
+    path = str(tmp_path / "actions.json")
+    clock = Clock()
+    scheduler = PowerActionScheduler(path, lambda action: None, clock=clock)
+    off = scheduler.schedule("plug", ACTION_TURN_OFF, 300, reason="print done")
+    scheduler.schedule("plug", ACTION_TURN_ON, 60)
+
+    restored = PowerActionScheduler(path, lambda action: None, clock=clock)
+    assert [(entry.action, entry.due) for entry in restored.list()] == [(ACTION_TURN_ON, 1060.0),
+                                                                         (ACTION_TURN_OFF, 1300.0)]
+    assert restored.list()[1].id == off.id
+    assert restored.list()[1].reason == "print done"
+
+
+def test_cancelled_actions_are_not_restored(tmp_path):
+    path = str(tmp_path / "actions.json")
+    scheduler = PowerActionScheduler(path, lambda action: None)
+    entry = scheduler.schedule("plug", ACTION_TURN_OFF, 300)
+    scheduler.schedule("other", ACTION_TURN_OFF, 300)
+    assert scheduler.cancel(entry.id) is entry
+    assert [e.device for e in scheduler.cancel_matching(device_id="other")] == ["other"]
+    assert PowerActionScheduler(path, lambda action: None).list() == []
+
+
+def test_overdue_actions_run_after_a_restart(tmp_path):
+    path = str(tmp_path / "actions.json")
+    clock = Clock()
+    PowerActionScheduler(path, lambda action: None, clock=clock).schedule("plug", ACTION_TURN_OFF, 60)
+
+    clock.now += 3600  # OctoPrint was down when it fell due
+    ran = threading.Event()
+    executed = []
+
+    def execute(action):
+        executed.append(action)
+        ran.set()
+
+    scheduler = PowerActionScheduler(path, execute, clock=clock)
+    scheduler.start()
+    try:
+        assert ran.wait(5)
+    finally:
+        scheduler.stop()
+    assert [(action.device, action.action) for action in executed] == [("plug", ACTION_TURN_OFF)]
+    # Removed from the file before it ran, so it never runs twice
+    assert PowerActionScheduler(path, lambda action: None, clock=clock).list() == []
+
+
+def test_a_failing_action_does_not_stop_the_scheduler(tmp_path):
+    done = threading.Event()
+
+    def execute(action):
+        if action.action == ACTION_TURN_ON:
+            raise RuntimeError("plug unreachable")
+        done.set()
+
+    scheduler = PowerActionScheduler(str(tmp_path / "actions.json"), execute)
+    scheduler.schedule("plug", ACTION_TURN_ON, 0)
+    scheduler.schedule("plug", ACTION_TURN_OFF, 0.01)
+    scheduler.start()
+    try:
+        assert done.wait(5)
+    finally:
+        scheduler.stop()
@@ -0,0 +1,69 @@
+# coding=utf-8
+from octoprint_tapo_p110.anomaly import (PowerAnomalyDetector, ANOMALY_IDLE_HEATING, ANOMALY_OVERDRAW,
+                                         ANOMALY_POWER_LOSS)
+
+
+def make_detector(**kwargs):
+    raised = []
+    kwargs.setdefault("window", 10.0)
+    return PowerAnomalyDetector(raised.append, **kwargs), raised
+
+
+def feed(detector, start, seconds, watts, step=5, **state):
+    anomalies = []
+    for timestamp in range(start, start + seconds, step):
+        anomalies.extend(detector.update("plug", timestamp, watts, **state))
+    return [anomaly.kind for anomaly in anomalies]
+
+
+def test_overdraw_above_the_heat_up_peak():
+    detector, raised = make_detector(overdraw_time=60.0)
+    feed(detector, 0, 60, 250.0, printing=True, heaters_on=True, heating_up=True)
+    # At temperature the heaters should cycle well below the heat-up peak
+    assert feed(detector, 60, 50, 240.0, printing=True, heaters_on=True) == []
+    assert feed(detector, 110, 60, 240.0, printing=True, heaters_on=True) == [ANOMALY_OVERDRAW]
+    assert [anomaly.kind for anomaly in raised] == [ANOMALY_OVERDRAW]
+
+
+def test_normal_printing_raises_nothing():
+    detector, raised = make_detector(overdraw_time=60.0)
+    feed(detector, 0, 60, 250.0, printing=True, heaters_on=True, heating_up=True)
+    assert feed(detector, 60, 600, 110.0, printing=True, heaters_on=True) == []
+    assert raised == []
+
+
+def test_power_loss_mid_print_is_raised_once():
+    detector, _ = make_detector()
+    feed(detector, 0, 120, 150.0, printing=True, heaters_on=True)
+    assert feed(detector, 120, 30, 0.0, printing=True, heaters_on=True) == [ANOMALY_POWER_LOSS]
+    # Raised again only after power came back in between
+    feed(detector, 150, 120, 150.0, printing=True, heaters_on=True)
+    assert feed(detector, 270, 5, 0.0, printing=True, heaters_on=True) == [ANOMALY_POWER_LOSS]
+
+
+def test_switching_off_after_a_print_is_no_power_loss():
+    detector, _ = make_detector()
+    feed(detector, 0, 120, 150.0, printing=True, heaters_on=True)
+    assert feed(detector, 120, 30, 0.0) == []
+
+
+def test_idle_heating():
+    detector, _ = make_detector(idle_max_power=60.0, idle_time=60.0)
+    assert feed(detector, 0, 60, 200.0) == []
+    assert feed(detector, 60, 10, 200.0) == [ANOMALY_IDLE_HEATING]
+    # A heater target explains the draw
+    assert feed(detector, 70, 120, 200.0, heaters_on=True) == []
+
+
+def test_configured_limit_overrides_the_peak():
+    detector, _ = make_detector(max_power=100.0, overdraw_time=30.0)
+    assert feed(detector, 0, 60, 150.0, printing=True, heaters_on=True) == [ANOMALY_OVERDRAW]
+    assert detector.get_state()["plug"]["limit"] == 100.0
+
+
+def test_reset_keeps_the_heat_up_peak():
+    detector, _ = make_detector()
+    feed(detector, 0, 30, 250.0, printing=True, heaters_on=True, heating_up=True)
+    detector.reset("plug")
+    state = detector.get_state()["plug"]
+    assert (state["peak"], state["samples"]) == (250.0, 0)
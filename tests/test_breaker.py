@@ -0,0 +1,104 @@
+# coding=utf-8
+import pytest
+
+from octoprint_tapo_p110.breaker import (CircuitBreaker, CircuitOpenError, STATE_CONNECTED, STATE_DEGRADED,
+                                         STATE_HALF_OPEN, STATE_OPEN)
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(clock, **kwargs):
+    kwargs.setdefault("failure_threshold", 3)
+    kwargs.setdefault("base_delay", 5.0)
+    kwargs.setdefault("max_delay", 20.0)
+    return CircuitBreaker(jitter=0.0, clock=clock, **kwargs)
+
+
+def test_failures_degrade_then_open():
+    breaker = make_breaker(Clock())
+    breaker.record_failure("timeout")
+    assert breaker.state == STATE_DEGRADED
+    breaker.record_failure("timeout")
+    assert breaker.state == STATE_DEGRADED
+    breaker.record_failure("timeout")
+    assert breaker.state == STATE_OPEN
+
+    with pytest.raises(CircuitOpenError) as raised:
+        breaker.before_call()
+    assert raised.value.retry_in == pytest.approx(5.0)
+    assert "timeout" in str(raised.value)
+
+
+def test_success_closes_and_resets_the_count():
+    breaker = make_breaker(Clock())
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    assert breaker.state == STATE_CONNECTED
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == STATE_DEGRADED
+
+
+def test_half_open_lets_one_probe_through():
+    clock = Clock()
+    breaker = make_breaker(clock, failure_threshold=1)
+    breaker.record_failure()
+
+    clock.now += 5.0
+    breaker.before_call()
+    assert breaker.state == STATE_HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == STATE_CONNECTED
+    breaker.before_call()
+
+
+def test_failed_probe_doubles_the_delay_up_to_the_maximum():
+    clock = Clock()
+    breaker = make_breaker(clock, failure_threshold=1)
+    breaker.record_failure()
+    delays = []
+    for _ in range(4):
+        delays.append(breaker.snapshot()["retry_in"])
+        clock.now += delays[-1]
+        breaker.before_call()
+        breaker.record_failure()
+    assert delays == [5.0, 10.0, 20.0, 20.0]
+    assert breaker.state == STATE_OPEN
+
+
+def test_force_skips_the_backoff():
+    breaker = make_breaker(Clock(), failure_threshold=1)
+    breaker.record_failure()
+    breaker.before_call(force=True)
+    assert breaker.state == STATE_HALF_OPEN
+
+
+def test_stale_probe_is_replaced_after_probe_timeout():
+    clock = Clock()
+    breaker = make_breaker(clock, failure_threshold=1, probe_timeout=60.0)
+    breaker.record_failure()
+    clock.now += 5.0
+    breaker.before_call()
+    clock.now += 60.0
+    breaker.before_call()
+    assert breaker.state == STATE_HALF_OPEN
+
+
+def test_on_change_reports_transitions():
+    changes = []
+    breaker = make_breaker(Clock(), failure_threshold=2)
+    breaker.on_change = lambda snapshot: changes.append(snapshot["state"])
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.reset()
+    assert changes == [STATE_DEGRADED, STATE_OPEN, STATE_CONNECTED]
@@ -0,0 +1,92 @@
+# coding=utf-8
+import logging
+import threading
+import time
+
+import pytest
+
+from octoprint_tapo_p110 import connection, simulator
+from octoprint_tapo_p110.connection import ConnectError
+from octoprint_tapo_p110.device import TapoDevice
+from octoprint_tapo_p110.discovery import Discovery, DiscoveryCache, normalize_mac
+
+logger = logging.getLogger("test")
+
+
+@pytest.fixture
+def responder():
+    with simulator.DiscoveryResponder(port=0) as responder:
+        yield responder
+
+
+def make_discovery(tmp_path, responder, **kwargs):
+    discovery = Discovery(DiscoveryCache(str(tmp_path / "discovery.json")), logger, targets=[responder.address],
+                          **kwargs)
+    # Probing without a key is enough for the simulator
+    discovery._key = ""
+    return discovery
+
+
+def test_resolve_finds_a_plug_by_mac(tmp_path, responder):
+    plug = simulator.SimulatedPlug()
+    responder.add(plug, "127.0.0.1:8081")
+    discovery = make_discovery(tmp_path, responder, timeout=2.0)
+    assert discovery.resolve(plug.mac) == "127.0.0.1:8081"
+    assert discovery.cache.get(plug.mac)["ip"] == "127.0.0.1:8081"
+
+
+def test_missing_plug_is_not_looked_for_again_right_away(tmp_path, responder):
+    discovery = make_discovery(tmp_path, responder, timeout=0.2)
+    assert discovery.resolve("AA:BB:CC:DD:EE:FF") is None
+    probes = responder.probes
+    assert discovery.resolve("AA:BB:CC:DD:EE:FF") is None
+    assert responder.probes == probes
+
+
+def test_cached_lookups_do_not_wait_for_a_scan(tmp_path, responder):
+    discovery = make_discovery(tmp_path, responder, timeout=1.0)
+    discovery.cache.update([dict(mac="AA:BB:CC:DD:EE:01", ip="10.0.0.1")])
+    scan = threading.Thread(target=discovery.resolve, args=("AA:BB:CC:DD:EE:02",))
+    scan.start()
+    while not discovery._scanning:
+        time.sleep(0.01)
+    start = time.monotonic()
+    assert discovery.resolve("AA:BB:CC:DD:EE:01") == "10.0.0.1"
+    assert time.monotonic() - start < 0.5
+    scan.join(5)
+
+
+def test_probe_key_is_kept_across_restarts(tmp_path):
+    pytest.importorskip("Crypto")
+    path = str(tmp_path / "discovery_key.pem")
+    cache = DiscoveryCache(str(tmp_path / "discovery.json"))
+    key = Discovery(cache, logger, key_path=path)._probe_key()
+    assert key.startswith("-----BEGIN PUBLIC KEY-----")
+    assert Discovery(cache, logger, key_path=path)._probe_key() == key
+
+
+def test_moved_plug_is_looked_up_without_holding_the_connection_lock(monkeypatch):
+    plug = simulator.SimulatedPlug(device_on=True)
+
+    def probe(host, port=connection.TAPO_PORT, timeout=1.5):
+        if host != "new":
+            raise ConnectError(f"{host}:{port} is unreachable")
+        return 0.001
+
+    monkeypatch.setattr(connection, "probe", probe)
+    client_class = simulator.client_class(plug)
+    device = TapoDevice("plug", "Plug", "old", simulator.DEFAULT_EMAIL, simulator.DEFAULT_PASSWORD,
+                        lambda: client_class, logger, mac=normalize_mac(plug.mac))
+    lock_free = []
+
+    def resolve(mac, timeout):
+        lock_free.append(device.connection_lock.acquire(blocking=False))
+        if lock_free[-1]:
+            device.connection_lock.release()
+        assert 0 < timeout <= device.connector.deadline
+        return "new"
+
+    device.resolve_address = resolve
+    assert device.connect()
+    assert device.ip == "new"
+    assert lock_free == [True]
@@ -0,0 +1,124 @@
+# coding=utf-8
+import threading
+import time
+
+from octoprint_tapo_p110.dispatcher import DeviceDispatcher
+
+
+def start(target):
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread
+
+
+def hold(dispatcher):
+    """Keep the dispatcher busy until the returned event is set"""
+    release, running = threading.Event(), threading.Event()
+
+    def blocker():
+        running.set()
+        release.wait(5)
+
+    thread = start(lambda: dispatcher.write(blocker))
+    running.wait(5)
+    return release, thread
+
+
+def wait_queued(dispatcher, count):
+    for _ in range(500):
+        if dispatcher.get_stats()["queued"] >= count:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"{count} calls never queued")
+
+
+def test_identical_reads_share_one_call():
+    dispatcher = DeviceDispatcher()
+    release, blocker = hold(dispatcher)
+    calls, results = [], []
+
+    def read():
+        calls.append(1)
+        return {"device_on": True}
+
+    readers = [start(lambda: results.append(dispatcher.read("info", read))) for _ in range(5)]
+    wait_queued(dispatcher, 1)
+    release.set()
+    for thread in readers + [blocker]:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == [{"device_on": True}] * 5
+    assert dispatcher.get_stats()["coalesced"] == 4
+
+
+def test_coalesced_readers_share_the_exception():
+    dispatcher = DeviceDispatcher()
+    release, blocker = hold(dispatcher)
+    errors = []
+
+    def read():
+        raise KeyError("result")
+
+    def reader():
+        try:
+            dispatcher.read("info", read)
+        except KeyError as e:
+            errors.append(e)
+
+    readers = [start(reader) for _ in range(3)]
+    wait_queued(dispatcher, 1)
+    release.set()
+    for thread in readers + [blocker]:
+        thread.join(5)
+
+    assert len(errors) == 3
+    assert errors[0] is errors[1] is errors[2]
+
+
+def test_calls_run_in_submission_order():
+    dispatcher = DeviceDispatcher()
+    release, blocker = hold(dispatcher)
+    order = []
+    threads = []
+    for index in range(5):
+        threads.append(start(lambda index=index: dispatcher.write(lambda: order.append(index))))
+        wait_queued(dispatcher, index + 1)
+    release.set()
+    for thread in threads + [blocker]:
+        thread.join(5)
+    assert order == [0, 1, 2, 3, 4]
+
+
+def test_read_after_write_is_not_coalesced_with_an_earlier_read():
+    dispatcher = DeviceDispatcher()
+    release, blocker = hold(dispatcher)
+    state = {"on": False}
+    results = []
+
+    before = start(lambda: results.append(("before", dispatcher.read("info", lambda: state["on"]))))
+    wait_queued(dispatcher, 1)
+    write = start(lambda: dispatcher.write(lambda: state.update(on=True)))
+    wait_queued(dispatcher, 2)
+    after = start(lambda: results.append(("after", dispatcher.read("info", lambda: state["on"]))))
+    wait_queued(dispatcher, 3)
+    release.set()
+    for thread in (before, write, after, blocker):
+        thread.join(5)
+
+    assert sorted(results) == [("after", True), ("before", False)]
+
+
+def test_urgent_write_skips_the_queue():
+    dispatcher = DeviceDispatcher()
+    release, blocker = hold(dispatcher)
+    order = []
+    queued = start(lambda: dispatcher.write(lambda: order.append("queued")))
+    wait_queued(dispatcher, 1)
+    urgent = start(lambda: dispatcher.write(lambda: order.append("urgent"), urgent=True))
+    while not dispatcher._urgent:
+        time.sleep(0.01)
+    release.set()
+    for thread in (queued, urgent, blocker):
+        thread.join(5)
+    assert order == ["urgent", "queued"]
@@ -0,0 +1,35 @@
+# coding=utf-8
+import threading
+
+from octoprint_tapo_p110.jobs import JobManager, JOB_DONE, JOB_FAILED
+
+
+def run(func):
+    finished = threading.Event()
+    manager = JobManager(on_update=lambda job: job.done and finished.set())
+    job = manager.submit("turn_on", "plug", func)
+    assert finished.wait(5)
+    manager.shutdown()
+    return job
+
+
+def test_result_becomes_the_job_result():
+    job = run(lambda: dict(device="plug", success=True))
+    assert job.status == JOB_DONE
+    assert job.result == dict(device="plug", success=True)
+    assert job.error is None
+
+
+def test_unsuccessful_result_fails_the_job():
+    job = run(lambda: dict(device="plug", success=False, error="Device unreachable"))
+    assert job.status == JOB_FAILED
+    assert job.error == "Device unreachable"
+    assert job.result["success"] is False
+
+
+def test_exception_fails_the_job():
+    def fail():
+        raise RuntimeError("boom")
+
+    job = run(fail)
+    assert (job.status, job.error) == (JOB_FAILED, "boom")
@@ -0,0 +1,75 @@
+# coding=utf-8
+import pytest
+
+from octoprint_tapo_p110.rollup import PowerRollups
+
+DAY = 86400
+
+
+def fill(rollups, start, seconds, watts, step=10):
+    for timestamp in range(start, start + seconds, step):
+        rollups.add(timestamp, watts)
+
+
+def test_minute_buckets_aggregate_samples(tmp_path):
+    rollups = PowerRollups(str(tmp_path))
+    for timestamp, watts in ((0, 100.0), (20, 200.0), (40, 300.0), (60, 100.0)):
+        rollups.add(timestamp, watts)
+
+    buckets, resolution = rollups.query(0, 120, 60)
+    assert resolution == 60
+    first = buckets[0]
+    assert (first["start"], first["samples"], first["min"], first["max"], first["avg"]) == (0, 3, 100.0, 300.0, 200.0)
+    # Trapezoids: 150 W and 250 W for 20 s each
+    assert first["energy_wh"] == pytest.approx((150 * 20 + 250 * 20) / 3600.0, abs=1e-4)
+
+
+def test_energy_is_the_same_at_every_resolution(tmp_path):
+    rollups = PowerRollups(str(tmp_path))
+    fill(rollups, 0, 2 * DAY, 120.0)
+    rollups.close()
+
+    totals = {}
+    for resolution in (60, 3600, DAY):
+        buckets, used = rollups.query(0, 2 * DAY, resolution)
+        assert used == resolution
+        totals[resolution] = sum(bucket["energy_wh"] for bucket in buckets)
+    expected = 120.0 * (2 * DAY - 10) / 3600.0
+    for total in totals.values():
+        assert total == pytest.approx(expected, rel=1e-4)
+
+
+def test_query_includes_data_not_yet_written(tmp_path):
+    rollups = PowerRollups(str(tmp_path))
+    fill(rollups, 0, 600, 50.0)
+    buckets, _ = rollups.query(0, 3600, 3600)
+    assert buckets[0]["samples"] == 60
+
+
+def test_gaps_longer_than_max_gap_hold_no_energy(tmp_path):
+    rollups = PowerRollups(str(tmp_path), max_gap=60)
+    rollups.add(0, 100.0)
+    rollups.add(3600, 100.0)
+    buckets, _ = rollups.query(0, 7200, 3600)
+    assert sum(bucket["energy_wh"] for bucket in buckets) == 0.0
+
+
+def test_buckets_survive_a_restart(tmp_path):
+    rollups = PowerRollups(str(tmp_path))
+    fill(rollups, 0, 1800, 80.0)
+    rollups.close()
+    restarted = PowerRollups(str(tmp_path))
+    fill(restarted, 1800, 1800, 80.0)
+
+    buckets, _ = restarted.query(0, 3600, 3600)
+    assert len(buckets) == 1
+    assert buckets[0]["samples"] == 360
+
+
+def test_prune_drops_old_minutes(tmp_path):
+    rollups = PowerRollups(str(tmp_path))
+    fill(rollups, 0, 2 * DAY, 10.0, step=60)
+    rollups.flush()
+    rollups.prune(DAY)
+    assert rollups.query(0, DAY, 60)[0] == []
+    assert rollups.query(DAY, 2 * DAY, 60)[0]
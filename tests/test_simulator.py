@@ -0,0 +1,114 @@
+# coding=utf-8
+import logging
+
+import pytest
+
+from octoprint_tapo_p110 import connection, simulator
+from octoprint_tapo_p110.breaker import STATE_CONNECTED, STATE_DEGRADED
+from octoprint_tapo_p110.device import TapoDevice
+
+
+@pytest.fixture
+def plug():
+    return simulator.SimulatedPlug(device_on=True, power_curve=simulator.constant_curve(120.0))
+
+
+@pytest.fixture
+def device(plug, monkeypatch):
+    # The in-process client needs no network, only the reachability probe would
+    monkeypatch.setattr(connection, "probe", lambda *args, **kwargs: 0.001)
+    client_class = simulator.client_class(plug)
+    return TapoDevice("plug", "Plug", "simulated", simulator.DEFAULT_EMAIL, simulator.DEFAULT_PASSWORD,
+                      lambda: client_class, logging.getLogger("test"))
+
+
+def test_status_and_energy(device, plug):
+    status = device.read_status()
+    assert status["device_on"] is True
+    assert status["mac"] == plug.mac
+    assert device.read_energy()["current_power"] == 120000
+
+
+def test_snapshot_is_one_batched_request(device, plug):
+    device.connect()
+    plug.requests.clear()
+    snapshot = device.read_snapshot()
+    assert snapshot["batched"] is True
+    assert snapshot["current_power"] == 120
+    assert dict(plug.requests) == {"multipleRequest": 1}
+
+
+def test_switching(device, plug):
+    assert device.turn_off()
+    assert plug.device_on is False
+    assert device.turn_on()
+    assert plug.device_on is True
+
+
+def test_wrong_password_fails(plug, monkeypatch):
+    monkeypatch.setattr(connection, "probe", lambda *args, **kwargs: 0.001)
+    client_class = simulator.client_class(plug)
+    device = TapoDevice("plug", "Plug", "simulated", simulator.DEFAULT_EMAIL, "wrong",
+                        lambda: client_class, logging.getLogger("test"))
+    assert not device.connect()
+    assert "-1501" in device.last_error
+
+
+def test_malformed_response_drops_the_session(device, plug):
+    device.connect()
+    plug.inject(simulator.FAULT_MALFORMED, method="get_device_info")
+    assert device.read_status() is None
+    assert device.client is None
+    assert device.breaker.state == STATE_DEGRADED
+    assert device.read_status()["device_on"] is True
+    assert device.breaker.state == STATE_CONNECTED
+
+
+def test_expired_session_reconnects(device, plug):
+    device.connect()
+    plug.inject(simulator.FAULT_SESSION_EXPIRED, method="set_device_info")
+    assert not device.turn_off()
+    sessions = device._sessions
+    assert device.turn_off()
+    assert plug.device_on is False
+    assert device._sessions == sessions + 1
+
+
+def test_power_curve_is_integrated():
+    clock = [0.0]
+    plug = simulator.SimulatedPlug(device_on=True, power_curve=simulator.constant_curve(100.0),
+                                   clock=lambda: clock[0])
+    clock[0] = 3600.0
+    energy = plug.energy_usage()
+    assert energy["today_energy"] == 100
+    assert energy["today_runtime"] == 60
+
+
+def test_http_server_speaks_the_pyp100_protocol(plug):
+    pytest.importorskip("Crypto")
+    PyP110 = pytest.importorskip("PyP100.PyP110")
+    with simulator.SimulatorServer(plug) as server:
+        client = PyP110.P110(server.address, simulator.DEFAULT_EMAIL, simulator.DEFAULT_PASSWORD)
+        client.handshake()
+        client.login()
+        info = client.getDeviceInfo()
+        # Older PyP100 versions hand back the whole envelope
+        assert info.get("result", info)["device_on"] is True
+        client.turnOff()
+        assert plug.device_on is False
+
+        server.expire_sessions()
+        with pytest.raises(Exception):
+            client.getDeviceInfo()
+
+
+def test_energy_failure_in_separate_reads_keeps_the_status(device, plug):
+    device.connect()
+    device.batch_supported = False
+    client = device.client
+    plug.inject(simulator.FAULT_ERROR, -1, method="get_energy_usage")
+    snapshot = device.read_snapshot()
+    assert snapshot["status"]["device_on"] is True
+    assert snapshot["energy"] is None
+    assert device.client is client
+    assert device.breaker.state == STATE_DEGRADED
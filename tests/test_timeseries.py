@@ -0,0 +1,19 @@
+# coding=utf-8
+import time
+
+from octoprint_tapo_p110.timeseries import PowerStore
+
+DAY = 86400
+
+
+def test_new_retention_applies_to_an_open_store(tmp_path):
+    store = PowerStore(str(tmp_path), flush_interval=0)
+    now = time.time()
+    store.append(now - 10 * DAY, 100.0)
+    assert len(store._segments()) == 1
+
+    store.configure(raw_days=2, retention_days=5)
+    # The maintenance runs again with the next sample instead of an hour later
+    store.append(now, 100.0)
+    assert [day for day, path in store._segments()] == [int(now) - int(now) % DAY]
+    store.close()